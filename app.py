@@ -5,13 +5,17 @@ Interactive Streamlit UI for exploring normalized transaction data.
 """
 
 import streamlit as st
-import pandas as pd
 import plotly.express as px
 import plotly.graph_objects as go
 from plotly.subplots import make_subplots
-import boto3
-from io import BytesIO
-import pyarrow.parquet as pq
+from fx_data import (
+    CORE_COLUMNS, STREAMING, dataset_columns, dataset_partitions, format_ids, get_dataset_cache,
+    get_derived_cache, get_disk_cache, get_filter_index, get_frame_store, load_dataset, memory_report,
+    narrowed_range
+)
+from fx_aggregates import AGGREGATE_WORKERS, GRANULARITIES, get_view_cache, stream_rollups, streamed_cube, view_rollups
+from fx_anomalies import ANOMALY_LABELS, ANOMALY_THRESHOLD, SEVERE_THRESHOLD, window_label
+from fx_backends import get_backend
 
 # Page configuration
 st.set_page_config(
@@ -355,103 +359,65 @@ CURRENCY_SYMBOLS = {
     "CAD": "C$", "AUD": "A$", "CHF": "Fr", "CNY": "¥", "SGD": "S$"
 }
 
-@st.cache_data(ttl=300)
-def load_data_from_s3():
-    """Load normalized data from S3 parquet files."""
+def load_data_from_s3(currencies=None, date_range=None, columns=CORE_COLUMNS):
+    """Load normalized data from S3 parquet files.
+
+    Goes through the shared fx_data cache, so dashboard.py running in the
+    same process reuses the same frame. `currencies` and `date_range`
+    restrict the download to the matching partitions; only `columns` are
+    decoded.
+    """
     try:
-        s3 = boto3.client('s3', region_name='us-east-2')
-        bucket = 'apoorv-financial-pipeline-2025'
-        prefix = 'output/normalized/'
-        
-        paginator = s3.get_paginator('list_objects_v2')
-        
-        dfs = []
-        for page in paginator.paginate(Bucket=bucket, Prefix=prefix):
-            if 'Contents' not in page:
-                continue
-            for obj in page['Contents']:
-                key = obj['Key']
-                if key.endswith('.parquet'):
-                    currency = None
-                    if 'currency=' in key:
-                        currency = key.split('currency=')[1].split('/')[0]
-                    
-                    obj_response = s3.get_object(Bucket=bucket, Key=key)
-                    df = pd.read_parquet(BytesIO(obj_response['Body'].read()))
-                    
-                    if currency and 'currency' not in df.columns:
-                        df['currency'] = currency
-                    
-                    dfs.append(df)
-        
-        if dfs:
-            combined = pd.concat(dfs, ignore_index=True)
-            if 'currency' not in combined.columns:
-                st.warning("Currency column missing from S3 data")
-                return None
-            return combined
+        return load_dataset('s3', currencies, date_range, columns)
+    except ValueError as e:
+        st.warning(str(e))
         return None
     except Exception as e:
         st.error(f"Error loading from S3: {e}")
         return None
 
-@st.cache_data
-def load_sample_data():
-    """Load sample data for local testing."""
+def load_s3_partitions():
+    """List the currency/date partitions in S3 without downloading data."""
     try:
-        return pd.read_parquet("sample_normalized.parquet")
-    except:
-        import numpy as np
-        np.random.seed(42)
-        
-        dates = pd.date_range('2025-09-01', periods=90, freq='D')
-        currencies = ['USD', 'EUR', 'GBP', 'INR', 'JPY', 'CAD', 'AUD', 'CHF', 'CNY', 'SGD']
-        product_types = ['ECOM', 'RETAIL', 'SUBSCRIPTION', 'TRAVEL', 'FOREX', 'REMITTANCE', 'INVESTMENT']
-        channels = ['ONLINE', 'POS', 'MOBILE', 'ATM', 'WIRE']
-        
-        n = 5000
-        data = {
-            'txn_id': [f'TXN{str(i).zfill(7)}' for i in range(n)],
-            'customer_id': [f'C{str(np.random.randint(1, 500)).zfill(5)}' for _ in range(n)],
-            'txn_date': np.random.choice(dates, n),
-            'amount': np.random.exponential(1000, n),
-            'currency': np.random.choice(currencies, n, p=[0.3, 0.2, 0.15, 0.1, 0.08, 0.05, 0.04, 0.03, 0.03, 0.02]),
-            'product_type': np.random.choice(product_types, n),
-            'channel': np.random.choice(channels, n),
-            'merchant_country': np.random.choice(['US', 'UK', 'DE', 'FR', 'IN', 'JP', 'CA', 'AU'], n),
-        }
-        
-        df = pd.DataFrame(data)
-        
-        fx_rates = {'USD': 1.0, 'EUR': 1.08, 'GBP': 1.27, 'INR': 0.012, 'JPY': 0.0067,
-                    'CAD': 0.74, 'AUD': 0.65, 'CHF': 1.13, 'CNY': 0.14, 'SGD': 0.74}
-        df['fx_rate'] = df['currency'].map(fx_rates)
-        df['amount_usd'] = df['amount'] * df['fx_rate']
-        df['base_currency'] = 'USD'
-        
-        return df
+        return dataset_partitions()
+    except Exception as e:
+        st.error(f"Error listing S3 partitions: {e}")
+        return None
+
+def load_sample_data(columns=CORE_COLUMNS):
+    """Load sample data for local testing (only the requested columns)."""
+    return load_dataset('sample', columns=columns)
+
+def load_streamed_cells(stream_source):
+    """Cube cells of a source, aggregated batch by batch without loading its rows."""
+    try:
+        return streamed_cube(stream_source).cells
+    except Exception as e:
+        st.error(f"Error streaming data: {e}")
+        return None
 
-def generate_executive_summary(df):
-    """Generate AI-style executive summary."""
-    total_volume = df['amount_usd'].sum()
-    total_txn = len(df)
-    avg_txn = df['amount_usd'].mean()
-    unique_customers = df['customer_id'].nunique()
+def generate_executive_summary(agg):
+    """Generate AI-style executive summary from the precomputed rollups."""
+    total_volume = agg.volume
+    total_txn = agg.count
+    unique_customers = agg.customers
     
     # Top currency
-    top_currency = df.groupby('currency')['amount_usd'].sum().idxmax()
-    top_currency_pct = (df.groupby('currency')['amount_usd'].sum().max() / total_volume * 100)
+    currency_volume = agg.volume_by('currency')
+    top_currency = currency_volume.idxmax()
+    top_currency_pct = (currency_volume.max() / total_volume * 100)
     
     # Top product
-    if 'product_type' in df.columns:
-        top_product = df.groupby('product_type')['amount_usd'].sum().idxmax()
-        top_product_pct = (df.groupby('product_type')['amount_usd'].sum().max() / total_volume * 100)
+    if agg.has('product_type'):
+        product_volume = agg.volume_by('product_type')
+        top_product = product_volume.idxmax()
+        top_product_pct = (product_volume.max() / total_volume * 100)
     else:
         top_product = "N/A"
         top_product_pct = 0
     
     # Currency concentration risk
-    currency_concentration = df.groupby('currency')['amount_usd'].sum() / total_volume * 100
+    currency_concentration = currency_volume / total_volume * 100
     high_concentration = currency_concentration[currency_concentration > 25].to_dict()
     
     summary = f"""
@@ -459,8 +425,8 @@ def generate_executive_summary(df):
     <h3>📊 Executive Intelligence Summary</h3>
     <p>
     <strong>Overview:</strong> Processed <strong>{total_txn:,}</strong> transactions worth 
-    <strong>${total_volume:,.0f}</strong> across <strong>{df['currency'].nunique()}</strong> currencies 
-    from <strong>{unique_customers:,}</strong> unique customers.<br><br>
+    <strong>${total_volume:,.0f}</strong> across <strong>{len(currency_volume)}</strong> currencies 
+    from <strong>{'' if agg.customers_exact else '≈'}{unique_customers:,}</strong> unique customers.<br><br>
     
     <strong>Key Finding:</strong> <strong>{top_currency}</strong> dominates with <strong>{top_currency_pct:.1f}%</strong> 
     of total volume. <strong>{top_product}</strong> is the highest-value product category 
@@ -472,20 +438,30 @@ def generate_executive_summary(df):
     """
     return summary
 
-def detect_anomalies(df):
-    """Detect anomalous transactions."""
-    # Define thresholds
-    high_value_threshold = 50000  # $50K
-    very_high_threshold = 100000  # $100K
-    
+def detect_anomalies(agg):
+    """Anomaly counts: amounts far from their currency x product peers."""
+    groups = agg.anomaly_groups
+    most_flagged = None
+    if groups is not None and {'currency', 'product_type'} <= set(groups.columns):
+        most_flagged = ", ".join(f"{g.currency} {g.product_type} ({g.flagged})" for g in groups.head(3).itertuples())
+    top_bursts = None
+    if agg.top_bursts is not None:
+        top_bursts = ", ".join(f"{b.customer_id} ({b.window_txns})" for b in agg.top_bursts.head(3).itertuples())
     anomalies = {
-        'high_value': len(df[df['amount_usd'] > high_value_threshold]),
-        'very_high': len(df[df['amount_usd'] > very_high_threshold]),
-        'total': len(df)
+        'flagged': agg.anomalies,
+        'severe': agg.severe_anomalies,
+        'method': ANOMALY_LABELS.get(agg.anomaly_method, "robust z"),
+        'rate': agg.anomaly_rate(),
+        'most_flagged': most_flagged,
+        'burst_customers': agg.burst_customers,
+        'burst_transactions': agg.burst_transactions,
+        'burst_window': agg.burst_window or window_label(),
+        'top_bursts': top_bursts,
+        'total': agg.count
     }
     
     # Get top 5 highest transactions
-    top_5 = df.nlargest(5, 'amount_usd')[['txn_id', 'amount_usd', 'currency', 'product_type']].to_dict('records') if 'product_type' in df.columns else df.nlargest(5, 'amount_usd')[['txn_id', 'amount_usd', 'currency']].to_dict('records')
+    top_5 = agg.top_transactions()
     
     return anomalies, top_5
 
@@ -506,16 +482,50 @@ def main():
             ["Sample Data (Local)", "S3 (Production)"],
             index=0
         )
+        prune_s3 = False
+        if data_source == "S3 (Production)":
+            prune_s3 = st.checkbox(
+                "⚡ Load selected partitions only",
+                value=True,
+                help="Only download the currency/date partitions matching the filters"
+            )
+        streaming = st.checkbox(
+            "🌊 Streaming mode",
+            value=STREAMING,
+            help="Aggregate the data in batches instead of loading it - for histories larger than memory"
+        )
         st.markdown("---")
         with st.expander("📋 Data Info"):
             st.write("Loading...")
     
     # Load data
+    partitions = None
+    s3_filter = {}
     with st.spinner("Loading data..."):
-        if data_source == "S3 (Production)":
-            df = load_data_from_s3()
+        if streaming:
+            # Only the streamed cube cells are held - enough for filter options and date bounds
+            df = load_streamed_cells('s3' if data_source == "S3 (Production)" else 'sample')
+            if df is None and data_source == "S3 (Production)":
+                st.warning("Could not stream data from S3. Using sample data instead.")
+                data_source = "Sample Data (Local)"
+                df = load_streamed_cells('sample')
+        elif data_source == "S3 (Production)":
+            if prune_s3:
+                partitions = load_s3_partitions()
+            if partitions:
+                # Filters are rendered below, so use their last values from session state
+                picked_currency = st.session_state.get("selected_currency", "All Currencies")
+                picked_dates = st.session_state.get("date_range") if partitions['date_bounds'] else None
+                s3_filter = {
+                    'currencies': None if picked_currency == "All Currencies" else (picked_currency,),
+                    # Only a range narrower than the partitions is pushed down; otherwise the
+                    # loaded dataset is cut by the filter index below
+                    'date_range': narrowed_range(picked_dates, partitions['date_bounds'])
+                }
+            df = load_data_from_s3(**s3_filter)
             if df is None:
                 st.warning("Could not load data from S3. Using sample data instead.")
+                data_source = "Sample Data (Local)"
                 df = load_sample_data()
         else:
             df = load_sample_data()
@@ -524,23 +534,38 @@ def main():
         st.error("No data available. Please check your data source.")
         return
     
+    # All source columns - the ones not loaded yet are fetched on demand for the table
+    if data_source == "S3 (Production)":
+        source_columns = dataset_columns('s3') or list(df.columns)
+    else:
+        source_columns = dataset_columns('sample') or list(df.columns)
+    loaded_rows = len(df)
+    
     # Update sidebar info
     with st.sidebar:
         with st.expander("📋 Data Info", expanded=False):
-            st.write(f"Rows: {len(df):,}")
+            st.write(f"{'Cube cells' if streaming else 'Rows'}: {len(df):,}")
             st.write(f"Columns: {list(df.columns)}")
+            if data_source == "S3 (Production)" and get_frame_store().last_refresh:
+                st.write(f"Last S3 refresh: {get_frame_store().last_refresh}")
+            if data_source == "S3 (Production)" and get_disk_cache():
+                st.write(f"Disk cache: {get_disk_cache().hits} hits / {get_disk_cache().misses} misses")
+            st.write(f"Shared dataset cache: {get_dataset_cache().hits} hits / {get_dataset_cache().misses} misses")
+            st.write(f"Derived structures cache: {get_derived_cache().hits} hits / {get_derived_cache().misses} misses")
+            st.write(f"Query backend: {get_backend().name}")
+            if streaming:
+                st.write(f"Aggregation workers: {AGGREGATE_WORKERS}")
+            view_cache_info = st.empty()  # filled in once this view has been looked up
+            st.caption("Memory per column (bytes)")
+            st.dataframe(memory_report(df), use_container_width=True)
     
     # Ensure required columns exist
-    required_cols = ['currency', 'amount_usd']
+    required_cols = ['currency'] if streaming else ['currency', 'amount_usd']
     missing = [c for c in required_cols if c not in df.columns]
     if missing:
         st.error(f"Missing required columns: {missing}. Available: {list(df.columns)}")
         return
     
-    # Convert date columns
-    if 'txn_date' in df.columns:
-        df['txn_date'] = pd.to_datetime(df['txn_date'])
-    
     # FILTERS ROW - Above KPIs (Compact Dropdowns)
     st.markdown("""
     <div class="filter-box">
@@ -549,58 +574,88 @@ def main():
     """, unsafe_allow_html=True)
     
     filter_col1, filter_col2, filter_col3, filter_col4 = st.columns(4)
+    dataset = df
+    filter_index = get_filter_index(dataset)
+    applied_dates = None
     
     with filter_col1:
         if 'txn_date' in df.columns:
-            min_date = df['txn_date'].min()
-            max_date = df['txn_date'].max()
+            if partitions and partitions['date_bounds']:
+                min_date, max_date = partitions['date_bounds']
+            else:
+                min_date = df['txn_date'].min()
+                max_date = df['txn_date'].max()
             date_range = st.date_input(
                 "📅 Date Range",
                 value=(min_date, max_date),
                 min_value=min_date,
-                max_value=max_date
+                max_value=max_date,
+                key="date_range"
             )
             if len(date_range) == 2:
-                df = df[(df['txn_date'] >= pd.Timestamp(date_range[0])) & 
-                       (df['txn_date'] <= pd.Timestamp(date_range[1]))]
+                applied_dates = date_range
+    
+    # Filters are collected here and evaluated once on the filter index below
+    filters = {}
     
     with filter_col2:
-        all_currencies = ["All Currencies"] + sorted(df['currency'].unique().tolist())
-        selected_currency = st.selectbox("💱 Currency", all_currencies, index=0)
+        if partitions and partitions['currencies']:
+            all_currencies = ["All Currencies"] + partitions['currencies']
+        else:
+            all_currencies = ["All Currencies"] + filter_index.distinct(dataset, 'currency', applied_dates)
+        selected_currency = st.selectbox("💱 Currency", all_currencies, index=0, key="selected_currency")
         if selected_currency != "All Currencies":
-            df = df[df['currency'] == selected_currency]
+            filters['currency'] = selected_currency
     
     with filter_col3:
         if 'product_type' in df.columns:
-            all_products = ["All Products"] + sorted(df['product_type'].unique().tolist())
+            all_products = ["All Products"] + filter_index.distinct(dataset, 'product_type', applied_dates, **filters)
             selected_product = st.selectbox("📦 Product Type", all_products, index=0)
             if selected_product != "All Products":
-                df = df[df['product_type'] == selected_product]
+                filters['product_type'] = selected_product
     
     with filter_col4:
         if 'channel' in df.columns:
-            all_channels = ["All Channels"] + sorted(df['channel'].unique().tolist())
+            all_channels = ["All Channels"] + filter_index.distinct(dataset, 'channel', applied_dates, **filters)
             selected_channel = st.selectbox("📱 Channel", all_channels, index=0)
             if selected_channel != "All Channels":
-                df = df[df['channel'] == selected_channel]
+                filters['channel'] = selected_channel
+    
+    if streaming:
+        # One batched pass over the matching partitions; df is only a preview of the rows
+        agg = stream_rollups('s3' if data_source == "S3 (Production)" else 'sample', applied_dates, **filters)
+        df = agg.preview if agg.preview is not None else dataset.iloc[:0]
+    else:
+        # Only the rows the table shows are materialized; the CSV export selects the rest on demand
+        df = filter_index.head(dataset, 100, applied_dates, **filters)
+        # All panels below read from the dataset's cube, sliced by the same filters.
+        # Views already seen come straight from the LRU view cache.
+        agg = view_rollups(dataset, applied_dates, backend=get_backend(), **filters)
     
-    st.markdown(f"<p style='text-align: right; color: #64748b; margin-top: -10px; font-family: JetBrains Mono, monospace;'>📊 Showing <strong style='color: #d4af37;'>{len(df):,}</strong> transactions</p>", unsafe_allow_html=True)
+    st.markdown(f"<p style='text-align: right; color: #64748b; margin-top: -10px; font-family: JetBrains Mono, monospace;'>📊 Showing <strong style='color: #d4af37;'>{agg.count:,}</strong> transactions</p>", unsafe_allow_html=True)
+    
+    stats = get_view_cache().stats()
+    view_cache_info.write(f"View cache: {stats['hits']} hits / {stats['misses']} misses / "
+                          f"{stats['evictions']} evictions ({stats['bytes'] / 1024 / 1024:.1f} MB)")
     
     # Executive Summary & Anomaly Detection Row
     col1, col2 = st.columns([2, 1])
     
     with col1:
-        st.markdown(generate_executive_summary(df), unsafe_allow_html=True)
+        st.markdown(generate_executive_summary(agg), unsafe_allow_html=True)
     
     with col2:
-        anomalies, top_5 = detect_anomalies(df)
+        anomalies, top_5 = detect_anomalies(agg)
         st.markdown(f"""
         <div class="anomaly-box">
         <h3>🚨 Anomaly Detection</h3>
         <p>
-        <strong>High-Value Transactions (>${"50K"}):</strong> {anomalies['high_value']:,}<br>
-        <strong>Very High (>${"100K"}):</strong> {anomalies['very_high']:,}<br>
-        <strong>Anomaly Rate:</strong> {anomalies['high_value']/anomalies['total']*100:.1f}%
+        <strong>Anomalies ({anomalies['method']} &gt; {ANOMALY_THRESHOLD:g}):</strong> {f"{anomalies['flagged']:,}" if anomalies['flagged'] is not None else "n/a"}<br>
+        <strong>Severe ({anomalies['method']} &gt; {SEVERE_THRESHOLD:g}):</strong> {f"{anomalies['severe']:,}" if anomalies['severe'] is not None else "n/a"}<br>
+        <strong>Anomaly Rate:</strong> {f"{anomalies['rate']:.1f}%" if anomalies['rate'] is not None else "n/a"}<br>
+        <strong>Most Flagged:</strong> {anomalies['most_flagged'] or "none"}<br>
+        <strong>Velocity Bursts ({anomalies['burst_window']}):</strong> {f"{anomalies['burst_customers']:,} customers, {anomalies['burst_transactions']:,} txns" if anomalies['burst_customers'] is not None else "n/a"}<br>
+        <strong>Fastest:</strong> {anomalies['top_bursts'] or "none"}
         </p>
         </div>
         """, unsafe_allow_html=True)
@@ -611,20 +666,20 @@ def main():
     col1, col2, col3, col4 = st.columns(4)
     
     with col1:
-        total_txn = len(df)
+        total_txn = agg.count
         st.metric("Total Transactions", f"{total_txn:,}")
     
     with col2:
-        total_usd = df['amount_usd'].sum()
+        total_usd = agg.volume
         st.metric("Total Volume (USD)", f"${total_usd:,.2f}")
     
     with col3:
-        avg_usd = df['amount_usd'].mean()
+        avg_usd = agg.average
         st.metric("Avg Transaction (USD)", f"${avg_usd:,.2f}")
     
     with col4:
-        unique_customers = df['customer_id'].nunique()
-        st.metric("Unique Customers", f"{unique_customers:,}")
+        unique_customers = agg.customers
+        st.metric("Unique Customers", f"{'' if agg.customers_exact else '≈'}{unique_customers:,}")
     
     st.markdown("---")
     
@@ -633,7 +688,7 @@ def main():
     
     with col1:
         st.subheader("📊 Transaction Volume by Currency")
-        currency_volume = df.groupby('currency')['amount_usd'].sum().sort_values(ascending=True)
+        currency_volume = agg.volume_by('currency').sort_values(ascending=True)
         
         fig = px.bar(
             x=currency_volume.values,
@@ -657,7 +712,7 @@ def main():
     
     with col2:
         st.subheader("🥧 Transaction Count by Currency")
-        currency_count = df.groupby('currency').size()
+        currency_count = agg.count_by('currency')
         dark_gold_palette = ['#d4af37', '#00d4ff', '#10b981', '#f43f5e', '#a855f7', '#f59e0b', '#06b6d4', '#ec4899', '#84cc16', '#6366f1']
         
         fig = px.pie(
@@ -677,13 +732,24 @@ def main():
         fig.update_traces(textfont=dict(color='#f8fafc'))
         st.plotly_chart(fig, use_container_width=True)
     
+    # Trend granularity - weeks and months are resampled from the daily rollup
+    granularity_options = list(GRANULARITIES)
+    granularity = st.radio(
+        "🗓️ Trend granularity",
+        granularity_options,
+        index=granularity_options.index(agg.default_granularity()),
+        horizontal=True,
+        key="granularity"
+    )
+    freq = GRANULARITIES[granularity]
+    
     # Charts Row 2
     col1, col2 = st.columns(2)
     
     with col1:
-        st.subheader("📈 Daily Transaction Trend")
-        if 'txn_date' in df.columns:
-            daily_volume = df.groupby('txn_date')['amount_usd'].sum().reset_index()
+        st.subheader(f"📈 {granularity} Transaction Trend")
+        if agg.has('txn_date'):
+            daily_volume = agg.volume_by_period(freq).reset_index()
             
             fig = px.line(
                 daily_volume,
@@ -708,8 +774,8 @@ def main():
     
     with col2:
         st.subheader("📊 Volume by Product Type")
-        if 'product_type' in df.columns:
-            product_volume = df.groupby('product_type')['amount_usd'].sum().sort_values(ascending=False)
+        if agg.has('product_type'):
+            product_volume = agg.volume_by('product_type').sort_values(ascending=False)
             
             fig = px.bar(
                 x=product_volume.index,
@@ -733,8 +799,8 @@ def main():
     st.markdown("---")
     st.subheader("💹 Currency Volume Trends Over Time")
     
-    if 'txn_date' in df.columns:
-        daily_by_currency = df.groupby(['txn_date', 'currency'])['amount_usd'].sum().reset_index()
+    if agg.has('txn_date'):
+        daily_by_currency = agg.volume_by_period(freq, 'currency').reset_index()
         dark_gold_palette = ['#d4af37', '#00d4ff', '#10b981', '#f43f5e', '#a855f7', '#f59e0b', '#06b6d4', '#ec4899', '#84cc16', '#6366f1']
         
         fig = px.line(
@@ -764,11 +830,8 @@ def main():
     
     with col1:
         st.subheader("📱 Transaction by Channel")
-        if 'channel' in df.columns:
-            channel_data = df.groupby('channel').agg({
-                'txn_id': 'count',
-                'amount_usd': 'sum'
-            }).rename(columns={'txn_id': 'count', 'amount_usd': 'volume'})
+        if agg.has('channel'):
+            channel_data = agg.by('channel')
             
             fig = make_subplots(specs=[[{"secondary_y": True}]])
             
@@ -799,8 +862,8 @@ def main():
     
     with col2:
         st.subheader("🌍 Top Merchant Countries")
-        if 'merchant_country' in df.columns:
-            country_volume = df.groupby('merchant_country')['amount_usd'].sum().sort_values(ascending=False).head(10)
+        if agg.has('merchant_country'):
+            country_volume = agg.volume_by('merchant_country').sort_values(ascending=False).head(10)
             
             fig = px.bar(
                 x=country_volume.index,
@@ -826,23 +889,53 @@ def main():
     
     display_cols = st.multiselect(
         "Select columns to display",
-        df.columns.tolist(),
+        df.columns.tolist() + [c for c in source_columns if c not in df.columns],
         default=['txn_id', 'txn_date', 'currency', 'amount', 'amount_usd', 'product_type', 'channel']
     )
     
+    # Load extra columns lazily, only once they are selected
+    lazy_cols = [c for c in display_cols if c not in df.columns]
+    wide = None
+    if lazy_cols and streaming:
+        st.caption("Extra columns are not loaded in streaming mode.")
+        display_cols = [c for c in display_cols if c in df.columns]
+    elif lazy_cols:
+        wide_cols = CORE_COLUMNS + tuple(lazy_cols)
+        if data_source == "S3 (Production)":
+            wide = load_data_from_s3(columns=wide_cols, **s3_filter)
+        else:
+            wide = load_sample_data(columns=wide_cols)
+        # Filters keep the loaded row index, so the extra columns align by index
+        if wide is not None and len(wide) == loaded_rows:
+            df = df.join(wide.loc[df.index, [c for c in lazy_cols if c in wide.columns]])
+        display_cols = [c for c in display_cols if c in df.columns]
+    
     if display_cols:
         st.dataframe(
-            df[display_cols].head(100),
+            format_ids(df[display_cols].head(100)),
             use_container_width=True,
             height=400
         )
     
-    st.download_button(
-        label="📥 Download Data as CSV",
-        data=df.to_csv(index=False).encode('utf-8'),
-        file_name="fx_normalized_transactions.csv",
-        mime="text/csv"
-    )
+    if streaming:
+        st.download_button(
+            label="📥 Download Preview as CSV",
+            data=format_ids(df).to_csv(index=False).encode('utf-8'),
+            file_name="fx_normalized_transactions.csv",
+            mime="text/csv"
+        )
+    elif st.button("📦 Prepare CSV Export", help="Formats every filtered row as CSV - can take a while for large selections"):
+        # Built only on request, so reruns and cached views never pay for it
+        export = filter_index.select(dataset, applied_dates, **filters)
+        extra = [c for c in df.columns if c not in export.columns]
+        if extra:
+            export = export.join(wide.loc[export.index, extra])
+        st.download_button(
+            label="📥 Download Data as CSV",
+            data=format_ids(export).to_csv(index=False).encode('utf-8'),
+            file_name="fx_normalized_transactions.csv",
+            mime="text/csv"
+        )
     
     # Footer
     st.markdown("---")
@@ -0,0 +1,53 @@
+"""
+Benchmark Query Backends
+------------------------
+Times the dashboard panels on every installed backend (pandas, DuckDB,
+Polars) for a few typical filter combinations.
+
+    python benchmark_backends.py [path.parquet] [--repeat N]
+"""
+
+import argparse
+import time
+
+from fx_backends import available_backends, get_backend
+from fx_data import SAMPLE_PATH, load_dataset
+
+# (label, date_range, filters) - mirrors what the dashboard filters send
+SCENARIOS = [
+    ("all data", None, {}),
+    ("one currency", None, {'currency': 'USD'}),
+    ("month, currency + product", ('2025-10-01', '2025-10-31'), {'currency': 'EUR', 'product_type': 'TRAVEL'}),
+    ("week, all filters", ('2025-11-01', '2025-11-07'), {'currency': 'USD', 'product_type': 'ECOM', 'channel': 'ONLINE'}),
+]
+
+
+def run_panels(backend, dataset, date_range, filters):
+    """Build every panel input the dashboards draw, uncached."""
+    agg = backend.rollups(dataset, date_range, **filters).prepare()
+    return agg.count, round(agg.volume, 2), agg.customers
+
+
+def benchmark(path=SAMPLE_PATH, repeat=5):
+    dataset = load_dataset('sample', columns=None, path=path)
+    print(f"Dataset: {path} ({len(dataset):,} rows)")
+    print(f"Backends: {', '.join(available_backends())}\n")
+    print(f"{'scenario':<28}{'backend':<10}{'best ms':>10}{'mean ms':>10}  result")
+    for label, date_range, filters in SCENARIOS:
+        for name in available_backends():
+            backend = get_backend(name)
+            result = run_panels(backend, dataset, date_range, filters)  # warm-up (builds cube/index once)
+            timings = []
+            for _ in range(repeat):
+                start = time.perf_counter()
+                run_panels(backend, dataset, date_range, filters)
+                timings.append((time.perf_counter() - start) * 1000)
+            print(f"{label:<28}{name:<10}{min(timings):>10.1f}{sum(timings) / len(timings):>10.1f}  {result}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare query backends on the dashboard panels")
+    parser.add_argument("path", nargs="?", default=SAMPLE_PATH)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+    benchmark(args.path, args.repeat)
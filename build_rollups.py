@@ -0,0 +1,132 @@
+"""
+Build Daily Rollups
+-------------------
+Writes per-day summary parquet files (volume and count per date x
+currency x product x channel x country) next to the normalized data,
+for the dashboards' charts.
+
+Incremental: only days covered by new, changed or deleted source files
+are re-aggregated, and only days whose summary changed are rewritten.
+
+    python build_rollups.py [--source sample|s3] [--full]
+"""
+
+import argparse
+import time
+
+import pandas as pd
+import pyarrow.parquet as pq
+
+from fx_aggregates import ROLLUP_DIMENSIONS, map_reduce_partial
+from fx_data import (
+    S3_BUCKET, S3_PREFIX, SAMPLE_PATH, get_s3_client, list_parquet_objects, metadata_date_bounds,
+    partition_date, read_footer
+)
+from fx_rollups import RollupStore, cells_digest, source_objects
+
+# Only what the cells need is decoded
+ROLLUP_COLUMNS = ('amount_usd', *ROLLUP_DIMENSIONS)
+
+
+def _day(value):
+    return str(pd.Timestamp(value).date())
+
+
+def object_day_bounds(source, keys, listing=None, path=SAMPLE_PATH):
+    """{object: [first day, last day]} from date partitions or parquet footers.
+
+    None for objects whose footer has no txn_date statistics.
+    """
+    bounds = {}
+    if source == 's3':
+        s3 = get_s3_client()
+        for key in keys:
+            day = partition_date(key)
+            if day is not None:
+                bounds[key] = [_day(day), _day(day)]
+                continue
+            found = metadata_date_bounds(read_footer(s3, S3_BUCKET, key, listing[key]))
+            bounds[key] = [_day(found[0]), _day(found[1])] if found else None
+    else:
+        for key in keys:
+            found = metadata_date_bounds(pq.ParquetFile(key).metadata)
+            bounds[key] = [_day(found[0]), _day(found[1])] if found else None
+    return bounds
+
+
+def _days(bound):
+    return {_day(day) for day in pd.date_range(bound[0], bound[1], freq='D')}
+
+
+def update_rollups(source='sample', full=False):
+    """Bring the source's rollup files up to date; returns (days re-aggregated, files written)."""
+    store = RollupStore.for_source(source, SAMPLE_PATH)
+    manifest = (None if full else store.read_manifest()) or {'objects': {}, 'bounds': {}, 'days': {}}
+    listing = list_parquet_objects(get_s3_client(), S3_BUCKET, S3_PREFIX) if source == 's3' else None
+    current = source_objects(source, SAMPLE_PATH, listing)
+
+    known = manifest['objects']
+    changed = [key for key, fingerprint in current.items() if known.get(key) != fingerprint]
+    removed = [key for key in known if key not in current]
+    if not changed and not removed:
+        print("Rollups are up to date")
+        return 0, 0
+
+    bounds = {key: bound for key, bound in manifest['bounds'].items() if key in current and key not in changed}
+    bounds.update(object_day_bounds(source, changed, listing))
+
+    # days whose rows may have changed - everything if an object's dates are unknown
+    rebuild_all = full or not manifest['days']
+    touched = set()
+    for key in changed:
+        if bounds.get(key) is None:
+            rebuild_all = True
+        else:
+            touched |= _days(bounds[key])
+    for key in removed:
+        if manifest['bounds'].get(key) is None:
+            rebuild_all = True
+        else:
+            touched |= _days(manifest['bounds'][key])
+
+    date_range = None if rebuild_all or not touched else (min(touched), max(touched))
+    cells = map_reduce_partial(source, date_range=date_range, columns=ROLLUP_COLUMNS).finish().cells
+    by_day = {_day(day): group.reset_index(drop=True) for day, group in cells.groupby('txn_date', observed=True)}
+    if rebuild_all:
+        touched = set(by_day) | set(manifest['days'])
+
+    days = dict(manifest['days'])
+    written = 0
+    for day in sorted(touched):
+        group = by_day.get(day)
+        if group is None:
+            if day in days:
+                store.delete_day(day)
+                del days[day]
+            continue
+        digest = cells_digest(group)
+        if days.get(day) != digest:
+            store.write_day(day, group)
+            days[day] = digest
+            written += 1
+
+    # written last, so an interrupted run leaves the old (stale, unused) manifest
+    store.write_manifest({
+        'objects': current,
+        'bounds': bounds,
+        'days': days,
+        'updated_at': pd.Timestamp.now(tz='UTC').isoformat(),
+    })
+    return len(touched), written
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Write daily rollup files for the dashboards")
+    parser.add_argument("--source", choices=["sample", "s3"], default="sample")
+    parser.add_argument("--full", action="store_true", help="Rebuild every day, ignoring the manifest")
+    args = parser.parse_args()
+    start = time.perf_counter()
+    touched, written = update_rollups(args.source, args.full)
+    store = RollupStore.for_source(args.source, SAMPLE_PATH)
+    print(f"Re-aggregated {touched} days, wrote {written} files to {store.root} "
+          f"in {time.perf_counter() - start:.1f}s")
@@ -0,0 +1,28 @@
+"""pytest setup: the repo root is importable, and every test gets its own caches.
+
+Being at the rootdir, this file puts the repo on sys.path for the tests.
+"""
+
+import os
+
+import pytest
+
+import fx_data
+
+
+@pytest.fixture(autouse=True)
+def isolated_caches(tmp_path, monkeypatch):
+    """Point the disk cache and Arrow snapshots at tmp_path and start with empty in-memory caches."""
+    cache_dir = str(tmp_path / 'cache')
+    snapshot_dir = os.path.join(cache_dir, 'snapshots')
+    monkeypatch.setenv('FX_CACHE_DIR', cache_dir)
+    monkeypatch.setenv('FX_SNAPSHOT_DIR', snapshot_dir)
+    # the modules read these at import time
+    monkeypatch.setattr(fx_data, 'DISK_CACHE_DIR', cache_dir)
+    monkeypatch.setattr(fx_data, 'SNAPSHOT_DIR', snapshot_dir)
+    monkeypatch.setattr(fx_data, '_DISK_CACHE', fx_data.DiskCache(cache_dir))
+    fx_data.get_dataset_cache().clear()
+    fx_data.get_derived_cache().clear()
+    yield
+    fx_data.get_dataset_cache().clear()
+    fx_data.get_derived_cache().clear()
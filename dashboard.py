@@ -4,16 +4,22 @@
 # AI-Enhanced with Groq LLM
 
 import streamlit as st
-import pandas as pd
 import plotly.express as px
 import plotly.graph_objects as go
 from plotly.subplots import make_subplots
 import json
 
-# tried using boto3 for s3 but had issues, keeping it for later
-import boto3
-from io import BytesIO
-import pyarrow.parquet as pq
+from fx_data import (
+    CORE_COLUMNS, STREAMING, dataset_columns, dataset_partitions, format_ids, get_dataset_cache,
+    get_derived_cache, get_disk_cache, get_filter_index, get_frame_store, load_dataset, memory_report,
+    narrowed_range
+)
+from fx_aggregates import AGGREGATE_WORKERS, GRANULARITIES, get_view_cache, stream_rollups, streamed_cube, view_rollups
+from fx_anomalies import (
+    ANOMALY_LABELS, ANOMALY_METHODS, ANOMALY_THRESHOLD, SEVERE_THRESHOLD, VELOCITY_MAX_TXNS, VELOCITY_MAX_USD,
+    window_label
+)
+from fx_backends import get_backend
 
 # Groq AI Integration
 try:
@@ -503,106 +509,60 @@ curr_symbols = {
 }
 
 # function to load data from s3
-# using caching so it doesnt reload every time
-@st.cache_data(ttl=300)
-def get_s3_data():
+# cached once per process in fx_data, shared with app.py
+# currencies / date_range prune the s3 listing to the matching partitions
+def get_s3_data(currencies=None, date_range=None, columns=CORE_COLUMNS):
     try:
-        s3_client = boto3.client('s3', region_name='us-east-2')
-        bucket_name = 'apoorv-financial-pipeline-2025'
-        data_prefix = 'output/normalized/'
-        
-        paginator = s3_client.get_paginator('list_objects_v2')
-        
-        all_dfs = []
-        for page in paginator.paginate(Bucket=bucket_name, Prefix=data_prefix):
-            if 'Contents' not in page:
-                continue
-            for obj in page['Contents']:
-                key = obj['Key']
-                if key.endswith('.parquet'):
-                    # extract currency from partition path
-                    curr = None
-                    if 'currency=' in key:
-                        curr = key.split('currency=')[1].split('/')[0]
-                    
-                    response = s3_client.get_object(Bucket=bucket_name, Key=key)
-                    temp_df = pd.read_parquet(BytesIO(response['Body'].read()))
-                    
-                    if curr and 'currency' not in temp_df.columns:
-                        temp_df['currency'] = curr
-                    
-                    all_dfs.append(temp_df)
-        
-        if all_dfs:
-            result = pd.concat(all_dfs, ignore_index=True)
-            if 'currency' not in result.columns:
-                st.warning("currency column not found in s3 data")
-                return None
-            return result
+        return load_dataset('s3', currencies, date_range, columns)
+    except ValueError as err:
+        st.warning(str(err))
         return None
     except Exception as err:
         st.error(f"s3 error: {err}")
         return None
 
-# fallback - generate sample data if s3 fails
-@st.cache_data
-def generate_sample():
+# partitions in the bucket - only lists keys, no downloads
+def get_s3_partitions():
     try:
-        return pd.read_parquet("sample_normalized.parquet")
-    except:
-        # generate fake data for testing
-        import numpy as np
-        np.random.seed(42)
-        
-        date_range = pd.date_range('2025-09-01', periods=90, freq='D')
-        currencies = ['USD', 'EUR', 'GBP', 'INR', 'JPY', 'CAD', 'AUD', 'CHF', 'CNY', 'SGD']
-        products = ['ECOM', 'RETAIL', 'SUBSCRIPTION', 'TRAVEL', 'FOREX', 'REMITTANCE', 'INVESTMENT']
-        channels = ['ONLINE', 'POS', 'MOBILE', 'ATM', 'WIRE']
-        
-        num_rows = 5000
-        
-        # creating the dataframe
-        df = pd.DataFrame({
-            'txn_id': [f'TXN{str(i).zfill(7)}' for i in range(num_rows)],
-            'customer_id': [f'C{str(np.random.randint(1, 500)).zfill(5)}' for _ in range(num_rows)],
-            'txn_date': np.random.choice(date_range, num_rows),
-            'amount': np.random.exponential(1000, num_rows),
-            'currency': np.random.choice(currencies, num_rows, p=[0.3, 0.2, 0.15, 0.1, 0.08, 0.05, 0.04, 0.03, 0.03, 0.02]),
-            'product_type': np.random.choice(products, num_rows),
-            'channel': np.random.choice(channels, num_rows),
-            'merchant_country': np.random.choice(['US', 'UK', 'DE', 'FR', 'IN', 'JP', 'CA', 'AU'], num_rows),
-        })
-        
-        # fx rates - approximate values
-        rates = {'USD': 1.0, 'EUR': 1.08, 'GBP': 1.27, 'INR': 0.012, 'JPY': 0.0067,
-                 'CAD': 0.74, 'AUD': 0.65, 'CHF': 1.13, 'CNY': 0.14, 'SGD': 0.74}
-        df['fx_rate'] = df['currency'].map(rates)
-        df['amount_usd'] = df['amount'] * df['fx_rate']
-        df['base_currency'] = 'USD'
-        
-        return df
+        return dataset_partitions()
+    except Exception as err:
+        st.error(f"s3 error: {err}")
+        return None
+
+# local sample file (falls back to generated data if it's missing)
+def generate_sample(columns=CORE_COLUMNS):
+    return load_dataset('sample', columns=columns)
+
+# streaming mode - cube cells built batch by batch, the rows are never loaded
+def get_streamed_cells(stream_source):
+    try:
+        return streamed_cube(stream_source).cells
+    except Exception as err:
+        st.error(f"streaming error: {err}")
+        return None
 
 # create summary text
-def create_summary(data):
-    vol = data['amount_usd'].sum()
-    txn_count = len(data)
-    avg = data['amount_usd'].mean()
-    customers = data['customer_id'].nunique()
+def create_summary(agg):
+    vol = agg.volume
+    txn_count = agg.count
+    customers = agg.customers
     
     # find top currency
-    top_curr = data.groupby('currency')['amount_usd'].sum().idxmax()
-    top_curr_pct = data.groupby('currency')['amount_usd'].sum().max() / vol * 100
+    curr_vol = agg.volume_by('currency')
+    top_curr = curr_vol.idxmax()
+    top_curr_pct = curr_vol.max() / vol * 100
     
     # find top product
-    if 'product_type' in data.columns:
-        top_prod = data.groupby('product_type')['amount_usd'].sum().idxmax()
-        top_prod_pct = data.groupby('product_type')['amount_usd'].sum().max() / vol * 100
+    if agg.has('product_type'):
+        prod_vol = agg.volume_by('product_type')
+        top_prod = prod_vol.idxmax()
+        top_prod_pct = prod_vol.max() / vol * 100
     else:
         top_prod = "N/A"
         top_prod_pct = 0
     
     # check concentration
-    conc = data.groupby('currency')['amount_usd'].sum() / vol * 100
+    conc = curr_vol / vol * 100
     high_conc = conc[conc > 25].to_dict()
     
     html = f"""
@@ -610,8 +570,8 @@ def create_summary(data):
     <h3>📊 Executive Summary</h3>
     <p>
     <strong>Overview:</strong> Analyzed <strong>{txn_count:,}</strong> transactions totaling 
-    <strong>${vol:,.0f}</strong> across <strong>{data['currency'].nunique()}</strong> currencies 
-    from <strong>{customers:,}</strong> customers.<br><br>
+    <strong>${vol:,.0f}</strong> across <strong>{len(curr_vol)}</strong> currencies 
+    from <strong>{'' if agg.customers_exact else '≈'}{customers:,}</strong> customers.<br><br>
     
     <strong>Top Currency:</strong> <strong>{top_curr}</strong> accounts for <strong>{top_curr_pct:.1f}%</strong> 
     of volume. Leading product: <strong>{top_prod}</strong> (<strong>{top_prod_pct:.1f}%</strong>).<br><br>
@@ -623,21 +583,21 @@ def create_summary(data):
     return html
 
 # detect unusual transactions
-def find_anomalies(data):
-    threshold1 = 50000  # 50k usd
-    threshold2 = 100000  # 100k usd
-    
+def find_anomalies(agg):
+    # robust z-score vs the currency x product median/MAD - not a fixed usd cutoff
     results = {
-        'high': len(data[data['amount_usd'] > threshold1]),
-        'very_high': len(data[data['amount_usd'] > threshold2]),
-        'total': len(data)
+        'flagged': agg.anomalies,
+        'severe': agg.severe_anomalies,
+        'method': ANOMALY_LABELS.get(agg.anomaly_method, "robust z"),
+        'rate': agg.anomaly_rate(),
+        'burst_customers': agg.burst_customers,
+        'burst_transactions': agg.burst_transactions,
+        'burst_window': agg.burst_window or window_label(),
+        'total': agg.count
     }
     
     # get biggest transactions
-    if 'product_type' in data.columns:
-        top5 = data.nlargest(5, 'amount_usd')[['txn_id', 'amount_usd', 'currency', 'product_type']].to_dict('records')
-    else:
-        top5 = data.nlargest(5, 'amount_usd')[['txn_id', 'amount_usd', 'currency']].to_dict('records')
+    top5 = agg.top_transactions()
     
     return results, top5
 
@@ -645,48 +605,61 @@ def find_anomalies(data):
 # 🤖 AI ASSISTANT FUNCTIONS (Groq Integration)
 # ============================================
 
-def get_data_context(df):
+def get_data_context(agg):
     """Generate a summary of the data for the AI to understand."""
     context = {
-        "total_transactions": len(df),
-        "total_volume_usd": round(df['amount_usd'].sum(), 2),
-        "avg_transaction_usd": round(df['amount_usd'].mean(), 2),
-        "unique_customers": df['customer_id'].nunique(),
-        "currencies": df['currency'].unique().tolist(),
-        "currency_volumes": df.groupby('currency')['amount_usd'].sum().to_dict(),
-        "currency_counts": df.groupby('currency').size().to_dict(),
+        "total_transactions": agg.count,
+        "total_volume_usd": round(agg.volume, 2),
+        "avg_transaction_usd": round(agg.average, 2),
+        "unique_customers": agg.customers,
+        "unique_customers_exact": agg.customers_exact,
+        "currencies": agg.distinct('currency'),
+        "currency_volumes": agg.volume_by('currency').to_dict(),
+        "currency_counts": agg.count_by('currency').to_dict(),
     }
     
-    if 'product_type' in df.columns:
-        context["product_types"] = df['product_type'].unique().tolist()
-        context["product_volumes"] = df.groupby('product_type')['amount_usd'].sum().to_dict()
+    if agg.has('product_type'):
+        context["product_types"] = agg.distinct('product_type')
+        context["product_volumes"] = agg.volume_by('product_type').to_dict()
     
-    if 'channel' in df.columns:
-        context["channels"] = df['channel'].unique().tolist()
-        context["channel_volumes"] = df.groupby('channel')['amount_usd'].sum().to_dict()
+    if agg.has('channel'):
+        context["channels"] = agg.distinct('channel')
+        context["channel_volumes"] = agg.volume_by('channel').to_dict()
     
-    if 'merchant_country' in df.columns:
-        context["countries"] = df['merchant_country'].unique().tolist()
-        context["country_volumes"] = df.groupby('merchant_country')['amount_usd'].sum().to_dict()
+    if agg.has('merchant_country'):
+        context["countries"] = agg.distinct('merchant_country')
+        context["country_volumes"] = agg.volume_by('merchant_country').to_dict()
     
-    if 'txn_date' in df.columns:
+    if agg.has('txn_date'):
+        start, end = agg.date_bounds()
         context["date_range"] = {
-            "start": str(df['txn_date'].min()),
-            "end": str(df['txn_date'].max())
+            "start": str(start),
+            "end": str(end)
         }
         # Daily trends
-        daily = df.groupby('txn_date')['amount_usd'].sum()
+        daily = agg.volume_by('txn_date')
         context["highest_volume_day"] = str(daily.idxmax())
         context["lowest_volume_day"] = str(daily.idxmin())
     
-    # Anomalies
-    high_value = df[df['amount_usd'] > 50000]
-    context["high_value_transactions"] = len(high_value)
-    context["anomaly_rate"] = round(len(high_value) / len(df) * 100, 2)
+    # Anomalies (per currency x product scores, see fx_anomalies)
+    if agg.anomalies is not None:
+        context["anomaly_method"] = (f"{ANOMALY_METHODS[agg.anomaly_method]}; "
+                                     f"flagged above {ANOMALY_THRESHOLD:g}, severe above {SEVERE_THRESHOLD:g}")
+        context["anomalous_transactions"] = agg.anomalies
+        context["severe_anomalies"] = agg.severe_anomalies
+        context["anomaly_rate"] = round(agg.anomaly_rate(), 2)
+        context["anomalies_by_group"] = agg.anomaly_groups.head(5).round(2).to_dict('records')
+    
+    # Velocity bursts (rolling per-customer windows, see fx_anomalies)
+    if agg.burst_customers is not None:
+        context["velocity_method"] = (f"a customer's transactions within {agg.burst_window} windows; burst at "
+                                      f"{VELOCITY_MAX_TXNS}+ transactions or 2+ totalling ${VELOCITY_MAX_USD:,.0f}+")
+        context["bursting_customers"] = agg.burst_customers
+        context["burst_transactions"] = agg.burst_transactions
+        context["top_bursting_customers"] = agg.top_bursts.round(2).to_dict('records')
     
     # Top transactions
-    top5 = df.nlargest(5, 'amount_usd')[['txn_id', 'amount_usd', 'currency']].to_dict('records')
-    context["top_5_transactions"] = top5
+    context["top_5_transactions"] = agg.top_transactions(['txn_id', 'amount_usd', 'currency'], n=5)
     
     return context
 
@@ -773,6 +746,12 @@ def run_app():
     with st.sidebar:
         st.header("⚙️ Options")
         source = st.radio("Data Source", ["Local Sample", "AWS S3"], index=0)
+        prune_s3 = False
+        if source == "AWS S3":
+            prune_s3 = st.checkbox("⚡ Load selected partitions only", value=True,
+                                   help="Only download the currency/date partitions matching the filters")
+        streaming = st.checkbox("🌊 Streaming mode", value=STREAMING,
+                                help="Aggregate the data in batches instead of loading it - for histories bigger than memory")
         
         st.markdown("---")
         
@@ -809,11 +788,32 @@ def run_app():
             st.write("Loading...")
     
     # load the data
+    partitions = None
+    s3_filter = {}
     with st.spinner("Fetching data..."):
-        if source == "AWS S3":
-            df = get_s3_data()
+        if streaming:
+            # df holds the streamed cube cells here - enough for the filter options and date bounds
+            df = get_streamed_cells('s3' if source == "AWS S3" else 'sample')
+            if df is None and source == "AWS S3":
+                st.warning("S3 failed, using sample data")
+                source = "Local Sample"
+                df = get_streamed_cells('sample')
+        elif source == "AWS S3":
+            if prune_s3:
+                partitions = get_s3_partitions()
+            if partitions:
+                # filter widgets are drawn later, so read their last values from session state
+                picked_curr = st.session_state.get("sel_curr", "All")
+                picked_dates = st.session_state.get("sel_dates") if partitions['date_bounds'] else None
+                s3_filter = {
+                    'currencies': None if picked_curr == "All" else (picked_curr,),
+                    # only push the dates down when they cut the partitions - otherwise the filter index slices
+                    'date_range': narrowed_range(picked_dates, partitions['date_bounds'])
+                }
+            df = get_s3_data(**s3_filter)
             if df is None:
                 st.warning("S3 failed, using sample data")
+                source = "Local Sample"
                 df = generate_sample()
         else:
             df = generate_sample()
@@ -823,21 +823,36 @@ def run_app():
         st.error("No data loaded!")
         return
     
+    # every column the source has - extras get loaded only if picked in the raw data table
+    if source == "AWS S3":
+        source_cols = dataset_columns('s3') or list(df.columns)
+    else:
+        source_cols = dataset_columns('sample') or list(df.columns)
+    loaded_rows = len(df)
+    
     # update debug info
     with st.sidebar:
         with st.expander("Debug Info", expanded=False):
-            st.write(f"Records: {len(df):,}")
+            st.write(f"{'Cube cells' if streaming else 'Records'}: {len(df):,}")
             st.write(f"Cols: {list(df.columns)}")
+            if source == "AWS S3" and get_frame_store().last_refresh:
+                st.write(f"Last S3 refresh: {get_frame_store().last_refresh}")
+            if source == "AWS S3" and get_disk_cache():
+                st.write(f"Disk cache: {get_disk_cache().hits} hits / {get_disk_cache().misses} misses")
+            st.write(f"Shared dataset cache: {get_dataset_cache().hits} hits / {get_dataset_cache().misses} misses")
+            st.write(f"Derived structures cache: {get_derived_cache().hits} hits / {get_derived_cache().misses} misses")
+            st.write(f"Query backend: {get_backend().name}")
+            if streaming:
+                st.write(f"Aggregation workers: {AGGREGATE_WORKERS}")
+            view_cache_info = st.empty()  # gets filled after the filters run
+            # bytes per column, before and after compacting
+            st.dataframe(memory_report(df), use_container_width=True)
     
     # make sure we have required columns
-    if 'currency' not in df.columns or 'amount_usd' not in df.columns:
+    if 'currency' not in df.columns or ('amount_usd' not in df.columns and not streaming):
         st.error(f"Missing columns! Have: {list(df.columns)}")
         return
     
-    # fix date column
-    if 'txn_date' in df.columns:
-        df['txn_date'] = pd.to_datetime(df['txn_date'])
-    
     # FILTERS SECTION
     st.markdown("""
     <div class="filter-section">
@@ -846,57 +861,85 @@ def run_app():
     """, unsafe_allow_html=True)
     
     c1, c2, c3, c4 = st.columns(4)
+    dataset = df
+    filter_index = get_filter_index(dataset)
+    applied_dates = None
     
     # date filter
     with c1:
         if 'txn_date' in df.columns:
-            min_d = df['txn_date'].min()
-            max_d = df['txn_date'].max()
-            dates = st.date_input("📅 Date Range", value=(min_d, max_d), min_value=min_d, max_value=max_d)
+            if partitions and partitions['date_bounds']:
+                min_d, max_d = partitions['date_bounds']
+            else:
+                min_d = df['txn_date'].min()
+                max_d = df['txn_date'].max()
+            dates = st.date_input("📅 Date Range", value=(min_d, max_d), min_value=min_d, max_value=max_d,
+                                  key="sel_dates")
             if len(dates) == 2:
-                df = df[(df['txn_date'] >= pd.Timestamp(dates[0])) & (df['txn_date'] <= pd.Timestamp(dates[1]))]
+                applied_dates = dates
+    
+    # filters get collected here and run once against the filter index below
+    filters = {}
     
     # currency filter
     with c2:
-        curr_opts = ["All"] + sorted(df['currency'].unique().tolist())
-        sel_curr = st.selectbox("💱 Currency", curr_opts)
+        if partitions and partitions['currencies']:
+            curr_opts = ["All"] + partitions['currencies']
+        else:
+            curr_opts = ["All"] + filter_index.distinct(dataset, 'currency', applied_dates)
+        sel_curr = st.selectbox("💱 Currency", curr_opts, key="sel_curr")
         if sel_curr != "All":
-            df = df[df['currency'] == sel_curr]
+            filters['currency'] = sel_curr
     
     # product filter
     with c3:
         if 'product_type' in df.columns:
-            prod_opts = ["All"] + sorted(df['product_type'].unique().tolist())
+            prod_opts = ["All"] + filter_index.distinct(dataset, 'product_type', applied_dates, **filters)
             sel_prod = st.selectbox("📦 Product", prod_opts)
             if sel_prod != "All":
-                df = df[df['product_type'] == sel_prod]
+                filters['product_type'] = sel_prod
     
     # channel filter
     with c4:
         if 'channel' in df.columns:
-            chan_opts = ["All"] + sorted(df['channel'].unique().tolist())
+            chan_opts = ["All"] + filter_index.distinct(dataset, 'channel', applied_dates, **filters)
             sel_chan = st.selectbox("📱 Channel", chan_opts)
             if sel_chan != "All":
-                df = df[df['channel'] == sel_chan]
+                filters['channel'] = sel_chan
+    
+    if streaming:
+        # one pass over the matching partitions, folded batch by batch - df is just a preview
+        agg = stream_rollups('s3' if source == "AWS S3" else 'sample', applied_dates, **filters)
+        df = agg.preview if agg.preview is not None else dataset.iloc[:0]
+    else:
+        # only the rows the table shows get materialized - the csv export selects the rest when asked
+        df = filter_index.head(dataset, 100, applied_dates, **filters)
+        # every panel below reads from the cube (built once per dataset), sliced with the same filters
+        # revisited views come from the lru view cache
+        agg = view_rollups(dataset, applied_dates, backend=get_backend(), **filters)
+    
+    st.markdown(f"<p style='text-align: right; color: #64748b; font-family: JetBrains Mono, monospace;'>Showing <strong style='color: #d4af37;'>{agg.count:,}</strong> records</p>", unsafe_allow_html=True)
     
-    st.markdown(f"<p style='text-align: right; color: #64748b; font-family: JetBrains Mono, monospace;'>Showing <strong style='color: #d4af37;'>{len(df):,}</strong> records</p>", unsafe_allow_html=True)
+    stats = get_view_cache().stats()
+    view_cache_info.write(f"View cache: {stats['hits']} hits / {stats['misses']} misses / "
+                          f"{stats['evictions']} evictions ({stats['bytes'] / 1024 / 1024:.1f} MB)")
     
     # Summary and Anomaly panels
     left_col, right_col = st.columns([2, 1])
     
     with left_col:
-        st.markdown(create_summary(df), unsafe_allow_html=True)
+        st.markdown(create_summary(agg), unsafe_allow_html=True)
     
     with right_col:
-        anomaly_data, _ = find_anomalies(df)
-        rate = anomaly_data['high'] / anomaly_data['total'] * 100 if anomaly_data['total'] > 0 else 0
+        anomaly_data, _ = find_anomalies(agg)
         st.markdown(f"""
         <div class="alert-panel">
         <h3>🚨 Anomaly Detection</h3>
         <p>
-        <strong>High-Value (>$50K):</strong> {anomaly_data['high']:,}<br>
-        <strong>Very High (>$100K):</strong> {anomaly_data['very_high']:,}<br>
-        <strong>Anomaly Rate:</strong> {rate:.1f}%
+        <strong>Anomalies ({anomaly_data['method']} &gt; {ANOMALY_THRESHOLD:g}):</strong> {f"{anomaly_data['flagged']:,}" if anomaly_data['flagged'] is not None else "n/a"}<br>
+        <strong>Severe ({anomaly_data['method']} &gt; {SEVERE_THRESHOLD:g}):</strong> {f"{anomaly_data['severe']:,}" if anomaly_data['severe'] is not None else "n/a"}<br>
+        <strong>Anomaly Rate:</strong> {f"{anomaly_data['rate']:.1f}%" if anomaly_data['rate'] is not None else "n/a"}<br>
+        <strong>Velocity Bursts ({anomaly_data['burst_window']}):</strong> {f"{anomaly_data['burst_customers']:,} customers ({anomaly_data['burst_transactions']:,} txns)" if anomaly_data['burst_customers'] is not None else "n/a"}
         </p>
         </div>
         """, unsafe_allow_html=True)
@@ -906,13 +949,13 @@ def run_app():
     # KPI metrics
     m1, m2, m3, m4 = st.columns(4)
     with m1:
-        st.metric("Total Transactions", f"{len(df):,}")
+        st.metric("Total Transactions", f"{agg.count:,}")
     with m2:
-        st.metric("Total Volume (USD)", f"${df['amount_usd'].sum():,.2f}")
+        st.metric("Total Volume (USD)", f"${agg.volume:,.2f}")
     with m3:
-        st.metric("Avg Transaction", f"${df['amount_usd'].mean():,.2f}")
+        st.metric("Avg Transaction", f"${agg.average:,.2f}")
     with m4:
-        st.metric("Unique Customers", f"{df['customer_id'].nunique():,}")
+        st.metric("Unique Customers", f"{'' if agg.customers_exact else '≈'}{agg.customers:,}")
     
     st.markdown("---")
     
@@ -960,8 +1003,8 @@ def run_app():
     # Process question
     if ask_button and user_question:
         with st.spinner("🤖 Analyzing your data..."):
-            # Get data context
-            data_context = get_data_context(df)
+            # Get data context - built once per dataset version + filters, kept with the view
+            data_context = agg.derived('ai_context', lambda: get_data_context(agg))
             # Get AI response
             ai_response = ask_ai_assistant(user_question, data_context, groq_api_key)
             
@@ -1007,7 +1050,7 @@ def run_app():
     
     with chart1:
         st.subheader("📊 Volume by Currency")
-        vol_by_curr = df.groupby('currency')['amount_usd'].sum().sort_values(ascending=True)
+        vol_by_curr = agg.volume_by('currency').sort_values(ascending=True)
         fig1 = px.bar(x=vol_by_curr.values, y=vol_by_curr.index, orientation='h',
                       color=vol_by_curr.values, color_continuous_scale=[[0, '#1a1f2e'], [0.5, '#d4af37'], [1, '#f4d03f']],
                       labels={'x': 'Volume (USD)', 'y': 'Currency'})
@@ -1025,7 +1068,7 @@ def run_app():
     
     with chart2:
         st.subheader("🥧 Transaction Count Distribution")
-        count_by_curr = df.groupby('currency').size()
+        count_by_curr = agg.count_by('currency')
         dark_gold_palette = ['#d4af37', '#00d4ff', '#10b981', '#f43f5e', '#a855f7', '#f59e0b', '#06b6d4', '#ec4899', '#84cc16', '#6366f1']
         fig2 = px.pie(values=count_by_curr.values, names=count_by_curr.index, hole=0.45,
                       color_discrete_sequence=dark_gold_palette)
@@ -1040,13 +1083,19 @@ def run_app():
         fig2.update_traces(textfont=dict(color='#f8fafc'))
         st.plotly_chart(fig2, use_container_width=True)
     
+    # time granularity for both trend charts - resampled from the daily rollup, never from rows
+    grain_opts = list(GRANULARITIES)
+    granularity = st.radio("🗓️ Trend granularity", grain_opts, index=grain_opts.index(agg.default_granularity()),
+                           horizontal=True, key="granularity")
+    freq = GRANULARITIES[granularity]
+    
     # Charts - Row 2
     chart3, chart4 = st.columns(2)
     
     with chart3:
-        st.subheader("📈 Daily Volume Trend")
-        if 'txn_date' in df.columns:
-            daily = df.groupby('txn_date')['amount_usd'].sum().reset_index()
+        st.subheader(f"📈 {granularity} Volume Trend")
+        if agg.has('txn_date'):
+            daily = agg.volume_by_period(freq).reset_index()
             fig3 = px.line(daily, x='txn_date', y='amount_usd',
                            labels={'txn_date': 'Date', 'amount_usd': 'Volume (USD)'})
             fig3.update_traces(line_color='#d4af37', line_width=3, line_shape='spline')
@@ -1066,8 +1115,8 @@ def run_app():
     
     with chart4:
         st.subheader("📊 Product Type Breakdown")
-        if 'product_type' in df.columns:
-            prod_vol = df.groupby('product_type')['amount_usd'].sum().sort_values(ascending=False)
+        if agg.has('product_type'):
+            prod_vol = agg.volume_by('product_type').sort_values(ascending=False)
             fig4 = px.bar(x=prod_vol.index, y=prod_vol.values,
                           color=prod_vol.values, color_continuous_scale=[[0, '#1a1f2e'], [0.5, '#00d4ff'], [1, '#06b6d4']],
                           labels={'x': 'Product', 'y': 'Volume (USD)'})
@@ -1086,8 +1135,8 @@ def run_app():
     st.markdown("---")
     st.subheader("💹 Currency Trends Over Time")
     
-    if 'txn_date' in df.columns:
-        trends = df.groupby(['txn_date', 'currency'])['amount_usd'].sum().reset_index()
+    if agg.has('txn_date'):
+        trends = agg.volume_by_period(freq, 'currency').reset_index()
         dark_gold_palette = ['#d4af37', '#00d4ff', '#10b981', '#f43f5e', '#a855f7', '#f59e0b', '#06b6d4', '#ec4899', '#84cc16', '#6366f1']
         fig5 = px.line(trends, x='txn_date', y='amount_usd', color='currency',
                        labels={'txn_date': 'Date', 'amount_usd': 'Volume', 'currency': 'Currency'},
@@ -1109,7 +1158,7 @@ def run_app():
     st.markdown("---")
     st.subheader("🗺️ Global Transaction Heatmap")
     
-    if 'merchant_country' in df.columns:
+    if agg.has('merchant_country'):
         # country code mapping for plotly
         country_codes = {
             'US': 'USA', 'UK': 'GBR', 'DE': 'DEU', 'FR': 'FRA', 
@@ -1119,10 +1168,7 @@ def run_app():
         }
         
         # aggregate by country
-        geo_data = df.groupby('merchant_country').agg({
-            'amount_usd': 'sum',
-            'txn_id': 'count'
-        }).reset_index()
+        geo_data = agg.by('merchant_country').reset_index()
         geo_data.columns = ['country', 'volume', 'transactions']
         geo_data['country_code'] = geo_data['country'].map(country_codes)
         geo_data = geo_data.dropna(subset=['country_code'])
@@ -1181,9 +1227,8 @@ def run_app():
     
     with ch5:
         st.subheader("📱 Channel Analysis")
-        if 'channel' in df.columns:
-            chan_stats = df.groupby('channel').agg({'txn_id': 'count', 'amount_usd': 'sum'})
-            chan_stats.columns = ['count', 'volume']
+        if agg.has('channel'):
+            chan_stats = agg.by('channel')[['count', 'volume']]
             
             # dual axis chart
             fig6 = make_subplots(specs=[[{"secondary_y": True}]])
@@ -1207,8 +1252,8 @@ def run_app():
     
     with ch6:
         st.subheader("🌍 Top Countries")
-        if 'merchant_country' in df.columns:
-            country_vol = df.groupby('merchant_country')['amount_usd'].sum().sort_values(ascending=False).head(10)
+        if agg.has('merchant_country'):
+            country_vol = agg.volume_by('merchant_country').sort_values(ascending=False).head(10)
             fig7 = px.bar(x=country_vol.index, y=country_vol.values,
                           color=country_vol.values, color_continuous_scale=[[0, '#1a1f2e'], [0.5, '#10b981'], [1, '#34d399']],
                           labels={'x': 'Country', 'y': 'Volume (USD)'})
@@ -1227,15 +1272,42 @@ def run_app():
     st.markdown("---")
     st.subheader("📋 Raw Data")
     
-    cols_to_show = st.multiselect("Select columns", df.columns.tolist(),
+    all_cols = df.columns.tolist() + [c for c in source_cols if c not in df.columns]
+    cols_to_show = st.multiselect("Select columns", all_cols,
                                    default=['txn_id', 'txn_date', 'currency', 'amount', 'amount_usd', 'product_type', 'channel'])
     
-    if cols_to_show:
-        st.dataframe(df[cols_to_show].head(100), use_container_width=True, height=400)
+    # lazily load columns that aren't part of the dashboard set
+    lazy_cols = [c for c in cols_to_show if c not in df.columns]
+    wide = None
+    if lazy_cols and streaming:
+        st.caption("Extra columns aren't loaded in streaming mode")
+        cols_to_show = [c for c in cols_to_show if c in df.columns]
+    elif lazy_cols:
+        wide_cols = CORE_COLUMNS + tuple(lazy_cols)
+        if source == "AWS S3":
+            wide = get_s3_data(columns=wide_cols, **s3_filter)
+        else:
+            wide = generate_sample(columns=wide_cols)
+        # filtering keeps the original row index, so the extra columns line up
+        if wide is not None and len(wide) == loaded_rows:
+            df = df.join(wide.loc[df.index, [c for c in lazy_cols if c in wide.columns]])
+        cols_to_show = [c for c in cols_to_show if c in df.columns]
     
-    # download button
-    st.download_button("📥 Download CSV", df.to_csv(index=False).encode('utf-8'),
-                       "fx_data_export.csv", "text/csv")
+    if cols_to_show:
+        st.dataframe(format_ids(df[cols_to_show].head(100)), use_container_width=True, height=400)
+    
+    # download button - only the preview rows exist in streaming mode
+    if streaming:
+        st.download_button("📥 Download CSV (preview)",
+                           format_ids(df).to_csv(index=False).encode('utf-8'), "fx_data_export.csv", "text/csv")
+    elif st.button("📦 Prepare CSV", help="formats every filtered row - slow for big selections"):
+        # only built when asked, so reruns and cached views skip it
+        export = filter_index.select(dataset, applied_dates, **filters)
+        extra = [c for c in df.columns if c not in export.columns]
+        if extra:
+            export = export.join(wide.loc[export.index, extra])
+        st.download_button("📥 Download CSV", format_ids(export).to_csv(index=False).encode('utf-8'),
+                           "fx_data_export.csv", "text/csv")
     
     # footer
     st.markdown("---")
@@ -0,0 +1,823 @@
+"""
+FX Aggregates
+-------------
+Rollups behind the summary, anomaly panel, AI context and charts in
+app.py and dashboard.py, answered from a per-dataset cube.
+"""
+
+import multiprocessing
+import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+import numpy as np
+import pandas as pd
+
+from fx_data import (
+    CORE_COLUMNS, S3_BUCKET, S3_PREFIX, STREAM_BATCH_ROWS, concat_frames, currency_partition_groups, dataset_version,
+    date_slice, format_ids, dataset_source, derived_for, get_derived_cache, get_filter_index, get_s3_client,
+    iter_dataset_batches, select_rows, sort_by_date, stream_version
+)
+from fx_anomalies import ANOMALY_THRESHOLD, SEVERE_THRESHOLD, StreamedBursts, get_anomaly_scores, get_velocity_bursts
+from fx_rollups import rollup_cells, rollups_match
+from fx_scoring import SCORE_GROUPS, IncrementalScorer, empty_stats, group_scales, group_stats, merge_stats, score_rows
+from fx_sketches import HLL_PRECISION, estimate, get_customer_sketches, hash_values, register_updates
+
+# Cube dimensions - every filter and chart is a sum or count over these
+ROLLUP_DIMENSIONS = ('txn_date', 'currency', 'product_type', 'channel', 'merchant_country')
+
+TOP_COLUMNS = ('txn_id', 'amount_usd', 'currency', 'product_type')
+
+# Largest transactions kept per cell of the top-k index, and the default
+# length of the top transactions lists - override with FX_TOP_N
+TOP_N = int(os.environ.get("FX_TOP_N", "5"))
+
+# Grain of the top-k index - the date partitions and the filter dimensions
+TOP_DIMENSIONS = ('txn_date', 'currency', 'product_type', 'channel')
+
+# Additive measures stored per cube cell
+MEASURES = ('volume', 'count')
+
+# Rollups every dashboard draws - computed up front for memoized views
+PANEL_ROLLUPS = (
+    ('currency',), ('product_type',), ('channel',), ('merchant_country',), ('txn_date',), ('txn_date', 'currency'),
+)
+
+# Time granularities of the trend charts -> pandas period codes
+GRANULARITIES = {'Daily': 'D', 'Weekly': 'W', 'Monthly': 'M'}
+
+# Selections up to this many rows count distinct customers exactly;
+# larger ones merge HyperLogLog sketches - override with FX_EXACT_DISTINCT_ROWS
+EXACT_DISTINCT_ROWS = int(os.environ.get("FX_EXACT_DISTINCT_ROWS", "200000"))
+
+# Worker processes for streamed aggregation - one per group of currency partitions.
+# 1 runs in-process; "auto" uses every core - override with FX_WORKERS
+_WORKERS = os.environ.get("FX_WORKERS", "1").strip().lower()
+AGGREGATE_WORKERS = (os.cpu_count() or 1) if _WORKERS == "auto" else max(1, int(_WORKERS))
+
+# Memory budget for memoized views - override with FX_VIEW_CACHE_MB
+VIEW_CACHE_MAX_BYTES = int(float(os.environ.get("FX_VIEW_CACHE_MB", "256")) * 1024 * 1024)
+
+# The streamed aggregates don't need txn_ts - velocity bursts take their own
+# narrow, date-ordered pass over BURST_COLUMNS (see stream_bursts)
+STREAM_COLUMNS = tuple(col for col in CORE_COLUMNS if col != 'txn_ts')
+BURST_DIMENSIONS = tuple(col for col in ROLLUP_DIMENSIONS if col != 'txn_date')
+BURST_COLUMNS = ('customer_id', 'txn_ts', 'txn_date', 'amount_usd', *BURST_DIMENSIONS)
+
+
+def build_cells(df):
+    """Group df once by every dimension it has into additive measure cells.
+
+    Returns a flat, txn_date-sorted frame with the dimension columns and
+    MEASURES, so the fx_data filters (date_slice, select_rows) apply to it
+    the same way they apply to transactions.
+    """
+    dimensions = [col for col in ROLLUP_DIMENSIONS if col in df.columns]
+    amounts = df['amount_usd']
+    measures = pd.DataFrame({
+        'volume': amounts,
+        'count': np.ones(len(df), dtype='int64'),
+    }, index=df.index)
+    if not dimensions:
+        return measures.sum().to_frame().T
+    for col in dimensions:
+        measures[col] = df[col]
+    cells = measures.groupby(dimensions, observed=True, dropna=False).sum().reset_index()
+    return sort_by_date(cells)
+
+
+def distinct_customers(df):
+    return df['customer_id'].nunique() if 'customer_id' in df.columns else 0
+
+
+def top_rows(df, n=TOP_N):
+    """The n largest transactions by amount_usd, TOP_COLUMNS only."""
+    return df.nlargest(n, 'amount_usd')[[col for col in TOP_COLUMNS if col in df.columns]]
+
+
+def _top_per_cell(amounts, cells, n):
+    """Sorted positions of the n largest amounts per cell code (ties in row order)."""
+    n_cells = int(cells.max()) + 1 if len(cells) else 0
+    # the n-th largest of a cell is at least the smallest of the cell's maxima over
+    # n disjoint (interleaved) row subsets, which rules out most rows before anything is sorted
+    bound = np.full(n_cells, np.inf)
+    for k in range(n):
+        best = pd.Series(amounts[k::n]).groupby(cells[k::n]).max()
+        bound = np.minimum(bound, best.reindex(range(n_cells)).fillna(-np.inf).to_numpy())
+    candidates = np.flatnonzero(amounts >= bound[cells])
+    # candidates grouped by cell, largest amount first (lexsort is stable, so ties stay in row order)
+    order = candidates[np.lexsort((-amounts[candidates], cells[candidates]))]
+    ordered = cells[order]
+    starts = np.flatnonzero(np.r_[True, ordered[1:] != ordered[:-1]])
+    rank = np.arange(len(order)) - np.repeat(starts, np.diff(np.r_[starts, len(order)]))
+    return np.sort(order[rank < n])
+
+
+class TopIndex:
+    """The n largest transactions of every date x currency x product x channel cell.
+
+    The top n of any filter combination are among the top n of the cells
+    it covers, so they are merged from those short lists instead of
+    sorting the filtered rows.
+    """
+
+    def __init__(self, df, n=TOP_N):
+        self.n = n
+        self.version = dataset_version(df)
+        self.dimensions = [col for col in TOP_DIMENSIONS if col in df.columns]
+        amounts = df['amount_usd'].to_numpy(dtype=np.float64)
+        if self.dimensions:
+            cells = df.groupby(self.dimensions, observed=True, sort=False, dropna=False).ngroup().to_numpy()
+        else:
+            cells = np.zeros(len(df), dtype=np.intp)
+        rows = _top_per_cell(amounts, cells, n)
+        candidates = df.iloc[rows][[*self.dimensions, 'amount_usd']].reset_index(drop=True)
+        candidates['row'] = rows
+        self.candidates = sort_by_date(candidates)
+
+    @classmethod
+    def extended(cls, held, df, start):
+        """held (built over df's first `start` rows) merged with the top rows past start."""
+        delta = cls(df.iloc[start:], held.n)
+        if delta.dimensions != held.dimensions:
+            return None
+        shifted = delta.candidates.assign(row=delta.candidates['row'] + start)
+        # held rows come first, so ties within a cell stay in row order
+        candidates = concat_frames([held.candidates, shifted])
+        if held.dimensions:
+            cells = candidates.groupby(held.dimensions, observed=True, sort=False, dropna=False).ngroup().to_numpy()
+        else:
+            cells = np.zeros(len(candidates), dtype=np.intp)
+        keep = _top_per_cell(candidates['amount_usd'].to_numpy(dtype=np.float64), cells, held.n)
+        index = cls.__new__(cls)
+        index.n = held.n
+        index.version = dataset_version(df)
+        index.dimensions = held.dimensions
+        index.candidates = sort_by_date(candidates.iloc[keep].reset_index(drop=True))
+        return index
+
+    def top(self, df, n=None, date_range=None, **equals):
+        """df's n largest transactions matching the filters (TOP_COLUMNS only).
+
+        None when the index can't answer: more than the n it keeps, or a
+        filter on a column outside its grain.
+        """
+        n = self.n if n is None else n
+        if n > self.n or any(col not in self.dimensions for col in equals):
+            return None
+        candidates = self.candidates
+        if date_range:
+            if 'txn_date' not in self.dimensions:
+                return None
+            candidates = date_slice(candidates, date_range)
+        candidates = select_rows(candidates, **equals)
+        return top_rows(df.iloc[candidates.nlargest(n, 'amount_usd')['row'].to_numpy()], n)
+
+
+def get_top_index(df):
+    return derived_for(df, 'top_index', TopIndex, TopIndex.extended)
+
+
+class Cube:
+    """Sums and counts per date x currency x product x channel x country.
+
+    Built from the unfiltered data; filter changes slice the cells
+    instead of the transactions, so the cost depends on the number of
+    cells, not rows.
+    """
+
+    def __init__(self, df):
+        self.version = dataset_version(df)
+        self.cells = build_cells(df)
+        self.dimensions = [col for col in ROLLUP_DIMENSIONS if col in self.cells.columns]
+
+    @classmethod
+    def from_cells(cls, cells, version=None):
+        """A cube over cells that were already aggregated (e.g. streamed)."""
+        cube = cls.__new__(cls)
+        cube.version = version
+        cube.cells = cells
+        cube.dimensions = [col for col in ROLLUP_DIMENSIONS if col in cells.columns]
+        return cube
+
+    @classmethod
+    def extended(cls, held, df, start):
+        """held (built over df's first `start` rows) plus the cells of the rows past start."""
+        cells = build_cells(df.iloc[start:])
+        if [col for col in ROLLUP_DIMENSIONS if col in cells.columns] != held.dimensions:
+            return None
+        return cls.from_cells(merge_cells([held.cells, cells]).reset_index(drop=True), dataset_version(df))
+
+    def slice(self, date_range=None, **equals):
+        """Cells matching the filters (a view when only dates are filtered)."""
+        cells = self.cells
+        if date_range and 'txn_date' in cells.columns:
+            cells = date_slice(cells, date_range)
+        return select_rows(cells, **equals)
+
+
+def _rollup_cube(df):
+    """A Cube over the materialized daily rollups of df's source, if they match df."""
+    source = dataset_source(df)
+    if source is None or df.empty or 'txn_date' not in df.columns:
+        return None
+    if df['txn_date'].isna().any():
+        return None  # rollups are per day, rows without a date aren't in them
+    if source.startswith('s3://'):
+        cells = rollup_cells('s3')
+    else:
+        cells = rollup_cells('sample', source)
+    if cells is None or not rollups_match(cells, df):
+        return None
+    # keep to what df was loaded with (partition pruning)
+    cells = date_slice(cells, (df['txn_date'].min(), df['txn_date'].max()))
+    if 'currency' in df.columns:
+        cells = cells[cells['currency'].isin(df['currency'].unique())]
+    return Cube.from_cells(cells.reset_index(drop=True), dataset_version(df))
+
+
+def get_cube(df):
+    """df's Cube (see derived_for).
+
+    Read from the daily rollup files (see build_rollups.py) when they
+    match the source, otherwise aggregated from df's rows.
+    """
+    return derived_for(df, 'cube', lambda df: _rollup_cube(df) or Cube(df), Cube.extended)
+
+
+class Rollups:
+    """Every aggregate the dashboards show for one filtered view.
+
+    Additive measures come from cube cells; by() re-aggregates those
+    cells per panel. Distinct customers and the largest transactions
+    aren't additive and are passed in: `customers` (an estimate when
+    customers_exact is False) and the `top` transactions frame. Anomaly
+    counts and velocity bursts are attached by set_anomalies and
+    set_bursts (None until then).
+    """
+
+    def __init__(self, cells, customers, top, customers_exact=True):
+        self.cells = cells
+        self.dimensions = [col for col in ROLLUP_DIMENSIONS if col in cells.columns]
+        totals = cells[list(MEASURES)].sum()
+        self.count = int(totals['count'])
+        self.volume = float(totals['volume'])
+        self.average = self.volume / self.count if self.count else 0.0
+        self.customers = int(customers)
+        self.customers_exact = customers_exact
+        self.top = format_ids(top)
+        self.anomalies = None
+        self.severe_anomalies = None
+        self.anomaly_groups = None
+        self.anomaly_method = None
+        self.burst_transactions = None
+        self.burst_customers = None
+        self.burst_window = None
+        self.top_bursts = None
+        self._rollups = {}
+        self._derived = {}
+
+    @classmethod
+    def from_frame(cls, df, top_n=TOP_N):
+        """Rollups for a frame with no cube - one groupby over its rows."""
+        return cls(build_cells(df), distinct_customers(df), top_rows(df, top_n))
+
+    @classmethod
+    def from_cube(cls, dataset, rows, date_range=None, top_n=TOP_N, **equals):
+        """Rollups for rows = dataset filtered by date_range and equals.
+
+        Above EXACT_DISTINCT_ROWS rows, distinct customers are estimated by
+        merging the dataset's per-cell HyperLogLog sketches. The largest
+        transactions come from the dataset's TopIndex when it can answer.
+        """
+        cells = get_cube(dataset).slice(date_range, **equals)
+        top = get_top_index(dataset).top(dataset, top_n, date_range, **equals)
+        if top is None:
+            top = top_rows(rows, top_n)
+        if len(rows) > EXACT_DISTINCT_ROWS and 'customer_id' in dataset.columns:
+            customers = get_customer_sketches(dataset).distinct(date_range, **equals)
+            return cls(cells, customers, top, customers_exact=False)
+        return cls(cells, distinct_customers(rows), top)
+
+    def set_anomalies(self, flagged, severe, by_group, method='robust'):
+        """Attach the view's anomaly counts and the scoring method (see fx_anomalies)."""
+        self.anomaly_method = method
+        self.anomalies = flagged
+        self.severe_anomalies = severe
+        self.anomaly_groups = by_group
+        return self
+
+    def set_bursts(self, transactions, customers, top, window=None):
+        """Attach the view's velocity bursts and their window label (see fx_anomalies.VelocityBursts)."""
+        self.burst_transactions = transactions
+        self.burst_customers = customers
+        self.burst_window = window
+        self.top_bursts = top
+        return self
+
+    def anomaly_rate(self):
+        """Flagged share of the view's transactions in percent, or None without scores."""
+        if self.anomalies is None:
+            return None
+        return self.anomalies / self.count * 100 if self.count else 0.0
+
+    def has(self, dim):
+        return dim in self.dimensions
+
+    def derived(self, name, build):
+        """build(), computed once per view and kept with it (e.g. the AI context).
+
+        Views are memoized per (dataset version, filters), so this is too.
+        """
+        if name not in self._derived:
+            self._derived[name] = build()
+        return self._derived[name]
+
+    def by(self, *dims):
+        """'volume' and 'count' per value of dims, sorted by dims."""
+        if dims not in self._rollups:
+            self._rollups[dims] = self.cells.groupby(list(dims), observed=True, dropna=False)[['volume', 'count']].sum()
+        return self._rollups[dims]
+
+    def volume_by(self, *dims):
+        """USD volume per value of dims, as a Series named amount_usd."""
+        return self.by(*dims)['volume'].rename('amount_usd')
+
+    def count_by(self, *dims):
+        return self.by(*dims)['count']
+
+    def by_period(self, freq='D', *dims):
+        """by('txn_date', *dims) with dates bucketed to freq ('D', 'W' or 'M').
+
+        Resamples the memoized daily rollup, not the cells, so the cost
+        depends on the number of days. Periods are labelled by their
+        first day.
+        """
+        if freq == 'D':
+            return self.by('txn_date', *dims)
+        key = ('period', freq, *dims)
+        if key not in self._rollups:
+            daily = self.by('txn_date', *dims)
+            index = daily.index
+            dates = index.get_level_values('txn_date') if dims else index
+            periods = pd.DatetimeIndex(dates).to_period(freq).start_time
+            keys = [periods, *[index.get_level_values(dim) for dim in dims]]
+            rollup = daily.groupby(keys, observed=True, dropna=False).sum()
+            rollup.index.names = ['txn_date', *dims]
+            self._rollups[key] = rollup
+        return self._rollups[key]
+
+    def volume_by_period(self, freq='D', *dims):
+        """USD volume per period and dims, as a Series named amount_usd."""
+        return self.by_period(freq, *dims)['volume'].rename('amount_usd')
+
+    def distinct(self, dim):
+        """Values of dim present in the view."""
+        return self.by(dim).index.tolist()
+
+    def date_bounds(self):
+        return self.cells['txn_date'].min(), self.cells['txn_date'].max()
+
+    def default_granularity(self):
+        """Daily up to ~3 months, weekly up to ~2 years, monthly beyond (a GRANULARITIES key)."""
+        start, end = self.date_bounds() if self.has('txn_date') else (None, None)
+        if pd.isna(start) or pd.isna(end):
+            return 'Daily'
+        days = (end - start).days
+        return 'Daily' if days <= 92 else 'Weekly' if days <= 730 else 'Monthly'
+
+    def top_transactions(self, columns=TOP_COLUMNS, n=None):
+        """The n (default all kept) largest transactions as records, with formatted IDs."""
+        top = self.top if n is None else self.top.head(n)
+        return top[[col for col in columns if col in top.columns]].to_dict('records')
+
+    def prepare(self):
+        """Compute the rollups behind every panel now, so a cached view has them."""
+        for dims in PANEL_ROLLUPS:
+            if all(self.has(dim) for dim in dims):
+                self.by(*dims)
+        return self
+
+    def nbytes(self):
+        """Approximate memory held, for the view cache budget."""
+        frames = [self.cells, self.top, *self._rollups.values()]
+        if self.anomaly_groups is not None:
+            frames.append(self.anomaly_groups)
+        if self.top_bursts is not None:
+            frames.append(self.top_bursts)
+        if getattr(self, 'preview', None) is not None:
+            frames.append(self.preview)
+        return int(sum(frame.memory_usage(deep=True).sum() for frame in frames))
+
+
+def merge_cells(frames):
+    """Re-aggregate cell frames from disjoint rows into one set of cells."""
+    frames = [frame for frame in frames if frame is not None]
+    if len(frames) == 1:
+        return frames[0]
+    combined = concat_frames(frames)
+    dimensions = [col for col in ROLLUP_DIMENSIONS if col in combined.columns]
+    if not dimensions:
+        return combined[list(MEASURES)].sum().to_frame().T
+    cells = combined.groupby(dimensions, observed=True, dropna=False)[list(MEASURES)].sum().reset_index()
+    return sort_by_date(cells)
+
+
+class PartialRollups:
+    """Mergeable aggregates of a stream of transaction batches.
+
+    add() folds in one batch and merge() folds in a partial built from
+    other rows, so batches (or partitions) can be aggregated in any order
+    and the result matches Rollups over all the rows at once. Only the
+    cells, the top rows, a bounded preview and the customer hashes are
+    kept - past EXACT_DISTINCT_ROWS distinct customers the hashes are
+    folded into a HyperLogLog sketch, so memory stays bounded too.
+
+    With collect_stats the per-group amount histograms are kept as well
+    (see fx_scoring); given score_stats, every batch gets modified
+    z-scores against their medians/MADs and the flagged rows are counted.
+    """
+
+    def __init__(self, top_n=TOP_N, preview_rows=0, score_stats=None, collect_stats=False):
+        self.top_n = top_n
+        self.preview_rows = preview_rows
+        self.score_stats = score_stats
+        self.score_scales = group_scales(score_stats) if score_stats is not None else None
+        self.stats = empty_stats() if collect_stats else None
+        self.flagged = 0
+        self.severe = 0
+        self.flagged_groups = None  # flagged rows per SCORE_GROUPS
+        self.rows = 0
+        self.cells = None
+        self.top = None
+        self.preview = None
+        self.customers = np.empty(0, dtype=np.uint64)  # sorted unique hashes
+        self.registers = None  # HyperLogLog registers once the exact set is dropped
+
+    def add(self, batch):
+        """Fold one batch of transactions in."""
+        if batch.empty:
+            return self
+        self.rows += len(batch)
+        self.cells = merge_cells([self.cells, build_cells(batch)])
+        self._add_top(top_rows(batch, self.top_n))
+        if self.preview_rows and (self.preview is None or len(self.preview) < self.preview_rows):
+            head = batch.head(self.preview_rows - (0 if self.preview is None else len(self.preview)))
+            self.preview = head if self.preview is None else concat_frames([self.preview, head])
+        if 'customer_id' in batch.columns:
+            self._add_customers(np.unique(hash_values(batch['customer_id'].to_numpy())))
+        if IncrementalScorer.can_score(batch):
+            if self.stats is not None:
+                self.stats = merge_stats(self.stats, group_stats(batch))
+            if self.score_stats is not None:
+                self._add_scores(batch)
+        return self
+
+    def merge(self, other):
+        """Fold in a partial built from rows disjoint from this one's."""
+        self.rows += other.rows
+        if other.cells is not None:
+            self.cells = merge_cells([self.cells, other.cells])
+        if other.top is not None:
+            self._add_top(other.top)
+        if other.preview is not None and self.preview_rows:
+            room = self.preview_rows - (0 if self.preview is None else len(self.preview))
+            if room > 0:
+                head = other.preview.head(room)
+                self.preview = head if self.preview is None else concat_frames([self.preview, head])
+        self._add_customers(other.customers, other.registers)
+        if self.stats is not None and other.stats is not None:
+            self.stats = merge_stats(self.stats, other.stats)
+        self.flagged += other.flagged
+        self.severe += other.severe
+        self._add_flagged_groups(other.flagged_groups)
+        return self
+
+    def _add_scores(self, batch):
+        # NaN (a group without statistics) compares False, so it is never flagged
+        magnitude = np.abs(score_rows(batch, self.score_scales))
+        flagged = magnitude > ANOMALY_THRESHOLD
+        self.flagged += int(flagged.sum())
+        self.severe += int((magnitude > SEVERE_THRESHOLD).sum())
+        if flagged.any():
+            rows = batch.loc[flagged, list(SCORE_GROUPS)].astype(str)
+            self._add_flagged_groups(rows.groupby(list(SCORE_GROUPS), observed=True, dropna=False).size())
+
+    def _add_flagged_groups(self, counts):
+        if counts is None:
+            return
+        if self.flagged_groups is None:
+            self.flagged_groups = counts
+        else:
+            self.flagged_groups = self.flagged_groups.add(counts, fill_value=0).astype('int64')
+
+    def _add_top(self, top):
+        if self.top is not None:
+            top = concat_frames([self.top, top])
+        self.top = top.nlargest(self.top_n, 'amount_usd').reset_index(drop=True)
+
+    def _add_customers(self, hashes, registers=None):
+        if registers is not None or self.registers is not None:
+            self._fold_into_sketch(hashes, registers)
+            return
+        self.customers = np.union1d(self.customers, hashes)
+        if len(self.customers) > EXACT_DISTINCT_ROWS:
+            self._fold_into_sketch(np.empty(0, dtype=np.uint64))
+
+    def _fold_into_sketch(self, hashes, registers=None):
+        if self.registers is None:
+            self.registers = np.zeros(1 << HLL_PRECISION, dtype=np.uint8)
+        if registers is not None:
+            np.maximum(self.registers, registers, out=self.registers)
+        hashes = np.concatenate([self.customers, hashes])
+        index, rank = register_updates(hashes, HLL_PRECISION)
+        np.maximum.at(self.registers, index, rank)
+        self.customers = np.empty(0, dtype=np.uint64)
+
+    def finish(self, dimensions=ROLLUP_DIMENSIONS):
+        """The Rollups for everything added so far (preview attached as .preview)."""
+        cells = self.cells
+        if cells is None:
+            cells = pd.DataFrame({**{col: [] for col in dimensions}, **{m: [] for m in MEASURES}})
+        if self.registers is not None:
+            customers, exact = int(round(estimate(self.registers))), False
+        else:
+            customers, exact = len(self.customers), True
+        top = self.top if self.top is not None else pd.DataFrame(columns=list(TOP_COLUMNS))
+        rollups = Rollups(cells, customers, top, customers_exact=exact)
+        rollups.preview = self.preview
+        if self.score_stats is not None:
+            by_group = pd.DataFrame(columns=[*SCORE_GROUPS, 'flagged'])
+            if self.flagged_groups is not None:
+                by_group = self.flagged_groups.rename('flagged').reset_index()
+                by_group = by_group.sort_values('flagged', ascending=False, kind='stable').reset_index(drop=True)
+            rollups.set_anomalies(self.flagged, self.severe, by_group, method='sketch')
+        return rollups
+
+
+def stream_partial(batches, top_n=TOP_N, preview_rows=0, score_stats=None, collect_stats=False, **equals):
+    """PartialRollups over the rows of batches that match equals."""
+    partial = PartialRollups(top_n, preview_rows, score_stats, collect_stats)
+    for batch in batches:
+        partial.add(select_rows(batch, **{col: value for col, value in equals.items() if col in batch.columns}))
+    return partial
+
+
+class ViewCache:
+    """LRU of Rollups keyed by filter state, bounded by a byte budget.
+
+    Keys are (dataset version, backend, date range, filters); a new dataset version
+    never matches old entries, which age out as newer views are added.
+    """
+
+    def __init__(self, max_bytes=VIEW_CACHE_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()  # key -> (value, size)
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+
+    def get(self, key, build):
+        """Return the cached value for key, building and storing it on a miss."""
+        with self._lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return entry[0]
+            self.misses += 1
+        value = build()
+        size = value.nbytes()
+        with self._lock:
+            if size > self.max_bytes or key in self.entries:
+                return value
+            self.entries[key] = (value, size)
+            self.bytes += size
+            while self.bytes > self.max_bytes:
+                _, (_, evicted) = self.entries.popitem(last=False)
+                self.bytes -= evicted
+                self.evictions += 1
+        return value
+
+    def stats(self):
+        return {'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions,
+                'entries': len(self.entries), 'bytes': self.bytes}
+
+
+_VIEWS = ViewCache()
+
+
+def get_view_cache():
+    """Return the process-wide ViewCache."""
+    return _VIEWS
+
+
+def view_rollups(dataset, date_range=None, rows=None, backend=None, **equals):
+    """Memoized Rollups for dataset filtered by date_range and equals.
+
+    `rows` (the filtered frame) is only used on a miss; when omitted it is
+    taken from the dataset's filter index. `backend` (see fx_backends)
+    answers the cells, customers and top rows instead of the in-memory
+    cube when given; anomalies and bursts always come from the loaded
+    dataset, so it must be loaded either way.
+    """
+    def build():
+        if backend is not None:
+            rollups = backend.rollups(dataset, date_range, rows, **equals)
+        else:
+            filtered = rows if rows is not None else get_filter_index(dataset).select(dataset, date_range, **equals)
+            rollups = Rollups.from_cube(dataset, filtered, date_range, **equals)
+        if 'amount_usd' in dataset.columns:
+            # scores are per dataset row, so the filter index's range + mask picks the view's
+            lo, hi, mask = get_filter_index(dataset).mask(dataset, date_range, **equals)
+            scores = get_anomaly_scores(dataset)
+            rollups.set_anomalies(*scores.summarize(lo, hi, mask), method=scores.method)
+            if 'customer_id' in dataset.columns:
+                bursts = get_velocity_bursts(dataset)
+                rollups.set_bursts(*bursts.summarize(lo, hi, mask), window=bursts.window)
+        return rollups.prepare()
+
+    version = dataset_version(dataset)
+    if version is None:
+        return build()
+    key = (version, getattr(backend, 'name', 'pandas'),
+           tuple(str(pd.Timestamp(d).date()) for d in date_range) if date_range else None,
+           tuple(sorted(equals.items())))
+    return _VIEWS.get(key, build)
+
+
+_POOL = None
+_POOL_LOCK = threading.Lock()
+
+
+def get_process_pool():
+    """The process-wide worker pool for map_reduce_partial, started on first use.
+
+    Workers are spawned rather than forked, since the dashboards run in a
+    threaded server.
+    """
+    global _POOL
+    with _POOL_LOCK:
+        if _POOL is None:
+            _POOL = ProcessPoolExecutor(max_workers=AGGREGATE_WORKERS,
+                                        mp_context=multiprocessing.get_context('spawn'))
+        return _POOL
+
+
+def _reset_process_pool():
+    global _POOL
+    with _POOL_LOCK:
+        if _POOL is not None:
+            _POOL.shutdown(wait=False, cancel_futures=True)
+        _POOL = None
+
+
+def _aggregate_partitions(source, currencies, date_range, top_n, preview_rows, equals, columns=STREAM_COLUMNS,
+                          score_stats=None, collect_stats=False):
+    """Map step (runs in a worker): PartialRollups of one group of partitions."""
+    batches = iter_dataset_batches(source, currencies, date_range, columns)
+    return stream_partial(batches, top_n, preview_rows, score_stats, collect_stats, **equals)
+
+
+def map_reduce_partial(source='sample', currencies=None, date_range=None, top_n=TOP_N, preview_rows=0,
+                       workers=None, columns=STREAM_COLUMNS, score_stats=None, collect_stats=False, **equals):
+    """PartialRollups over a dataset, aggregated in parallel per currency partition group.
+
+    S3 currency partitions are split into `workers` groups of similar
+    size; each group is streamed and aggregated in a worker process and
+    the partials are merged here. With one worker, one group, or the
+    (single file) sample, everything runs in this process.
+    """
+    workers = AGGREGATE_WORKERS if workers is None else workers
+    groups = [currencies]
+    if source == 's3' and workers > 1:
+        groups = currency_partition_groups(get_s3_client(), S3_BUCKET, S3_PREFIX, currencies, date_range, workers)
+    options = (equals, columns, score_stats, collect_stats)
+    if len(groups) <= 1:
+        return _aggregate_partitions(source, currencies, date_range, top_n, preview_rows, *options)
+    try:
+        pool = get_process_pool()
+        futures = [pool.submit(_aggregate_partitions, source, group, date_range, top_n, preview_rows, *options)
+                   for group in groups]
+        partials = [future.result() for future in futures]
+    except BrokenProcessPool:
+        # a worker died - start a fresh pool next time and finish this one here
+        _reset_process_pool()
+        return _aggregate_partitions(source, currencies, date_range, top_n, preview_rows, *options)
+    result = PartialRollups(top_n, preview_rows, score_stats, collect_stats)
+    for partial in partials:
+        result.merge(partial)
+    return result
+
+
+def streamed_cube(source='sample', currencies=None, date_range=None):
+    """A Cube built by streaming the dataset in batches instead of loading it.
+
+    Shared per stream version, like get_cube; the streaming dashboards
+    take their filter options and date bounds from it. Current daily
+    rollup files are used instead of the stream when there are any.
+    """
+    version = stream_version(source, currencies, date_range)
+
+    def build():
+        cells = rollup_cells(source, currencies=currencies, date_range=date_range)
+        if cells is not None:
+            return Cube.from_cells(cells.reset_index(drop=True), version)
+        partial = map_reduce_partial(source, currencies, date_range)
+        return Cube.from_cells(partial.finish().cells, version)
+
+    return get_derived_cache().get(('streamed_cube', version), build)
+
+
+def stream_score_stats(source='sample'):
+    """Per currency x product amount histograms of the whole dataset, streamed.
+
+    One narrow pass (amount and the two group columns) per stream version;
+    partitions are reduced in parallel like map_reduce_partial. The
+    histograms give each group's median and MAD (see fx_scoring), so the
+    streamed anomaly counts are robust ones.
+    """
+    version = stream_version(source)
+
+    def build():
+        partial = map_reduce_partial(source, top_n=0, columns=('amount_usd', *SCORE_GROUPS), collect_stats=True)
+        return partial.stats
+
+    return get_derived_cache().get(('stream_score_stats', version), build)
+
+
+def date_chunks(cells, max_rows=STREAM_BATCH_ROWS):
+    """Consecutive (first day, last day) ranges of about max_rows rows each (at least a day), from cube cells."""
+    per_day = cells.groupby('txn_date', observed=True)['count'].sum().sort_index()
+    chunks, first, rows = [], None, 0
+    for day, count in per_day.items():
+        if first is not None and rows + count > max_rows:
+            chunks.append((first, last))
+            first, rows = None, 0
+        if first is None:
+            first = day
+        last, rows = day, rows + count
+    if first is not None:
+        chunks.append((first, last))
+    return chunks
+
+
+def stream_bursts(source='sample'):
+    """StreamedBursts of the whole dataset, streamed in date order.
+
+    The days are cut into chunks of about FX_STREAM_BATCH_ROWS rows (from
+    the streamed cube's daily counts), each read with date pushdown and
+    only BURST_COLUMNS decoded. That is one pass when row groups follow
+    the dates; otherwise each chunk reads the row groups it overlaps.
+    Built once per stream version; any filter is then a lookup.
+    """
+    version = stream_version(source)
+
+    def build():
+        bursts = StreamedBursts(BURST_DIMENSIONS)
+        chunks = date_chunks(streamed_cube(source).cells)
+        for i, chunk_range in enumerate(chunks):
+            frames = list(iter_dataset_batches(source, date_range=chunk_range, columns=BURST_COLUMNS))
+            bursts.add(concat_frames(frames) if frames else None, chunks[i + 1][0] if i + 1 < len(chunks) else None)
+        return bursts.finish()
+
+    return get_derived_cache().get(('stream_bursts', version), build)
+
+
+def stream_rollups(source='sample', date_range=None, top_n=TOP_N, preview_rows=100, **equals):
+    """Memoized Rollups for a filtered view, computed out of core.
+
+    The dataset is read batch by batch (only the partitions and row
+    groups that can match) and each batch is folded into a PartialRollups,
+    so peak memory depends on FX_STREAM_BATCH_ROWS rather than the size
+    of the history. With FX_WORKERS above 1 the currency partitions are
+    aggregated in parallel (see map_reduce_partial). The first
+    preview_rows matching rows are kept as .preview for the raw data table.
+    Anomalies are robust z-scores like the loaded dashboards': two passes,
+    the first building the whole dataset's per-group amount histograms
+    (stream_score_stats), the second scoring every row against the group
+    median/MAD read off them, which match the exact ones to within
+    FX_SCORE_ACCURACY. Velocity bursts come from stream_bursts.
+    """
+    currencies = (equals['currency'],) if 'currency' in equals else None
+    version = stream_version(source, currencies, date_range)
+
+    def build():
+        stats = stream_score_stats(source)
+        partial = map_reduce_partial(source, currencies, date_range, top_n, preview_rows,
+                                     score_stats=stats, **equals)
+        rollups = partial.finish()
+        bursts = stream_bursts(source)
+        summary = bursts.summarize(date_range, **equals)
+        if summary is not None:
+            rollups.set_bursts(*summary, window=bursts.window)
+        return rollups.prepare()
+
+    key = (version, 'stream',
+           tuple(str(pd.Timestamp(d).date()) for d in date_range) if date_range else None,
+           tuple(sorted(equals.items())))
+    return _VIEWS.get(key, build)
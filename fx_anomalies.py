@@ -0,0 +1,345 @@
+"""
+FX Anomalies
+------------
+Robust anomaly scores: every transaction's amount_usd is compared with
+the median and MAD of its currency x product_type group, so a $60K
+FOREX ticket can be normal while a $5K subscription charge is not.
+
+S3 data arrives already scored (the same modified z-score, against
+per-group quantile sketches that grow as objects arrive, see fx_scoring);
+those scores are used as they are.
+
+Velocity bursts catch what single amounts can't: a customer firing many
+transactions, or a large cumulative amount, within a short window.
+"""
+
+import os
+
+import numpy as np
+import pandas as pd
+
+from fx_data import concat_frames, dataset_version, date_slice, derived_for, format_ids, select_rows
+from fx_scoring import MAD_SCALE, MEAN_AD_SCALE, SCORE_COLUMN
+
+# Peer groups the amounts are compared within
+ANOMALY_GROUPS = ('currency', 'product_type')
+
+# Modified z-score cutoffs (Iglewicz & Hoaglin recommend 3.5) - override with
+# FX_ANOMALY_THRESHOLD / FX_SEVERE_THRESHOLD
+ANOMALY_THRESHOLD = float(os.environ.get("FX_ANOMALY_THRESHOLD", "3.5"))
+SEVERE_THRESHOLD = float(os.environ.get("FX_SEVERE_THRESHOLD", "7.0"))
+
+# Velocity window and burst limits: a customer's transactions within the window
+# are a burst at VELOCITY_MAX_TXNS of them, or at two or more adding up to
+# VELOCITY_MAX_USD - override with FX_VELOCITY_WINDOW / _MAX_TXNS / _MAX_USD
+VELOCITY_WINDOW = pd.Timedelta(os.environ.get("FX_VELOCITY_WINDOW", "24h"))
+VELOCITY_MAX_TXNS = int(os.environ.get("FX_VELOCITY_MAX_TXNS", "3"))
+VELOCITY_MAX_USD = float(os.environ.get("FX_VELOCITY_MAX_USD", "100000"))
+
+# How the scores were computed, for the panels and the AI context
+ANOMALY_METHODS = {
+    'robust': "modified z-score of amount_usd vs its currency x product_type median/MAD",
+    'sketch': ("modified z-score of amount_usd vs its currency x product_type median/MAD, read off running "
+               "quantile sketches as each S3 object arrived"),
+    'mixed': ("modified z-score of amount_usd vs its currency x product_type median/MAD, from running quantile "
+              "sketches or, where none existed yet, from the loaded rows"),
+}
+
+# The same, as the anomaly panels label the counts
+ANOMALY_LABELS = {'robust': "robust z", 'sketch': "robust z, sketched", 'mixed': "robust z, partly sketched"}
+
+
+def robust_scores(amounts, codes, n_groups):
+    """Modified z-scores of amounts within their group codes, plus per-group (median, scale).
+
+    scale is MAD / 0.6745, or 1.2533 x the mean absolute deviation for
+    groups whose MAD is 0. Amounts in a group with no spread at all
+    score 0 when equal to the median and +-inf otherwise.
+    """
+    values = pd.Series(amounts, copy=False)
+    median = values.groupby(codes).median().reindex(range(n_groups)).to_numpy()
+    deviation = amounts - median[codes]
+    spread = pd.Series(np.abs(deviation), copy=False).groupby(codes)
+    scale = spread.median().reindex(range(n_groups)).to_numpy() / MAD_SCALE
+    flat = scale == 0
+    if flat.any():
+        scale[flat] = spread.mean().reindex(range(n_groups)).to_numpy()[flat] * MEAN_AD_SCALE
+    row_scale = scale[codes]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        scores = np.where(deviation == 0, 0.0, deviation / row_scale)
+    return scores.astype(np.float32), median, scale
+
+
+class AnomalyScores:
+    """Robust z-score of every row of a dataset, in the dataset's row order.
+
+    Built in one grouped pass; a filtered view's counts are sums over the
+    filter index's row range and mask, with no regrouping. Frames with a precomputed
+    anomaly_score column (method 'sketch') aren't rescored; rows it
+    leaves unscored fall back to the robust batch scores ('mixed').
+    """
+
+    def __init__(self, df):
+        self.version = dataset_version(df)
+        groups = [col for col in ANOMALY_GROUPS if col in df.columns]
+        if groups:
+            # null currency/product rows form their own peer group instead of getting no code
+            grouped = df.groupby(groups, observed=True, sort=True, dropna=False)
+            self.codes = grouped.ngroup().to_numpy()
+            self.groups = grouped.size().reset_index()[groups]
+        else:
+            self.codes = np.zeros(len(df), dtype=np.intp)
+            self.groups = pd.DataFrame(index=range(1))
+        precomputed = None
+        if SCORE_COLUMN in df.columns:
+            precomputed = df[SCORE_COLUMN].to_numpy(dtype=np.float32, na_value=np.nan)
+        missing = None if precomputed is None else np.isnan(precomputed)
+        if missing is not None and not missing.any():
+            self.method = 'sketch'
+            self.scores = precomputed
+        else:
+            amounts = df['amount_usd'].to_numpy(dtype=np.float64)
+            self.scores, median, scale = robust_scores(amounts, self.codes, len(self.groups))
+            self.groups['median_usd'] = median
+            self.groups['scale_usd'] = scale
+            self.method = 'robust'
+            if missing is not None and not missing.all():
+                self.method = 'mixed'
+                self.scores = np.where(missing, self.scores, precomputed)
+        magnitude = np.abs(self.scores)
+        self.flagged = magnitude > ANOMALY_THRESHOLD
+        self.severe = magnitude > SEVERE_THRESHOLD
+
+    @classmethod
+    def extended(cls, held, df, start):
+        """held (built over df's first `start` rows) with the rows past start appended.
+
+        Only for precomputed scores, which don't depend on the other rows;
+        robust scores are rebuilt over the whole dataset.
+        """
+        delta = cls(df.iloc[start:])
+        if held.method != 'sketch' or delta.method != 'sketch' or list(delta.groups) != list(held.groups):
+            return None
+        groups = list(held.groups.columns)
+        stacked = concat_frames([held.groups, delta.groups])
+        if groups:
+            grouped = stacked.groupby(groups, observed=True, sort=True, dropna=False)
+            ids = grouped.ngroup().to_numpy()
+            merged = grouped.size().reset_index()[groups]
+        else:
+            ids = np.zeros(len(stacked), dtype=np.intp)
+            merged = pd.DataFrame(index=range(1))
+        scores = cls.__new__(cls)
+        scores.version = dataset_version(df)
+        scores.groups = merged
+        scores.codes = np.concatenate([ids[:len(held.groups)][held.codes], ids[len(held.groups):][delta.codes]])
+        scores.method = held.method
+        for name in ('scores', 'flagged', 'severe'):
+            setattr(scores, name, np.concatenate([getattr(held, name), getattr(delta, name)]))
+        return scores
+
+    def summarize(self, lo=0, hi=None, mask=None):
+        """(flagged, severe, flagged per group) for rows [lo, hi) selected by mask."""
+        flagged, severe, codes = self.flagged[lo:hi], self.severe[lo:hi], self.codes[lo:hi]
+        if mask is not None:
+            flagged, severe, codes = flagged[mask], severe[mask], codes[mask]
+        by_group = self.groups.copy()
+        by_group['flagged'] = np.bincount(codes[flagged], minlength=len(self.groups))
+        by_group = by_group[by_group['flagged'] > 0].sort_values('flagged', ascending=False, kind='stable')
+        return int(flagged.sum()), int(severe.sum()), by_group.reset_index(drop=True)
+
+
+def get_anomaly_scores(df):
+    return derived_for(df, 'anomaly_scores', AnomalyScores, AnomalyScores.extended)
+
+
+def _timestamps(df):
+    """Transaction times in seconds, and whether they are exact.
+
+    txn_ts when the dataset has it, otherwise txn_date (day resolution).
+    """
+    if 'txn_ts' in df.columns and df['txn_ts'].notna().any():
+        return pd.to_datetime(df['txn_ts'], errors='coerce').to_numpy(dtype='datetime64[s]'), True
+    return df['txn_date'].to_numpy(dtype='datetime64[s]'), False
+
+
+def window_label(window=VELOCITY_WINDOW, exact=True):
+    """The velocity window as the panels show it: '24h', or calendar days without txn_ts."""
+    if exact:
+        return f"{window.total_seconds() / 3600:g}h"
+    # with day timestamps (t - window, t] spans whole days
+    days = max(1, int(np.ceil(window / pd.Timedelta(days=1))))
+    return "same day" if days == 1 else f"{days} calendar days"
+
+
+def burst_windows(codes, seconds, amounts, width):
+    """(transactions, USD, burst flag) of every row's window of `width` seconds, in row order.
+
+    Rows are sorted once by (customer, time) as a single int64 key -
+    customer code x span + seconds, with the span wider than the window
+    so windows never cross customers. Every window is then two
+    searchsorted calls and a cumulative-sum difference, with no
+    per-customer loop.
+    """
+    window_txns = np.zeros(len(codes), dtype=np.int32)
+    window_usd = np.zeros(len(codes), dtype=np.float64)
+    burst = np.zeros(len(codes), dtype=bool)
+    if not len(codes):
+        return window_txns, window_usd, burst
+    seconds = seconds - seconds.min()
+    span = int(seconds.max()) + width + 1
+    keys = codes.astype(np.int64) * span + seconds
+    order = np.argsort(keys)
+    keys = keys[order]
+
+    # each transaction's window is the customer's rows in (t - window, t], ties included
+    start = keys.searchsorted(keys - width, 'right')
+    end = keys.searchsorted(keys, 'right')
+    totals = np.concatenate([[0.0], np.cumsum(np.nan_to_num(amounts[order]))])
+    txns = end - start
+    usd = totals[end] - totals[start]
+    hit = (txns >= VELOCITY_MAX_TXNS) | ((txns >= 2) & (usd >= VELOCITY_MAX_USD))
+    # every row inside a qualifying window is part of the burst
+    depth = np.cumsum(np.bincount(start[hit], minlength=len(keys) + 1)
+                      - np.bincount(end[hit], minlength=len(keys) + 1))[:len(keys)]
+
+    window_txns[order] = txns
+    window_usd[order] = usd
+    burst[order] = depth > 0
+    return window_txns, window_usd, burst
+
+
+def _peaks(customers, window_txns, window_usd, top):
+    """(bursting customers, the top ones by their busiest window: most transactions, then volume)."""
+    peaks = pd.DataFrame({
+        'customer_id': customers,
+        'window_txns': window_txns,
+        'window_usd': window_usd,
+    }).sort_values(['window_txns', 'window_usd'], ascending=False, kind='stable')
+    peaks = peaks.drop_duplicates('customer_id')
+    return len(peaks), format_ids(peaks.head(top).reset_index(drop=True))
+
+
+class VelocityBursts:
+    """Rolling per-customer transaction counts and volume, in the dataset's row order.
+
+    Windows come from burst_windows. Without txn_ts they fall on whole
+    days; `window` says which (see window_label).
+    """
+
+    def __init__(self, df, window=VELOCITY_WINDOW):
+        self.version = dataset_version(df)
+        self.customers = df['customer_id'].to_numpy()
+        self.window_txns = np.zeros(len(df), dtype=np.int32)
+        self.window_usd = np.zeros(len(df), dtype=np.float64)
+        self.burst = np.zeros(len(df), dtype=bool)
+
+        codes, _ = pd.factorize(df['customer_id'])
+        times, exact = _timestamps(df)
+        self.window = window_label(window, exact)
+        valid = np.flatnonzero((codes >= 0) & ~np.isnat(times))
+        if not len(valid):
+            return
+        amounts = df['amount_usd'].to_numpy(dtype=np.float64)[valid]
+        txns, usd, burst = burst_windows(codes[valid], times[valid].astype(np.int64), amounts,
+                                         int(window.total_seconds()))
+        self.window_txns[valid] = txns
+        self.window_usd[valid] = usd
+        self.burst[valid] = burst
+
+    def summarize(self, lo=0, hi=None, mask=None, top=5):
+        """(burst transactions, bursting customers, top customers) for rows [lo, hi) selected by mask."""
+        burst = self.burst[lo:hi]
+        rows = np.flatnonzero(burst if mask is None else burst & mask) + lo
+        return (len(rows), *_peaks(self.customers[rows], self.window_txns[rows], self.window_usd[rows], top))
+
+
+class StreamedBursts:
+    """Velocity bursts of a dataset fed in date order, one chunk of days at a time.
+
+    Each chunk is windowed together with the tail of earlier rows that
+    its windows can still reach, so every new row's window is complete;
+    a qualifying window also marks the tail rows it covers. Rows leave
+    the tail once no later row can reach them, and only the burst rows
+    among them are kept, with their dimensions and window, so summarize()
+    answers any filter. Memory is one chunk and one window of rows, plus
+    the burst rows.
+    """
+
+    def __init__(self, dimensions=(), window=VELOCITY_WINDOW):
+        self.dimensions = list(dimensions)
+        self.width = int(window.total_seconds())
+        self._window = window
+        self.window = None  # window_label, once the first rows show whether txn_ts is there
+        self.exact = None
+        self.tail = None
+        self.parts = []
+        self.rows = None
+
+    def _times(self, chunk):
+        if self.exact is None:
+            _, self.exact = _timestamps(chunk)
+            self.window = window_label(self._window, self.exact)
+        if self.exact:
+            return pd.to_datetime(chunk['txn_ts'], errors='coerce').to_numpy(dtype='datetime64[s]')
+        return chunk['txn_date'].to_numpy(dtype='datetime64[s]')
+
+    def add(self, chunk, next_start=None):
+        """Fold in one chunk of days; next_start is the first day of the next chunk (None after the last)."""
+        frame = self.tail
+        if chunk is not None and len(chunk):
+            times = self._times(chunk)
+            valid = ~np.isnat(times) & chunk['customer_id'].notna().to_numpy()
+            keep = [col for col in ('customer_id', 'txn_date', *self.dimensions) if col in chunk.columns]
+            rows = chunk.loc[valid, keep].reset_index(drop=True)
+            rows['seconds'] = times[valid].astype(np.int64)
+            rows['amount_usd'] = chunk['amount_usd'].to_numpy(dtype=np.float64)[valid]
+            rows = rows.assign(window_txns=np.int32(0), window_usd=0.0, burst=False)
+            held = 0 if frame is None else len(frame)
+            frame = rows if frame is None else concat_frames([frame, rows])
+            codes, _ = pd.factorize(frame['customer_id'])
+            txns, usd, burst = burst_windows(codes, frame['seconds'].to_numpy(), frame['amount_usd'].to_numpy(),
+                                             self.width)
+            # tail rows keep the windows of their own chunk, which were complete
+            txns[:held] = frame['window_txns'].to_numpy()[:held]
+            usd[:held] = frame['window_usd'].to_numpy()[:held]
+            burst[:held] |= frame['burst'].to_numpy()[:held]
+            frame = frame.assign(window_txns=txns, window_usd=usd, burst=burst)
+        if frame is None:
+            return self
+        if next_start is None:
+            done = np.ones(len(frame), dtype=bool)
+        else:
+            # a later row at u reaches back to u - window, and u >= next_start
+            done = frame['seconds'].to_numpy() <= pd.Timestamp(next_start).value // 10 ** 9 - self.width
+        finished = frame[done]
+        self.parts.append(finished[finished['burst'].to_numpy()])
+        self.tail = frame[~done].reset_index(drop=True)
+        return self
+
+    def finish(self):
+        """Flush the tail; the burst rows are then final."""
+        self.add(None)
+        self.rows = concat_frames(self.parts) if self.parts else None
+        self.tail, self.parts = None, []
+        return self
+
+    def summarize(self, date_range=None, top=5, **equals):
+        """(burst transactions, bursting customers, top customers) for the filters, or None.
+
+        None when a filter is on a column the burst rows don't keep.
+        """
+        if any(col not in self.dimensions for col in equals):
+            return None
+        rows = self.rows
+        if rows is None:
+            return 0, *_peaks([], [], [], top)
+        if date_range:
+            rows = date_slice(rows, date_range)
+        rows = select_rows(rows, **equals)
+        return (len(rows), *_peaks(rows['customer_id'].to_numpy(), rows['window_txns'].to_numpy(),
+                                   rows['window_usd'].to_numpy(), top))
+
+
+def get_velocity_bursts(df):
+    return derived_for(df, 'velocity_bursts', VelocityBursts)
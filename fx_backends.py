@@ -0,0 +1,176 @@
+"""
+FX Query Backends
+-----------------
+Interchangeable engines for the dashboards' aggregation, filter and
+top-N queries. pandas (the in-memory cube) is the default; DuckDB and
+Polars run the same queries multi-threaded. Pick one with FX_BACKEND.
+
+The engines only answer the panel aggregates (cells, distinct customers,
+top rows), and they query the loaded dataset itself - the same snapshot
+the filter options, raw data table, anomaly scores and velocity bursts
+come from - so every panel describes the same rows. They apply the
+filters themselves and ignore `rows` (the pandas selection of those
+same rows).
+"""
+
+import os
+
+import pandas as pd
+
+from fx_aggregates import (
+    MEASURES, ROLLUP_DIMENSIONS, TOP_COLUMNS, TOP_N, Rollups
+)
+from fx_data import derived_for, get_filter_index, prepare_frame, sort_by_date
+
+# Optional engines
+try:
+    import duckdb
+    DUCKDB_AVAILABLE = True
+except ImportError:
+    DUCKDB_AVAILABLE = False
+
+try:
+    import polars as pl
+    POLARS_AVAILABLE = True
+except ImportError:
+    POLARS_AVAILABLE = False
+
+# pandas | duckdb | polars
+BACKEND = os.environ.get("FX_BACKEND", "pandas").lower()
+
+
+def _normalize_cells(cells, dimensions):
+    """Engine output -> the cube cell layout Rollups expects."""
+    cells = prepare_frame(cells)
+    cells = cells[[*dimensions, *MEASURES]]
+    return sort_by_date(cells)
+
+
+class PandasBackend:
+    """The in-memory cube, filter index and sketches (the default)."""
+
+    name = 'pandas'
+
+    def rollups(self, dataset, date_range=None, rows=None, **equals):
+        if rows is None:
+            rows = get_filter_index(dataset).select(dataset, date_range, **equals)
+        return Rollups.from_cube(dataset, rows, date_range, **equals)
+
+
+class DuckDBBackend:
+    """Runs the queries in DuckDB over the loaded dataset.
+
+    DuckDB scans the pandas columns in place (no copy) on all cores, and
+    only the small aggregate results come back to pandas.
+    """
+
+    name = 'duckdb'
+
+    def __init__(self):
+        self.con = duckdb.connect()
+
+    def _where(self, date_range, equals):
+        clauses, params = [], []
+        if date_range:
+            clauses.append("CAST(txn_date AS DATE) BETWEEN ? AND ?")
+            params += [pd.Timestamp(date_range[0]).date(), pd.Timestamp(date_range[1]).date()]
+        for col, value in equals.items():
+            clauses.append(f'"{col}" = ?')
+            params.append(value)
+        return (" WHERE " + " AND ".join(clauses)) if clauses else "", params
+
+    def query(self, dataset, date_range=None, dimensions=ROLLUP_DIMENSIONS, top_n=TOP_N, **equals):
+        """(cells, distinct customers, top rows) of the dataset's matching rows."""
+        # a cursor per query: the connection is shared by every session thread
+        con = self.con.cursor()
+        con.register('fx_rows', dataset)
+        where, params = self._where(date_range, equals)
+        keys = ", ".join('CAST(txn_date AS DATE) AS txn_date' if col == 'txn_date' else f'"{col}"'
+                         for col in dimensions)
+        try:
+            cells = con.execute(
+                f"SELECT {keys}, SUM(amount_usd) AS volume, COUNT(*) AS count "
+                f"FROM fx_rows{where} GROUP BY ALL",
+                params
+            ).df()
+            customers = con.execute(f"SELECT COUNT(DISTINCT customer_id) FROM fx_rows{where}", params).fetchone()[0]
+            top = con.execute(
+                f"SELECT {', '.join(TOP_COLUMNS)} FROM fx_rows{where} ORDER BY amount_usd DESC LIMIT {int(top_n)}",
+                params
+            ).df()
+        finally:
+            con.close()
+        return _normalize_cells(cells, dimensions), customers, top
+
+    def rollups(self, dataset, date_range=None, rows=None, **equals):
+        dimensions = [col for col in ROLLUP_DIMENSIONS if col in dataset.columns]
+        cells, customers, top = self.query(dataset, date_range, dimensions, **equals)
+        return Rollups(cells, customers, top)
+
+
+def polars_frame(df):
+    """The dataset as a Polars frame, converted once per dataset version."""
+    columns = [col for col in (*ROLLUP_DIMENSIONS, *TOP_COLUMNS, 'customer_id') if col in df.columns]
+    return derived_for(df, 'polars', lambda df: pl.from_pandas(df[list(dict.fromkeys(columns))]))
+
+
+class PolarsBackend:
+    """Runs the queries as Polars lazy plans over the loaded dataset.
+
+    The dataset is converted to Arrow once per version (numeric columns
+    without a copy); the filters and column selection are planned
+    together and executed on all cores.
+    """
+
+    name = 'polars'
+
+    def query(self, dataset, date_range=None, dimensions=ROLLUP_DIMENSIONS, top_n=TOP_N, **equals):
+        """(cells, distinct customers, top rows) of the dataset's matching rows."""
+        frame = polars_frame(dataset).lazy().with_columns(pl.col('txn_date').cast(pl.Date))
+        if date_range:
+            start, end = pd.Timestamp(date_range[0]).date(), pd.Timestamp(date_range[1]).date()
+            frame = frame.filter(pl.col('txn_date').is_between(start, end))
+        for col, value in equals.items():
+            frame = frame.filter(pl.col(col).cast(pl.String) == value)
+        amount = pl.col('amount_usd')
+        cells, summary, top = pl.collect_all([
+            frame.group_by(list(dimensions)).agg(
+                amount.sum().alias('volume'),
+                pl.len().alias('count'),
+            ),
+            frame.select(pl.col('customer_id').n_unique()),
+            frame.select(list(TOP_COLUMNS)).top_k(top_n, by='amount_usd'),
+        ])
+        top = top.to_pandas().sort_values('amount_usd', ascending=False)
+        return _normalize_cells(cells.to_pandas(), dimensions), summary.item(), top
+
+    def rollups(self, dataset, date_range=None, rows=None, **equals):
+        dimensions = [col for col in ROLLUP_DIMENSIONS if col in dataset.columns]
+        cells, customers, top = self.query(dataset, date_range, dimensions, **equals)
+        return Rollups(cells, customers, top)
+
+
+_BACKENDS = {}
+
+
+def available_backends():
+    """Names of the backends that can run here."""
+    names = ['pandas']
+    if DUCKDB_AVAILABLE:
+        names.append('duckdb')
+    if POLARS_AVAILABLE:
+        names.append('polars')
+    return names
+
+
+def get_backend(name=None):
+    """The process-wide backend for name (default FX_BACKEND).
+
+    Unknown or uninstalled engines fall back to pandas.
+    """
+    name = (name or BACKEND).lower()
+    if name not in available_backends():
+        name = 'pandas'
+    if name not in _BACKENDS:
+        _BACKENDS[name] = {'pandas': PandasBackend, 'duckdb': DuckDBBackend, 'polars': PolarsBackend}[name]()
+    return _BACKENDS[name]
@@ -0,0 +1,1645 @@
+"""
+FX Data Access
+--------------
+Loading, normalization and caching shared by app.py and dashboard.py.
+Datasets are cached once per process, however many apps use them.
+"""
+
+import glob
+import hashlib
+import io
+import json
+import os
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+
+import boto3
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.ipc as ipc
+import pyarrow.parquet as pq
+
+from fx_scoring import SCORE_ACCURACY, SCORE_COLUMN, IncrementalScorer
+
+# Cached frames are shared between sessions; copy-on-write keeps one caller's
+# writes from reaching them. It is always on from pandas 3 (and deprecated there).
+if int(pd.__version__.split('.')[0]) < 3:
+    pd.options.mode.copy_on_write = True
+
+# Pipeline output location (written by the EMR normalization job)
+S3_REGION = 'us-east-2'
+S3_BUCKET = 'apoorv-financial-pipeline-2025'
+S3_PREFIX = 'output/normalized/'
+
+# Parallel S3 downloads - override with FX_S3_WORKERS
+S3_MAX_WORKERS = int(os.environ.get("FX_S3_WORKERS", "16"))
+
+# Point at a local S3 stand-in (MinIO, moto server) with FX_S3_ENDPOINT_URL
+S3_ENDPOINT_URL = os.environ.get("FX_S3_ENDPOINT_URL") or None
+
+# Local disk cache of downloaded objects - FX_CACHE_MAX_MB=0 turns it off
+DISK_CACHE_DIR = os.environ.get("FX_CACHE_DIR", os.path.join(os.path.expanduser("~"), ".cache", "fx-intelligence"))
+DISK_CACHE_MAX_BYTES = int(float(os.environ.get("FX_CACHE_MAX_MB", "2048")) * 1024 * 1024)
+
+# Arrow IPC snapshots of the loaded dataset, memory-mapped on startup
+SNAPSHOT_DIR = os.environ.get("FX_SNAPSHOT_DIR", os.path.join(DISK_CACHE_DIR, "snapshots"))
+# Minimum seconds between rewriting the S3 snapshot after changes
+SNAPSHOT_INTERVAL = float(os.environ.get("FX_SNAPSHOT_INTERVAL", "600"))
+
+SAMPLE_PATH = 'sample_normalized.parquet'
+
+# Seconds a loaded S3 dataset is reused before the bucket is listed again
+DATASET_TTL = float(os.environ.get("FX_DATASET_TTL", "60"))
+# Seconds the partition listing is reused
+PARTITIONS_TTL = 300
+
+# Loaded datasets kept in memory, and separately the structures derived from
+# them (cubes, filter indexes, scores, ...) - FX_DATASET_CACHE_ENTRIES / FX_DERIVED_CACHE_ENTRIES
+DATASET_CACHE_ENTRIES = int(os.environ.get("FX_DATASET_CACHE_ENTRIES", "16"))
+DERIVED_CACHE_ENTRIES = int(os.environ.get("FX_DERIVED_CACHE_ENTRIES", "48"))
+
+# Rows decoded at a time in streaming (out-of-core) mode - override with FX_STREAM_BATCH_ROWS
+STREAM_BATCH_ROWS = int(os.environ.get("FX_STREAM_BATCH_ROWS", "250000"))
+
+# Default the dashboards to streaming mode - FX_STREAMING=1
+STREAMING = os.environ.get("FX_STREAMING", "0") == "1"
+
+# Low-cardinality dimensions kept as categoricals
+DIMENSION_COLUMNS = (
+    'currency', 'product_type', 'channel', 'merchant_country', 'customer_segment', 'base_currency',
+)
+
+# ID columns kept as integers: column -> (prefix, zero-padded width)
+ID_FORMATS = {'txn_id': ('TXN', 7), 'customer_id': ('C', 5)}
+
+# Hive partition names that hold the transaction date
+DATE_PARTITIONS = ('txn_date', 'date')
+
+# Columns the dashboards' panels, filters and AI context read (txn_ts for
+# the velocity-burst windows). Anything else (customer_segment, ...) is only
+# loaded for the raw table.
+CORE_COLUMNS = (
+    'txn_id', 'customer_id', 'txn_date', 'txn_ts', 'amount', 'amount_usd',
+    'currency', 'product_type', 'channel', 'merchant_country',
+)
+
+
+def get_s3_client():
+    """Create the S3 client used by the loaders."""
+    return boto3.client('s3', region_name=S3_REGION, endpoint_url=S3_ENDPOINT_URL)
+
+
+def partition_values(key):
+    """Parse the Hive-style `name=value` directories of a key into a dict."""
+    values = {}
+    for part in key.split('/')[:-1]:
+        if '=' in part:
+            name, value = part.split('=', 1)
+            values[name] = value
+    return values
+
+
+def partition_currency(key):
+    """Return the currency from a `currency=XXX/` partition path, or None."""
+    return partition_values(key).get('currency')
+
+
+def partition_date(key):
+    """Return the date partition of a key as a Timestamp, or None."""
+    values = partition_values(key)
+    for name in DATE_PARTITIONS:
+        if name in values:
+            try:
+                return pd.Timestamp(values[name])
+            except ValueError:
+                return None
+    return None
+
+
+def key_in_partitions(key, currencies=None, date_range=None):
+    """Check a key against the currency/date filters.
+
+    Keys without the matching partition directory are always kept, so
+    unpartitioned files are never dropped by mistake.
+    """
+    if currencies:
+        currency = partition_currency(key)
+        if currency is not None and currency not in currencies:
+            return False
+    if date_range:
+        day = partition_date(key)
+        if day is not None and not (pd.Timestamp(date_range[0]) <= day <= pd.Timestamp(date_range[1])):
+            return False
+    return True
+
+
+def _list_objects(s3, bucket, prefix):
+    objects = {}
+    paginator = s3.get_paginator('list_objects_v2')
+    for page in paginator.paginate(Bucket=bucket, Prefix=prefix):
+        if 'Contents' not in page:
+            continue
+        for obj in page['Contents']:
+            if obj['Key'].endswith('.parquet'):
+                objects[obj['Key']] = (obj.get('ETag'), obj.get('LastModified'), obj.get('Size'))
+    return objects
+
+
+def list_parquet_objects(s3, bucket=S3_BUCKET, prefix=S3_PREFIX, currencies=None, date_range=None):
+    """List parquet objects under the prefix as {key: (etag, last_modified, size)}.
+
+    With `currencies` only the matching `currency=XXX/` prefixes are listed.
+    With `date_range` (start, end) keys from date partitions outside the
+    range are skipped.
+    """
+    if currencies:
+        objects = {}
+        for currency in sorted(currencies):
+            objects.update(_list_objects(s3, bucket, f"{prefix}currency={currency}/"))
+        if not objects:
+            # layout isn't partitioned by currency - list everything
+            objects = _list_objects(s3, bucket, prefix)
+    else:
+        objects = _list_objects(s3, bucket, prefix)
+    return {key: meta for key, meta in objects.items() if key_in_partitions(key, currencies, date_range)}
+
+
+def currency_partition_groups(s3, bucket=S3_BUCKET, prefix=S3_PREFIX, currencies=None, date_range=None,
+                              groups=1):
+    """Split the matching currency partitions into at most `groups` tuples of similar total size.
+
+    Largest partitions are placed first, each into the lightest group so
+    far. Returns [currencies] when the layout isn't partitioned by currency.
+    """
+    sizes = {}
+    for key, meta in list_parquet_objects(s3, bucket, prefix, currencies, date_range).items():
+        currency = partition_currency(key)
+        sizes[currency] = sizes.get(currency, 0) + (meta[2] or 0)
+    if not sizes or None in sizes:
+        return [currencies]
+    buckets = [[] for _ in range(max(1, min(groups, len(sizes))))]
+    loads = [0] * len(buckets)
+    for currency in sorted(sizes, key=sizes.get, reverse=True):
+        lightest = loads.index(min(loads))
+        buckets[lightest].append(currency)
+        loads[lightest] += sizes[currency]
+    return [tuple(sorted(bucket)) for bucket in buckets]
+
+
+def list_parquet_keys(s3, bucket=S3_BUCKET, prefix=S3_PREFIX, currencies=None, date_range=None):
+    """List parquet object keys under the prefix (see list_parquet_objects)."""
+    return list(list_parquet_objects(s3, bucket, prefix, currencies, date_range))
+
+
+def list_partitions(s3, bucket=S3_BUCKET, prefix=S3_PREFIX):
+    """Return the currency and date partitions present under the prefix.
+
+    Used to fill the filter widgets without downloading any data.
+    `date_bounds` comes from the date partitions, or from the txn_date
+    statistics in the parquet footers when the layout has none.
+    """
+    objects = _list_objects(s3, bucket, prefix)
+    currencies, dates = set(), set()
+    for key in objects:
+        currency = partition_currency(key)
+        if currency:
+            currencies.add(currency)
+        day = partition_date(key)
+        if day is not None:
+            dates.add(day)
+    dates = sorted(dates)
+    if dates:
+        date_bounds = (dates[0], dates[-1])
+    else:
+        date_bounds = footer_date_bounds(s3, bucket, objects)
+    return {'currencies': sorted(currencies), 'dates': dates, 'date_bounds': date_bounds}
+
+
+def parse_ids(values, prefix, width):
+    """Parse 'TXN0000001'-style IDs into integers.
+
+    Returns None unless every value round-trips through format_ids, so
+    the conversion is always reversible.
+    """
+    text = values.astype(str)
+    if not text.str.fullmatch(rf"{prefix}[0-9]+").all():
+        return None
+    digits = text.str.slice(len(prefix))
+    # zfill(width) gives back exactly these digits: width of them, or more with no leading zero
+    length = digits.str.len()
+    if not ((length == width) | ((length > width) & ~digits.str.startswith('0'))).all():
+        return None
+    return pd.to_numeric(digits.astype('int64'), downcast='integer')
+
+
+def format_ids(df):
+    """Return df with integer ID columns formatted back to their strings."""
+    converted = {
+        col: prefix + df[col].astype(str).str.zfill(width)
+        for col, (prefix, width) in ID_FORMATS.items()
+        if col in df.columns and pd.api.types.is_integer_dtype(df[col])
+    }
+    return df.assign(**converted) if converted else df
+
+
+def compact_frame(df):
+    """Shrink a loaded frame in place.
+
+    Dimensions become categoricals, IDs become integers and numeric
+    columns are downcast when the values survive it exactly. The original
+    bytes per column are kept in `df.attrs['memory_before']`.
+    """
+    before = df.memory_usage(index=False, deep=True).to_dict()
+    for col in DIMENSION_COLUMNS:
+        if col in df.columns and not isinstance(df[col].dtype, pd.CategoricalDtype):
+            df[col] = df[col].astype('category')
+    for col, (prefix, width) in ID_FORMATS.items():
+        if col in df.columns and not pd.api.types.is_integer_dtype(df[col]):
+            ids = parse_ids(df[col], prefix, width)
+            if ids is not None:
+                df[col] = ids
+    for col in df.select_dtypes(include='integer').columns:
+        df[col] = pd.to_numeric(df[col], downcast='integer')
+    for col in df.select_dtypes(include='float64').columns:
+        narrow = df[col].astype('float32')
+        if narrow.astype('float64').equals(df[col]):
+            df[col] = narrow
+    df.attrs['memory_before'] = {col: int(size) for col, size in before.items()}
+    return df
+
+
+def prepare_frame(df):
+    """Fix column types once at load time (txn_date, txn_ts as datetime64) and compact."""
+    if 'txn_date' in df.columns and not pd.api.types.is_datetime64_any_dtype(df['txn_date']):
+        df['txn_date'] = pd.to_datetime(df['txn_date'])
+    if 'txn_ts' in df.columns and not pd.api.types.is_datetime64_any_dtype(df['txn_ts']):
+        df['txn_ts'] = pd.to_datetime(df['txn_ts'], errors='coerce')
+    return compact_frame(df)
+
+
+def sort_by_date(df):
+    """Order rows by txn_date (stable) and mark the frame as date-sorted.
+
+    Sorting happens once at load; date filters on a sorted frame are
+    plain slices, so they don't copy any data.
+    """
+    if df is None or 'txn_date' not in df.columns:
+        return df
+    if not df['txn_date'].is_monotonic_increasing:
+        df = df.sort_values('txn_date', kind='stable', ignore_index=True)
+    df.attrs['sorted_by'] = 'txn_date'
+    return df
+
+
+def date_slice(df, date_range):
+    """Rows with txn_date within date_range (inclusive).
+
+    A zero-copy slice when the frame is date-sorted, a boolean mask otherwise.
+    """
+    start, end = pd.Timestamp(date_range[0]), pd.Timestamp(date_range[1])
+    if df.attrs.get('sorted_by') == 'txn_date':
+        dates = df['txn_date'].to_numpy()
+        lo = dates.searchsorted(start.to_datetime64(), 'left')
+        hi = dates.searchsorted(end.to_datetime64(), 'right')
+        return df.iloc[lo:hi]
+    return df[(df['txn_date'] >= start) & (df['txn_date'] <= end)]
+
+
+def row_mask(df, **equals):
+    """Boolean array for rows where every column equals its value, or None."""
+    mask = None
+    for col, value in equals.items():
+        match = (df[col] == value).to_numpy()
+        mask = match if mask is None else mask & match
+    return mask
+
+
+def select_rows(df, **equals):
+    """Apply all equality filters in one pass; df itself when there are none."""
+    mask = row_mask(df, **equals)
+    return df if mask is None else df[mask]
+
+
+def distinct_values(df, col, **equals):
+    """Sorted distinct values of col among the rows matching the filters."""
+    values = df[col]
+    mask = row_mask(df, **equals)
+    if isinstance(values.dtype, pd.CategoricalDtype):
+        codes = values.cat.codes.to_numpy()
+        present = np.unique(codes if mask is None else codes[mask])
+        return sorted(values.cat.categories[present[present >= 0]].tolist())
+    return sorted((values if mask is None else values[mask]).dropna().unique().tolist())
+
+
+def memory_report(df):
+    """Bytes per column before and after compaction, as a DataFrame."""
+    after = df.memory_usage(index=False, deep=True)
+    before = pd.Series(df.attrs.get('memory_before', {}), dtype='float64')
+    return pd.DataFrame({'before': before.reindex(after.index), 'after': after})
+
+
+def concat_frames(frames):
+    """pd.concat that keeps categoricals and the memory report.
+
+    Categories are unioned first, since concatenating categoricals with
+    different categories would fall back to plain strings.
+    """
+    frames = list(frames)
+    for col in DIMENSION_COLUMNS:
+        dtypes = [frame[col].dtype for frame in frames if col in frame.columns]
+        if len(dtypes) < 2 or not all(isinstance(dtype, pd.CategoricalDtype) for dtype in dtypes):
+            continue
+        categories = sorted(set().union(*(dtype.categories for dtype in dtypes)))
+        union = pd.CategoricalDtype(categories)
+        for i, frame in enumerate(frames):
+            if col in frame.columns and frame[col].dtype != union:
+                frame = frame.copy(deep=False)
+                frame[col] = frame[col].astype(union)
+                frames[i] = frame
+
+    reports = [frame.attrs.get('memory_before') for frame in frames]
+    combined = pd.concat(frames, ignore_index=True)
+    combined.attrs.clear()
+    if reports and all(report is not None for report in reports):
+        combined.attrs['memory_before'] = {
+            col: sum(report.get(col, 0) for report in reports) for col in combined.columns
+        }
+    return combined
+
+
+def _add_partition_columns(df, key, names, columns):
+    """Add partition columns parsed from the key and list them in names."""
+    currency = partition_currency(key)
+    if currency and 'currency' not in names:
+        names.append('currency')
+        if columns is None or 'currency' in columns:
+            df['currency'] = currency
+    day = partition_date(key)
+    if day is not None and 'txn_date' not in names:
+        names.append('txn_date')
+        df['txn_date'] = day
+    return df
+
+
+def read_parquet_columns(source, columns=None, key=''):
+    """Read a parquet file or buffer, decoding only the requested columns.
+
+    Requested columns that the file doesn't have are ignored. Partition
+    columns parsed from `key` are added when requested. The file's full
+    column list is kept in `df.attrs['file_columns']`.
+    """
+    names = pq.read_schema(source).names
+    if hasattr(source, 'seek'):
+        source.seek(0)
+    wanted = None if columns is None else [name for name in names if name in set(columns)]
+    df = _add_partition_columns(pd.read_parquet(source, columns=wanted), key, names, columns)
+    if columns is not None and 'txn_date' not in columns:
+        df = df.drop(columns='txn_date', errors='ignore')
+    df = prepare_frame(df)
+    df.attrs['file_columns'] = names
+    return df
+
+
+def snapshot_version(*parts):
+    """Short stable hash of the values identifying a snapshot."""
+    return hashlib.sha256(json.dumps(parts, default=str).encode('utf-8')).hexdigest()[:16]
+
+
+def source_digest(objects):
+    """Digest of {object: fingerprint}, the source files a dataset or rollup build was read from."""
+    return snapshot_version(sorted(objects.items()))
+
+
+def sample_objects(path=SAMPLE_PATH, version=None):
+    """{path: fingerprint} of the local sample file, by (mtime_ns, size)."""
+    if version is None:
+        stat = os.stat(path)
+        version = (stat.st_mtime_ns, stat.st_size)
+    return {os.path.abspath(path): f"{version[0]}-{version[1]}"}
+
+
+def _tag_source(df, listing, currencies, date_range):
+    # lets materialized rollups be checked against exactly the objects df was read from
+    df.attrs['source_digest'] = source_digest({key: str(meta[0]) for key, meta in listing.items()})
+    df.attrs['source_scope'] = (sorted(currencies) if currencies else None,
+                                [str(d) for d in date_range] if date_range else None)
+
+
+def write_snapshot(df, name, metadata=None, stale_prefix=None):
+    """Write df as an uncompressed Arrow IPC file so it can be memory-mapped.
+
+    `metadata` (JSON-serialisable) is stored in the schema. Files starting
+    with `stale_prefix` are removed afterwards. Failures are ignored - the
+    snapshot is only a startup accelerator.
+    """
+    path = os.path.join(SNAPSHOT_DIR, name + '.arrow')
+    try:
+        os.makedirs(SNAPSHOT_DIR, exist_ok=True)
+        table = pa.Table.from_pandas(df, preserve_index=False)
+        if metadata is not None:
+            table = table.replace_schema_metadata({
+                **(table.schema.metadata or {}), b'fx_snapshot': json.dumps(metadata, default=str).encode('utf-8')
+            })
+        fd, tmp_path = tempfile.mkstemp(dir=SNAPSHOT_DIR, suffix='.tmp')
+        with os.fdopen(fd, 'wb') as f:
+            with ipc.new_file(f, table.schema) as writer:
+                writer.write_table(table)
+        os.replace(tmp_path, path)
+        if stale_prefix:
+            for old in glob.glob(os.path.join(SNAPSHOT_DIR, stale_prefix + '*.arrow')):
+                if old != path:
+                    os.remove(old)
+    except (OSError, pa.ArrowException):
+        pass
+
+
+def read_snapshot(name):
+    """Memory-map a snapshot; returns (df, metadata) or None if missing.
+
+    Numeric columns stay backed by the mapped file, so the OS page cache
+    is shared between processes opening the same snapshot.
+    """
+    path = os.path.join(SNAPSHOT_DIR, name + '.arrow')
+    try:
+        table = ipc.open_file(pa.memory_map(path)).read_all()
+    except (OSError, pa.ArrowException):
+        return None
+    raw = (table.schema.metadata or {}).get(b'fx_snapshot')
+    metadata = json.loads(raw) if raw else None
+    return table.to_pandas(split_blocks=True), metadata
+
+
+def load_sample_frame(path=SAMPLE_PATH, columns=None):
+    """Load the local sample parquet through an Arrow snapshot.
+
+    The snapshot is keyed by the file's path, size and mtime, so editing
+    or regenerating the parquet file invalidates it. Only older snapshots
+    of the same file and columns are pruned, never other files'.
+    """
+    stat = os.stat(path)
+    prefix = 'sample-' + snapshot_version(os.path.abspath(path), columns) + '-'
+    name = prefix + snapshot_version(stat.st_mtime_ns, stat.st_size)
+    snapshot = read_snapshot(name)
+    if snapshot is not None:
+        df, metadata = snapshot
+        df.attrs = {'memory_before': (metadata or {}).get('memory_before', {})}
+        return df
+    df = sort_by_date(read_parquet_columns(path, columns))
+    df.attrs.pop('file_columns', None)
+    write_snapshot(df, name, {'memory_before': df.attrs.get('memory_before', {})}, stale_prefix=prefix)
+    return df
+
+
+class DiskCache:
+    """Content-addressed cache of S3 objects on local disk.
+
+    Files are named by a hash of bucket/key/ETag, so a changed object never
+    hits a stale entry. Reads refresh the file's mtime and the least
+    recently used files are evicted once the total size passes max_bytes.
+    """
+
+    def __init__(self, directory=DISK_CACHE_DIR, max_bytes=DISK_CACHE_MAX_BYTES):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._size = None
+        self._lock = threading.Lock()
+
+    def path(self, bucket, key, etag):
+        digest = hashlib.sha256(f"{bucket}/{key}/{etag}".encode('utf-8')).hexdigest()
+        return os.path.join(self.directory, digest[:2], digest + '.parquet')
+
+    def get(self, bucket, key, etag):
+        """Return the cached bytes, or None on a miss."""
+        path = self.path(bucket, key, etag)
+        try:
+            with open(path, 'rb') as f:
+                data = f.read()
+            os.utime(path)
+        except OSError:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return data
+
+    def put(self, bucket, key, etag, data):
+        """Store bytes for an object, evicting old entries if over the cap."""
+        if len(data) > self.max_bytes:
+            return
+        path = self.path(bucket, key, etag)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # write to a temp file first so readers never see a partial object
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+        with self._lock:
+            if self._size is None:
+                self._size = self._scan_size()
+            else:
+                self._size += len(data)
+            if self._size > self.max_bytes:
+                self.evict()
+
+    def _entries(self):
+        entries = []
+        for root, _, files in os.walk(self.directory):
+            for name in files:
+                if name.endswith('.parquet'):
+                    path = os.path.join(root, name)
+                    try:
+                        stat = os.stat(path)
+                    except OSError:
+                        continue
+                    entries.append((stat.st_mtime, stat.st_size, path))
+        return entries
+
+    def _scan_size(self):
+        return sum(size for _, size, _ in self._entries())
+
+    def evict(self):
+        """Remove least recently used files until the cache fits max_bytes."""
+        entries = sorted(self._entries())
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in entries:
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+                total -= size
+            except OSError:
+                pass
+        self._size = total
+
+
+_DISK_CACHE = None
+
+
+def get_disk_cache():
+    """Return the process-wide DiskCache, or None when disabled."""
+    global _DISK_CACHE
+    if DISK_CACHE_MAX_BYTES <= 0:
+        return None
+    if _DISK_CACHE is None:
+        _DISK_CACHE = DiskCache()
+    return _DISK_CACHE
+
+
+def fetch_parquet(s3, bucket, key, columns=None, etag=None):
+    """Download and decode one parquet object, adding the partition columns.
+
+    With an `etag` the object is served from the local disk cache when
+    possible, and cached after downloading otherwise.
+    """
+    cache = get_disk_cache() if etag else None
+    data = cache.get(bucket, key, etag) if cache else None
+    if data is None:
+        response = s3.get_object(Bucket=bucket, Key=key)
+        data = response['Body'].read()
+        if cache:
+            cache.put(bucket, key, etag, data)
+    return read_parquet_columns(BytesIO(data), columns, key)
+
+
+def fetch_many(s3, bucket, keys, max_workers=S3_MAX_WORKERS, columns=None, etags=None):
+    """Download and decode objects concurrently, keeping the key order.
+
+    `etags` maps keys to their listed ETag, enabling the disk cache.
+    """
+    if not keys:
+        return []
+    etags = etags or {}
+    workers = max(1, min(max_workers, len(keys)))
+    if workers == 1:
+        return [fetch_parquet(s3, bucket, key, columns, etags.get(key)) for key in keys]
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        return list(pool.map(lambda key: fetch_parquet(s3, bucket, key, columns, etags.get(key)), keys))
+
+
+class RangedS3File(io.RawIOBase):
+    """Read-only, seekable file over an S3 object backed by ranged GETs.
+
+    Lets pyarrow read a parquet footer and individual column chunks
+    without downloading the whole object.
+    """
+
+    def __init__(self, s3, bucket, key, size):
+        self.s3 = s3
+        self.bucket = bucket
+        self.key = key
+        self.size = size
+        self.pos = 0
+        self.bytes_read = 0
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self.pos
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_SET:
+            self.pos = offset
+        elif whence == io.SEEK_CUR:
+            self.pos += offset
+        else:
+            self.pos = self.size + offset
+        return self.pos
+
+    def readinto(self, buffer):
+        end = min(self.pos + len(buffer), self.size)
+        if end <= self.pos:
+            return 0
+        response = self.s3.get_object(Bucket=self.bucket, Key=self.key, Range=f"bytes={self.pos}-{end - 1}")
+        data = response['Body'].read()
+        buffer[:len(data)] = data
+        self.pos += len(data)
+        self.bytes_read += len(data)
+        return len(data)
+
+
+# Parquet footers kept, most recently used first - one per object
+MAX_FOOTERS = 4096
+
+_FOOTERS = OrderedDict()  # (bucket, key) -> (etag, FileMetaData)
+_FOOTERS_LOCK = threading.Lock()
+
+
+def read_footer(s3, bucket, key, meta):
+    """Return the parquet FileMetaData of an object, cached by ETag.
+
+    Only the footer bytes are transferred (one ranged GET in most cases).
+    One footer is kept per object - a new ETag replaces the old one - and
+    the least recently used are dropped past MAX_FOOTERS.
+    """
+    etag, _, size = meta
+    with _FOOTERS_LOCK:
+        cached = _FOOTERS.get((bucket, key))
+        if cached is not None and cached[0] == etag:
+            _FOOTERS.move_to_end((bucket, key))
+            return cached[1]
+    metadata = pq.read_metadata(RangedS3File(s3, bucket, key, size))
+    with _FOOTERS_LOCK:
+        _FOOTERS[(bucket, key)] = (etag, metadata)
+        _FOOTERS.move_to_end((bucket, key))
+        while len(_FOOTERS) > MAX_FOOTERS:
+            _FOOTERS.popitem(last=False)
+    return metadata
+
+
+def forget_footer(bucket, key):
+    """Drop a deleted object's cached footer."""
+    with _FOOTERS_LOCK:
+        _FOOTERS.pop((bucket, key), None)
+
+
+def _as_timestamp(value):
+    try:
+        ts = pd.Timestamp(value)
+    except (TypeError, ValueError):
+        return None
+    return ts.tz_localize(None) if ts.tzinfo is not None else ts
+
+
+def _column_stats(metadata, row_group, column):
+    group = metadata.row_group(row_group)
+    for j in range(group.num_columns):
+        chunk = group.column(j)
+        if chunk.path_in_schema == column:
+            stats = chunk.statistics
+            if stats is None or not stats.has_min_max:
+                return None
+            return _as_timestamp(stats.min), _as_timestamp(stats.max)
+    return None
+
+
+def row_groups_in_range(metadata, date_range, column='txn_date'):
+    """Indexes of row groups whose `column` min/max can overlap date_range.
+
+    Row groups without usable statistics are always kept.
+    """
+    start, end = pd.Timestamp(date_range[0]), pd.Timestamp(date_range[1])
+    groups = []
+    for i in range(metadata.num_row_groups):
+        stats = _column_stats(metadata, i, column)
+        if stats is not None and None not in stats and (stats[1] < start or stats[0] > end):
+            continue
+        groups.append(i)
+    return groups
+
+
+def metadata_date_bounds(metadata, column='txn_date'):
+    """(min, max) of `column` over a parquet file's row groups, or None without statistics."""
+    lows, highs = [], []
+    for i in range(metadata.num_row_groups):
+        stats = _column_stats(metadata, i, column)
+        if stats is None or None in stats:
+            return None
+        lows.append(stats[0])
+        highs.append(stats[1])
+    if not lows:
+        return None
+    return min(lows), max(highs)
+
+
+def footer_date_bounds(s3, bucket, objects, max_workers=S3_MAX_WORKERS, column='txn_date'):
+    """Overall (min, max) of `column` from the footers of the objects, or None."""
+    keys = list(objects)
+    if not keys:
+        return None
+    with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(keys)))) as pool:
+        footers = list(pool.map(lambda key: read_footer(s3, bucket, key, objects[key]), keys))
+    bounds = [metadata_date_bounds(metadata, column) for metadata in footers if metadata.num_row_groups]
+    if not bounds or any(bound is None for bound in bounds):
+        return None
+    return min(low for low, _ in bounds), max(high for _, high in bounds)
+
+
+def in_date_range(df, date_range):
+    """Boolean mask of rows whose txn_date is within [start, end]."""
+    dates = pd.to_datetime(df['txn_date'])
+    return (dates >= pd.Timestamp(date_range[0])) & (dates <= pd.Timestamp(date_range[1]))
+
+
+def fetch_row_groups(s3, bucket, key, meta, date_range, columns=None):
+    """Read only the rows of an object within date_range.
+
+    Row groups are skipped using the txn_date footer statistics, and when
+    the object isn't in the disk cache only the needed column chunks are
+    fetched with ranged GETs. Returns (df, row groups read, row groups total,
+    bytes transferred).
+    """
+    etag = meta[0]
+    cache = get_disk_cache() if etag else None
+    data = cache.get(bucket, key, etag) if cache else None
+    if data is not None:
+        source = BytesIO(data)
+        metadata = pq.read_metadata(source)
+        source.seek(0)
+    else:
+        source = RangedS3File(s3, bucket, key, meta[2])
+        metadata = read_footer(s3, bucket, key, meta)
+    groups = row_groups_in_range(metadata, date_range)
+
+    parquet_file = pq.ParquetFile(source, metadata=metadata)
+    names = parquet_file.schema_arrow.names
+    wanted = None if columns is None else [name for name in names if name in set(columns)]
+    df = parquet_file.read_row_groups(groups, columns=wanted).to_pandas()
+    df = _add_partition_columns(df, key, names, columns)
+    if 'txn_date' in df.columns:
+        df = df[in_date_range(df, date_range)].reset_index(drop=True)
+    if columns is not None and 'txn_date' not in columns:
+        df = df.drop(columns='txn_date', errors='ignore')
+    df = prepare_frame(df)
+    df.attrs['file_columns'] = names
+    transferred = source.bytes_read if isinstance(source, RangedS3File) else 0
+    return df, len(groups), metadata.num_row_groups, transferred
+
+
+def iter_parquet_batches(source, columns=None, key='', date_range=None, metadata=None,
+                         batch_rows=None):
+    """Yield a parquet file's rows as prepared DataFrames of at most batch_rows rows.
+
+    Row groups outside date_range are skipped and only one batch is
+    decoded at a time, so memory is bounded by the batch size.
+    """
+    parquet_file = pq.ParquetFile(source, metadata=metadata)
+    names = list(parquet_file.schema_arrow.names)
+    wanted = None if columns is None else [name for name in names if name in set(columns)]
+    groups = None
+    if date_range:
+        groups = row_groups_in_range(parquet_file.metadata, date_range)
+    for batch in parquet_file.iter_batches(batch_size=batch_rows or STREAM_BATCH_ROWS, row_groups=groups,
+                                           columns=wanted):
+        df = _add_partition_columns(batch.to_pandas(), key, list(names), columns)
+        if date_range and 'txn_date' in df.columns:
+            df = df[in_date_range(df, date_range)].reset_index(drop=True)
+        if columns is not None and 'txn_date' not in columns:
+            df = df.drop(columns='txn_date', errors='ignore')
+        yield prepare_frame(df)
+
+
+def iter_s3_batches(s3=None, bucket=S3_BUCKET, prefix=S3_PREFIX, currencies=None, date_range=None,
+                    columns=None, batch_rows=None):
+    """Stream the matching S3 objects batch by batch, one object at a time.
+
+    Objects in the disk cache are read from it; the rest are read with
+    ranged GETs of just the needed row groups and columns.
+    """
+    s3 = s3 or get_s3_client()
+    cache = get_disk_cache()
+    for key, meta in list_parquet_objects(s3, bucket, prefix, currencies, date_range).items():
+        data = cache.get(bucket, key, meta[0]) if cache and meta[0] else None
+        if data is not None:
+            source, metadata = BytesIO(data), None
+        else:
+            source, metadata = RangedS3File(s3, bucket, key, meta[2]), read_footer(s3, bucket, key, meta)
+        yield from iter_parquet_batches(source, columns, key, date_range, metadata, batch_rows)
+
+
+def load_s3_frame(bucket=S3_BUCKET, prefix=S3_PREFIX, max_workers=S3_MAX_WORKERS, s3=None,
+                  currencies=None, date_range=None, columns=None):
+    """Load the parquet objects under the prefix into one DataFrame.
+
+    `currencies` and `date_range` prune the listing down to the matching
+    partitions; rows are not filtered further. `columns` limits the
+    columns decoded. Returns None when there are no parquet objects.
+    """
+    s3 = s3 or get_s3_client()
+    listing = list_parquet_objects(s3, bucket, prefix, currencies, date_range)
+    etags = {key: meta[0] for key, meta in listing.items()}
+    frames = fetch_many(s3, bucket, list(listing), max_workers, columns, etags)
+    if not frames:
+        return None
+    for frame in frames:
+        frame.attrs.pop('file_columns', None)
+    return concat_frames(frames)
+
+
+class S3FrameStore:
+    """Keeps S3 data in sync with an ETag/LastModified manifest.
+
+    Each refresh lists the objects, downloads only new or changed ones
+    and forgets deleted ones. One store is shared by all partition filters,
+    so an object is downloaded once however many views use it. Columns
+    are decoded on demand: asking for a column an object's frame doesn't
+    have yet fetches just that column. Rows are anomaly-scored once, as
+    their object arrives (see fx_scoring), into an anomaly_score column.
+
+    The objects are laid out once, in arrival order, in one "arena" frame
+    and the per-object frames are views into it, so the data is held
+    once. New objects are appended to the arena; the combined frame then
+    extends the previous one (attrs['extends']) and derived structures
+    are updated from the appended rows only (see derived_for). Changed,
+    deleted or widened objects lay the arena out again. The arena is in
+    object order, not sorted by date - date cuts on it are masks.
+    load_dataset caches the combined frames, and hands back the previous
+    one so an unchanged listing isn't rebuilt at all.
+    """
+
+    def __init__(self, bucket=S3_BUCKET, prefix=S3_PREFIX, max_workers=S3_MAX_WORKERS):
+        self.bucket = bucket
+        self.prefix = prefix
+        self.max_workers = max_workers
+        self.manifest = {}  # key -> (etag, last_modified)
+        self.frames = {}  # key -> DataFrame
+        self.loaded = {}  # key -> set of decoded columns (None = all)
+        self.file_columns = {}  # key -> all columns in the object
+        self.last_refresh = {}
+        self.snapshot_written = None  # time of the last snapshot write
+        self.scorer = IncrementalScorer()
+        self.arena = None  # every laid-out object's rows, in arena_keys order
+        self.arena_keys = []
+        self.arena_epoch = 0  # bumped whenever the arena is laid out again
+        self.spans = {}  # key -> (start, stop) of objects whose frame is a view of the arena
+        self._lock = threading.Lock()
+
+    def _snapshot_name(self, columns):
+        # the scorer state is stored with the rows, so its bucket layout is part of the name
+        return 's3-' + snapshot_version(self.bucket, self.prefix, columns, 'sketch', SCORE_ACCURACY)
+
+    def _restore_snapshot(self, listing, columns):
+        """Fill an empty store from the Arrow snapshot.
+
+        Only objects whose ETag and size still match the listing are
+        restored; the normal refresh then fetches everything else.
+        Returns the snapshot frame when it covers the listing exactly.
+        """
+        snapshot = read_snapshot(self._snapshot_name(columns))
+        if snapshot is None or not snapshot[1]:
+            return None
+        df, metadata = snapshot
+        df.attrs = {'memory_before': metadata['memory_before']}
+        scores = metadata.get('scores', {})
+        # the snapshot becomes the arena; objects that no longer match leave it stale
+        self.arena, self.arena_keys = df, [obj[0] for obj in metadata['objects']]
+        self.arena_epoch += 1
+        offset = 0
+        current = True
+        for key, etag, size, rows, file_columns, memory_before in metadata['objects']:
+            meta = listing.get(key)
+            if meta is not None and meta[0] == etag and meta[2] == size:
+                self.frames[key] = df.iloc[offset:offset + rows].reset_index(drop=True)
+                self.frames[key].attrs = {'memory_before': memory_before}
+                self.spans[key] = (offset, offset + rows)
+                self.loaded[key] = None if columns is None else set(columns)
+                self.file_columns[key] = file_columns
+                self.manifest[key] = meta
+                if key in scores and SCORE_COLUMN in df.columns:
+                    self.scorer.restore(key, *scores[key])
+            else:
+                current = False
+            offset += rows
+        if current and set(self.arena_keys) == set(listing):
+            return df
+        return None
+
+    def _write_snapshot(self, listing, combined, columns):
+        # combined is (a projection of) the arena, so its rows are in arena_keys order
+        metadata = {
+            'objects': [
+                [key, listing[key][0], listing[key][2], len(self.frames[key]), self.file_columns.get(key, []),
+                 self.frames[key].attrs.get('memory_before', {})]
+                for key in self.arena_keys
+            ],
+            'memory_before': combined.attrs.get('memory_before', {}),
+            'scores': self.scorer.state(),
+        }
+        write_snapshot(combined, self._snapshot_name(columns), metadata)
+        self.snapshot_written = time.time()
+
+    def _missing_columns(self, key, columns):
+        have = self.loaded[key]
+        if have is None:
+            return set()
+        if columns is None:
+            return None
+        return set(columns) - have
+
+    def _set_frame(self, key, df):
+        self.frames[key] = df
+        self.spans.pop(key, None)  # no longer a view of the arena
+
+    def _store(self, key, df, columns):
+        self.file_columns[key] = df.attrs.pop('file_columns', list(df.columns))
+        self._set_frame(key, df)
+        self.loaded[key] = None if columns is None else set(columns)
+
+    def _forget(self, key):
+        for table in (self.manifest, self.frames, self.loaded, self.file_columns, self.spans):
+            table.pop(key, None)
+        forget_footer(self.bucket, key)
+        self.scorer.forget(key)
+
+    def _score_new(self, listing):
+        """Score the rows of objects the scorer hasn't seen; returns how many were scored.
+
+        Their statistics are merged into the running totals first, then
+        only their rows are scored - frames scored earlier keep their scores.
+        """
+        # a refetched frame (same ETag, e.g. for more columns) comes without its scores
+        pending = {
+            key: (listing[key][0], self.frames[key]) for key in listing
+            if key in self.frames and self.scorer.can_score(self.frames[key])
+            and not (self.scorer.is_current(key, listing[key][0]) and SCORE_COLUMN in self.frames[key].columns)
+        }
+        self.scorer.update(pending)
+        for key, (_, df) in pending.items():
+            report = df.attrs.get('memory_before', {})
+            self._set_frame(key, df.assign(**{SCORE_COLUMN: self.scorer.score(df)}))
+            self.frames[key].attrs = {'memory_before': report}
+        return len(pending)
+
+    def _lay_out(self, keys, append):
+        """Concatenate the keys' frames into the arena (after its rows when append is set).
+
+        The frames are then replaced by views of the arena, so each
+        object's rows are held once.
+        """
+        frames = [self.frames[key] for key in keys]
+        start = len(self.arena) if append else 0
+        if not append:
+            self.arena_keys, self.spans = [], {}
+            self.arena_epoch += 1
+        self.arena = concat_frames([self.arena, *frames] if append else frames)
+        for key, frame in zip(keys, frames):
+            self.spans[key] = (start, start + len(frame))
+            start += len(frame)
+        self.arena_keys += keys
+        # every object, old ones included, now points into the new arena so the old one is freed
+        for key in self.arena_keys:
+            frame = self.frames[key]
+            start, stop = self.spans[key]
+            view = self.arena.iloc[start:stop][list(frame.columns)].reset_index(drop=True)
+            view.attrs = {'memory_before': frame.attrs.get('memory_before', {})}
+            self.frames[key] = view
+
+    def _combine(self, listing):
+        """The listed objects' rows as one frame, and whether that frame is the arena.
+
+        Objects added since the arena was laid out are appended to it;
+        listings covering only part of the arena are concatenated
+        separately (a copy, as for partition-pruned views).
+        """
+        keys = set(listing)
+        current = self.arena is not None and all(key in self.spans for key in self.arena_keys)
+        if current and keys >= set(self.arena_keys):
+            added = [key for key in listing if key not in self.spans]
+            if added:
+                self._lay_out(added, append=True)
+            return self.arena, True
+        if keys == set(self.frames):
+            self._lay_out(list(listing), append=False)
+            return self.arena, True
+        return concat_frames(self.frames[key] for key in listing), False
+
+    def available_columns(self, keys=None):
+        """All columns present in the stored objects, in file order."""
+        names = []
+        for key in (self.file_columns if keys is None else keys):
+            for name in self.file_columns.get(key, []):
+                if name not in names:
+                    names.append(name)
+        return names
+
+    def refresh(self, s3=None, currencies=None, date_range=None, columns=None, previous=None):
+        """Sync the store and return the combined frame, or None if empty."""
+        s3 = s3 or get_s3_client()
+        columns = list(columns) if columns is not None else None
+        with self._lock:
+            listing = list_parquet_objects(s3, self.bucket, self.prefix, currencies, date_range)
+            full_scope = not currencies and not date_range
+            snapshot_df = None
+            if full_scope and not self.frames:
+                snapshot_df = self._restore_snapshot(listing, columns)
+
+            # only keys under the listed partitions can be judged as deleted
+            deleted = [
+                key for key in self.manifest
+                if key not in listing and key_in_partitions(key, currencies, date_range)
+                and (not currencies or partition_currency(key) in currencies)
+            ]
+            for key in deleted:
+                self._forget(key)
+
+            changed, widen, extra = [], [], set()
+            for key, meta in listing.items():
+                if self.manifest.get(key) != meta:
+                    changed.append(key)
+                    continue
+                missing = self._missing_columns(key, columns)
+                if missing is None:
+                    changed.append(key)  # all columns wanted - refetch
+                elif missing:
+                    widen.append(key)
+                    extra |= missing
+
+            etags = {key: meta[0] for key, meta in listing.items()}
+            for key, df in zip(changed, fetch_many(s3, self.bucket, changed, self.max_workers, columns, etags)):
+                self._store(key, df, columns)
+                self.manifest[key] = listing[key]
+            if widen:
+                extra = sorted(extra)
+                for key, df in zip(widen, fetch_many(s3, self.bucket, widen, self.max_workers, extra, etags)):
+                    base = self.frames[key]
+                    new_cols = [name for name in df.columns if name not in base.columns]
+                    report = {**base.attrs.get('memory_before', {}), **df.attrs.get('memory_before', {})}
+                    self._set_frame(key, pd.concat([base, df[new_cols]], axis=1))
+                    self.frames[key].attrs = {'memory_before': report}
+                    self.loaded[key] |= set(extra)
+            scored = self._score_new(listing)
+
+            self.last_refresh = {'objects': len(listing), 'fetched': len(changed),
+                                 'widened': len(widen), 'deleted': len(deleted), 'scored': scored,
+                                 'from_snapshot': snapshot_df is not None}
+
+            result_key = (tuple(sorted(currencies)) if currencies else None,
+                          tuple(str(d) for d in date_range) if date_range else None,
+                          tuple(columns) if columns is not None else None)
+            version = snapshot_version(self.bucket, self.prefix, result_key, listing)
+            if previous is not None and dataset_version(previous) == version and not changed and not widen and not scored:
+                return previous
+
+            if not listing:
+                return None
+            # a restored snapshot is the arena as is (still memory-mapped, no copy)
+            frame, is_arena = self._combine(listing)
+            if columns is not None:
+                keep = {*columns, SCORE_COLUMN}
+                combined = frame[[name for name in frame.columns if name in keep]]
+            else:
+                combined = frame.copy(deep=False)
+            combined.attrs = dict(frame.attrs)  # never write into the arena's own attrs
+            combined.attrs['dataset_version'] = version
+            if is_arena:
+                combined.attrs['arena'] = (self.arena_epoch, len(combined))
+                # the previous result is a prefix of this one when only objects were appended since
+                held = previous.attrs.get('arena') if previous is not None else None
+                if (held and held[0] == self.arena_epoch and held[1] < len(combined)
+                        and list(previous.columns) == list(combined.columns)):
+                    combined.attrs['extends'] = (dataset_version(previous), held[1])
+                stale = self.snapshot_written is None or time.time() - self.snapshot_written > SNAPSHOT_INTERVAL
+                if full_scope and stale and frame is not snapshot_df:
+                    self._write_snapshot(listing, combined, columns)
+            _tag_source(combined, listing, currencies, date_range)
+            return combined
+
+    def load_range(self, s3=None, currencies=None, date_range=None, columns=None):
+        """Return only the rows within date_range for the given partitions.
+
+        Objects already held (with the requested columns) are sliced in
+        memory; everything else is read with row-group pushdown, so row
+        groups outside the range are never transferred. The result isn't
+        added to the store.
+        """
+        if not date_range:
+            return self.refresh(s3, currencies, date_range, columns)
+        s3 = s3 or get_s3_client()
+        columns = list(columns) if columns is not None else None
+        listing = list_parquet_objects(s3, self.bucket, self.prefix, currencies, date_range)
+
+        parts, remote = {}, []
+        with self._lock:
+            for key, meta in listing.items():
+                held = self.manifest.get(key) == meta and self._missing_columns(key, columns) == set()
+                if held and 'txn_date' in self.frames[key].columns:
+                    frame = self.frames[key]
+                    frame = frame[in_date_range(frame, date_range)]
+                    frame.attrs = {}  # the object's memory report doesn't apply to a slice
+                    if columns is not None:
+                        keep = {*columns, SCORE_COLUMN}
+                        frame = frame[[name for name in frame.columns if name in keep]]
+                    parts[key] = frame
+                else:
+                    remote.append(key)
+
+        groups_read = groups_total = transferred = 0
+        if remote:
+            workers = max(1, min(self.max_workers, len(remote)))
+            with ThreadPoolExecutor(max_workers=workers) as pool:
+                results = list(pool.map(
+                    lambda key: fetch_row_groups(s3, self.bucket, key, listing[key], date_range, columns),
+                    remote
+                ))
+            for key, (frame, read, total, nbytes) in zip(remote, results):
+                with self._lock:
+                    self.file_columns[key] = frame.attrs.pop('file_columns', list(frame.columns))
+                parts[key] = frame
+                groups_read += read
+                groups_total += total
+                transferred += nbytes
+            scorable = {key: (listing[key][0], parts[key]) for key in remote if self.scorer.can_score(parts[key])}
+            if scorable:
+                with self._lock:
+                    # partial reads aren't added to the running statistics; they are scored
+                    # against the totals plus their own rows, so unseen groups still get stats
+                    stats = self.scorer.with_frames(scorable)
+                    for key, (_, frame) in scorable.items():
+                        frame[SCORE_COLUMN] = self.scorer.score(frame, stats)
+
+        self.last_refresh = {'objects': len(listing), 'in_memory': len(listing) - len(remote),
+                             'row_groups_read': groups_read, 'row_groups_total': groups_total,
+                             'bytes_transferred': transferred}
+        if not parts:
+            return None
+        combined = concat_frames(parts[key] for key in listing)
+        combined.attrs['dataset_version'] = snapshot_version(
+            self.bucket, self.prefix, currencies, date_range, columns, listing
+        )
+        _tag_source(combined, listing, currencies, date_range)
+        return combined
+
+
+_STORES = {}
+_STORES_LOCK = threading.Lock()
+
+
+def get_frame_store(bucket=S3_BUCKET, prefix=S3_PREFIX):
+    """Return the process-wide S3FrameStore for a bucket/prefix."""
+    with _STORES_LOCK:
+        if (bucket, prefix) not in _STORES:
+            _STORES[(bucket, prefix)] = S3FrameStore(bucket, prefix)
+        return _STORES[(bucket, prefix)]
+
+
+def refresh_s3_frame(bucket=S3_BUCKET, prefix=S3_PREFIX, currencies=None, date_range=None,
+                     columns=None, s3=None, previous=None):
+    """Incrementally refresh and return the S3 data for the given partitions/columns.
+
+    `previous` (an earlier result for the same request) is returned as is
+    when nothing changed since it was built.
+    """
+    return get_frame_store(bucket, prefix).refresh(s3, currencies, date_range, columns, previous)
+
+
+def load_s3_range(bucket=S3_BUCKET, prefix=S3_PREFIX, currencies=None, date_range=None,
+                  columns=None, s3=None):
+    """Return the S3 rows within date_range, skipping row groups outside it."""
+    return get_frame_store(bucket, prefix).load_range(s3, currencies, date_range, columns)
+
+
+def parquet_columns(path):
+    """Column names of a local parquet file, without reading any data."""
+    return pq.read_schema(path).names
+
+
+def synthetic_frame(n=5000, seed=42):
+    """Random transactions in the normalized schema, used when no data is available."""
+    np.random.seed(seed)
+
+    dates = pd.date_range('2025-09-01', periods=90, freq='D')
+    currencies = ['USD', 'EUR', 'GBP', 'INR', 'JPY', 'CAD', 'AUD', 'CHF', 'CNY', 'SGD']
+    product_types = ['ECOM', 'RETAIL', 'SUBSCRIPTION', 'TRAVEL', 'FOREX', 'REMITTANCE', 'INVESTMENT']
+    channels = ['ONLINE', 'POS', 'MOBILE', 'ATM', 'WIRE']
+
+    df = pd.DataFrame({
+        'txn_id': [f'TXN{str(i).zfill(7)}' for i in range(n)],
+        'customer_id': [f'C{str(np.random.randint(1, 500)).zfill(5)}' for _ in range(n)],
+        'txn_date': np.random.choice(dates, n),
+        'amount': np.random.exponential(1000, n),
+        'currency': np.random.choice(currencies, n, p=[0.3, 0.2, 0.15, 0.1, 0.08, 0.05, 0.04, 0.03, 0.03, 0.02]),
+        'product_type': np.random.choice(product_types, n),
+        'channel': np.random.choice(channels, n),
+        'merchant_country': np.random.choice(['US', 'UK', 'DE', 'FR', 'IN', 'JP', 'CA', 'AU'], n),
+    })
+
+    fx_rates = {'USD': 1.0, 'EUR': 1.08, 'GBP': 1.27, 'INR': 0.012, 'JPY': 0.0067,
+                'CAD': 0.74, 'AUD': 0.65, 'CHF': 1.13, 'CNY': 0.14, 'SGD': 0.74}
+    df['fx_rate'] = df['currency'].map(fx_rates)
+    df['amount_usd'] = df['amount'] * df['fx_rate']
+    df['base_currency'] = 'USD'
+    return prepare_frame(df)
+
+
+class DatasetCache:
+    """Process-wide cache of loaded datasets.
+
+    Entries expire after their ttl (None = never) and the least recently
+    used ones are dropped past max_entries. Concurrent requests for the
+    same key wait for a single load instead of each hitting S3.
+    """
+
+    def __init__(self, max_entries=DATASET_CACHE_ENTRIES):
+        self.max_entries = max_entries
+        self.entries = OrderedDict()  # key -> (loaded_at, ttl, value)
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._loading = {}  # key -> lock held while that key loads
+
+    def _fresh(self, key):
+        entry = self.entries.get(key)
+        if entry is None:
+            return None
+        loaded_at, ttl, value = entry
+        if ttl is not None and time.time() - loaded_at > ttl:
+            return None
+        self.entries.move_to_end(key)
+        return entry
+
+    def get(self, key, loader, ttl=None):
+        """Return the cached value for key, calling loader() on a miss."""
+        with self._lock:
+            entry = self._fresh(key)
+            if entry is not None:
+                self.hits += 1
+                return entry[2]
+            key_lock = self._loading.setdefault(key, threading.Lock())
+        with key_lock:
+            with self._lock:
+                entry = self._fresh(key)
+                if entry is not None:
+                    self.hits += 1
+                    return entry[2]
+                self.misses += 1
+            try:
+                value = loader()
+                with self._lock:
+                    self.entries[key] = (time.time(), ttl, value)
+                    self.entries.move_to_end(key)
+                    while len(self.entries) > self.max_entries:
+                        self.entries.popitem(last=False)
+            finally:
+                with self._lock:
+                    self._loading.pop(key, None)
+            return value
+
+    def fresh(self, key):
+        """The value stored for key if it hasn't expired, without loading (None otherwise)."""
+        with self._lock:
+            entry = self._fresh(key)
+            return None if entry is None else entry[2]
+
+    def peek(self, key):
+        """The value stored for key even if expired, without loading (None if absent)."""
+        with self._lock:
+            entry = self.entries.get(key)
+            return None if entry is None else entry[2]
+
+    def clear(self):
+        with self._lock:
+            self.entries.clear()
+
+
+_DATASETS = DatasetCache()
+# cubes, indexes and scores get their own slots, so they never evict the datasets they come from
+_DERIVED = DatasetCache(DERIVED_CACHE_ENTRIES)
+
+
+def get_dataset_cache():
+    """Return the process-wide DatasetCache."""
+    return _DATASETS
+
+
+def get_derived_cache():
+    """Return the process-wide cache of per-dataset-version derived structures."""
+    return _DERIVED
+
+
+def derived_for(df, name, build, extend=None):
+    """build(df), built on first use and shared per dataset version.
+
+    Indexes, cubes, scores and sketches all go through here, keyed by
+    (name, df's version). Frames without a version (synthetic or ad hoc
+    data) get a fresh build every call. When df only appends rows to an
+    earlier version (attrs['extends'], see S3FrameStore) whose structure
+    is still held, extend(held, df, start) updates it from df's rows past
+    `start` instead; it may return None to fall back to build.
+    """
+    version = dataset_version(df)
+    if version is None:
+        return build(df)
+
+    def load():
+        base = df.attrs.get('extends')
+        if extend is not None and base is not None:
+            held = _DERIVED.fresh((name, base[0]))
+            if held is not None:
+                extended = extend(held, df, base[1])
+                if extended is not None:
+                    return extended
+        return build(df)
+    return _DERIVED.get((name, version), load)
+
+
+def _load_sample(path, columns):
+    try:
+        df = load_sample_frame(path, columns)
+        df.attrs['parquet_source'] = os.path.abspath(path)
+        return df
+    except (OSError, pa.ArrowException):
+        df = synthetic_frame()
+        return df if columns is None else df[[name for name in df.columns if name in set(columns)]]
+
+
+def _load_s3(currencies, date_range, columns, previous=None):
+    if date_range:
+        df = sort_by_date(load_s3_range(currencies=currencies, date_range=date_range, columns=columns))
+    else:
+        df = refresh_s3_frame(currencies=currencies, columns=columns, previous=previous)
+    if df is not None and 'currency' not in df.columns:
+        raise ValueError("currency column missing from S3 data")
+    if df is not None:
+        df.attrs['parquet_source'] = f"s3://{S3_BUCKET}/{S3_PREFIX}"
+    return df
+
+
+def load_dataset(source='sample', currencies=None, date_range=None, columns=CORE_COLUMNS, path=SAMPLE_PATH):
+    """Load a normalized dataset through the process-wide cache.
+
+    `source` is 'sample' (the local parquet file, or synthetic data if it
+    is missing) or 's3'. For S3, `currencies` and `date_range` restrict the
+    partitions read and the result is reused for DATASET_TTL seconds. The
+    returned frame is shared; it is sorted by txn_date except for whole S3
+    partitions, which keep the store's object order (see S3FrameStore).
+    Use date_slice() and select_rows() for filtered views. A date_range request is
+    answered with the already loaded frame of the same partitions when
+    there is one (the caller's date cut then slices it), so narrowing the
+    dates never builds a second copy. Copy-on-write is on (see
+    the top of this module), so writes by one caller never reach the
+    shared frame.
+    """
+    columns = tuple(columns) if columns is not None else None
+    if source == 's3':
+        scope = tuple(sorted(currencies)) if currencies else None
+        if date_range:
+            for wider in {scope, None}:
+                held = _DATASETS.fresh(('s3', wider, None, columns))
+                if held is not None:
+                    return held
+        key = ('s3', scope, tuple(str(d) for d in date_range) if date_range else None, columns)
+        # an expired entry is handed back to the store, which returns it if nothing changed
+        return _DATASETS.get(key, lambda: _load_s3(currencies, date_range, columns, _DATASETS.peek(key)),
+                             ttl=DATASET_TTL)
+    try:
+        stat = os.stat(path)
+        version = (stat.st_mtime_ns, stat.st_size)
+    except OSError:
+        version = None
+    key = ('sample', os.path.abspath(path), version, columns)
+
+    def load():
+        df = sort_by_date(_load_sample(path, columns))
+        df.attrs['dataset_version'] = snapshot_version(*key)
+        if dataset_source(df) is not None and version is not None:
+            df.attrs['source_digest'] = source_digest(sample_objects(path, version))
+        return df
+    return _DATASETS.get(key, load)
+
+
+def dataset_source(df):
+    """Parquet file or s3:// prefix df was loaded from (None for synthetic data)."""
+    return df.attrs.get('parquet_source')
+
+
+def dataset_version(df):
+    """Identifier of the loaded dataset df came from, or None.
+
+    Changes whenever the underlying files change; filtered views of a
+    dataset carry its version too.
+    """
+    return df.attrs.get('dataset_version')
+
+
+def narrowed_range(date_range, bounds):
+    """date_range as a (start, end) partition filter, or None unless it strictly narrows bounds.
+
+    A picker left at the full bounds (or half-picked) loads everything, so
+    it shares the dataset other views use instead of building a copy.
+    """
+    if not date_range or len(date_range) != 2 or not bounds:
+        return None
+    start, end = (pd.Timestamp(d).normalize() for d in date_range)
+    low, high = (pd.Timestamp(d).normalize() for d in bounds)
+    if start <= low and end >= high:
+        return None
+    return tuple(date_range)
+
+
+def dataset_partitions():
+    """Currency/date partitions in the S3 bucket (cached, no downloads)."""
+    return _DATASETS.get(('partitions',), lambda: list_partitions(get_s3_client()), ttl=PARTITIONS_TTL)
+
+
+def dataset_columns(source='sample', path=SAMPLE_PATH):
+    """Every column the source has, including ones not loaded yet."""
+    if source == 's3':
+        return get_frame_store().available_columns()
+    try:
+        return parquet_columns(path)
+    except (OSError, pa.ArrowException):
+        return None
+
+
+# Columns with a per-value bitmap in the filter index
+INDEXED_COLUMNS = ('currency', 'product_type', 'channel', 'merchant_country')
+
+
+class FilterIndex:
+    """Precomputed filter structures for one dataset.
+
+    Each value of the INDEXED_COLUMNS gets a packed bitmap (one bit per
+    row), and the date-sorted txn_date column serves as a position index
+    for binary-searched range cuts. A query cuts the row range first,
+    ANDs only the bitmap bytes covering that range, and materializes the
+    result once.
+    """
+
+    def __init__(self, df):
+        self.rows = len(df)
+        self.version = dataset_version(df)
+        self.dates = None
+        if 'txn_date' in df.columns and df.attrs.get('sorted_by') == 'txn_date':
+            self.dates = df['txn_date'].to_numpy()
+        self.bitmaps = {}  # column -> {value: packed bitmap}
+        for col in INDEXED_COLUMNS:
+            if col not in df.columns:
+                continue
+            values = df[col]
+            if not isinstance(values.dtype, pd.CategoricalDtype):
+                values = values.astype('category')
+            codes = values.cat.codes.to_numpy()
+            self.bitmaps[col] = {
+                value: np.packbits(codes == code)
+                for code, value in enumerate(values.cat.categories.tolist())
+                if (codes == code).any()
+            }
+
+    @classmethod
+    def extended(cls, held, df, start):
+        """held (built over df's first `start` rows) with df's rows past start appended."""
+        if held.rows != start or held.dates is not None:
+            return None
+        delta = cls(df.iloc[start:])
+        if set(delta.bitmaps) != set(held.bitmaps):
+            return None
+        index = cls.__new__(cls)
+        index.rows = len(df)
+        index.version = dataset_version(df)
+        index.dates = None
+        index.bitmaps = {}
+        for col, old in held.bitmaps.items():
+            new = delta.bitmaps[col]
+            index.bitmaps[col] = {
+                value: _append_bits(old.get(value), start, new.get(value), delta.rows) for value in {**old, **new}
+            }
+        return index
+
+    def row_range(self, df, date_range=None):
+        """(start, stop, mask) for the date cut; mask is None when it is a plain range."""
+        if not date_range or 'txn_date' not in df.columns:
+            return 0, self.rows, None
+        start, end = pd.Timestamp(date_range[0]), pd.Timestamp(date_range[1])
+        if self.dates is None:
+            dates = df['txn_date']
+            return 0, self.rows, ((dates >= start) & (dates <= end)).to_numpy()
+        lo = int(self.dates.searchsorted(start.to_datetime64(), 'left'))
+        hi = int(self.dates.searchsorted(end.to_datetime64(), 'right'))
+        return lo, hi, None
+
+    def _bits(self, col, value, byte_lo, byte_hi):
+        bitmap = self.bitmaps.get(col, {}).get(value)
+        if bitmap is None:
+            return np.zeros(byte_hi - byte_lo, dtype=np.uint8)
+        return bitmap[byte_lo:byte_hi]
+
+    def mask(self, df, date_range=None, **equals):
+        """(start, stop, mask) selecting the matching rows within [start, stop)."""
+        lo, hi, date_mask = self.row_range(df, date_range)
+        equals = {col: value for col, value in equals.items() if col in df.columns}
+        if not equals:
+            return lo, hi, date_mask
+        unknown = {col: value for col, value in equals.items() if col not in self.bitmaps}
+        byte_lo, byte_hi = lo // 8, (hi + 7) // 8
+        packed = None
+        for col, value in equals.items():
+            if col in unknown:
+                continue
+            bits = self._bits(col, value, byte_lo, byte_hi)
+            packed = bits.copy() if packed is None else np.bitwise_and(packed, bits, out=packed)
+        if packed is None:
+            mask = np.ones(hi - lo, dtype=bool)
+        else:
+            offset = lo - byte_lo * 8
+            mask = np.unpackbits(packed, count=offset + (hi - lo)).view(bool)[offset:]
+        if date_mask is not None:
+            mask &= date_mask[lo:hi]
+        if unknown:
+            mask &= row_mask(df.iloc[lo:hi], **unknown)
+        return lo, hi, mask
+
+    def select(self, df, date_range=None, **equals):
+        """df filtered by date_range and equals; a zero-copy view when only dates are filtered."""
+        lo, hi, mask = self.mask(df, date_range, **equals)
+        view = df.iloc[lo:hi]
+        return view if mask is None else view[mask]
+
+    def head(self, df, n, date_range=None, **equals):
+        """The first n matching rows, without materializing the others (for previews)."""
+        lo, hi, mask = self.mask(df, date_range, **equals)
+        if mask is None:
+            return df.iloc[lo:min(hi, lo + n)]
+        return df.iloc[np.flatnonzero(mask)[:n] + lo]
+
+    def distinct(self, df, col, date_range=None, **equals):
+        """Sorted values of col present among the rows matching the filters."""
+        if col not in self.bitmaps:
+            return distinct_values(self.select(df, date_range, **equals), col)
+        lo, hi, mask = self.mask(df, date_range, **equals)
+        byte_lo, byte_hi = lo // 8, (hi + 7) // 8
+        offset = lo - byte_lo * 8
+        present = []
+        for value, bitmap in self.bitmaps[col].items():
+            bits = np.unpackbits(bitmap[byte_lo:byte_hi], count=offset + (hi - lo)).view(bool)[offset:]
+            if (bits if mask is None else bits & mask).any():
+                present.append(value)
+        return sorted(present)
+
+
+def _append_bits(head, head_rows, tail, tail_rows):
+    """Packed bitmap of head_rows bits followed by tail_rows bits (None = all zero)."""
+    if head is None:
+        head = np.zeros((head_rows + 7) // 8, dtype=np.uint8)
+    if tail is None:
+        tail = np.zeros((tail_rows + 7) // 8, dtype=np.uint8)
+    whole, rest = divmod(head_rows, 8)
+    if not rest:
+        return np.concatenate([head[:whole], tail])
+    # re-pack from the last partial byte of head on
+    bits = np.concatenate([np.unpackbits(head[whole:], count=rest), np.unpackbits(tail, count=tail_rows)])
+    return np.concatenate([head[:whole], np.packbits(bits)])
+
+
+def get_filter_index(df):
+    return derived_for(df, 'filter_index', FilterIndex, FilterIndex.extended)
+
+
+def iter_dataset_batches(source='sample', currencies=None, date_range=None, columns=CORE_COLUMNS,
+                         path=SAMPLE_PATH, batch_rows=None):
+    """Stream a dataset in batches instead of loading it (see load_dataset)."""
+    if source == 's3':
+        return iter_s3_batches(currencies=currencies, date_range=date_range, columns=columns,
+                               batch_rows=batch_rows)
+    return iter_parquet_batches(path, columns, date_range=date_range, batch_rows=batch_rows)
+
+
+def stream_version(source='sample', currencies=None, date_range=None, path=SAMPLE_PATH):
+    """Version of what iter_dataset_batches would read, without reading it.
+
+    For S3 this lists the matching objects (keys, ETags, sizes); for the
+    sample it is the file's mtime and size.
+    """
+    if source == 's3':
+        listing = list_parquet_objects(get_s3_client(), S3_BUCKET, S3_PREFIX, currencies, date_range)
+        return snapshot_version('s3', S3_BUCKET, S3_PREFIX, currencies, date_range, listing)
+    stat = os.stat(path)
+    return snapshot_version('sample', os.path.abspath(path), stat.st_mtime_ns, stat.st_size, currencies, date_range)
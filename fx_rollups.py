@@ -0,0 +1,177 @@
+"""
+FX Rollups
+----------
+Materialized per-day cube cells, written next to the normalized data by
+build_rollups.py. The dashboards draw their charts from these instead
+of aggregating every transaction, as long as they match the source.
+"""
+
+import json
+import os
+import tempfile
+from io import BytesIO
+
+import pandas as pd
+
+from fx_data import (
+    DATASET_TTL, S3_BUCKET, S3_PREFIX, SAMPLE_PATH, concat_frames, date_slice, fetch_many, get_dataset_cache,
+    get_s3_client, key_in_partitions, list_parquet_objects, read_parquet_columns, sample_objects, snapshot_version,
+    sort_by_date, source_digest
+)
+
+# Local rollups directory (sample data) - defaults to rollups/ next to the sample file
+ROLLUP_DIR = os.environ.get("FX_ROLLUP_DIR", "")
+
+# S3 prefix for the rollups, in the data bucket - override with FX_ROLLUP_PREFIX
+ROLLUP_PREFIX = os.environ.get("FX_ROLLUP_PREFIX", "output/rollups/")
+
+MANIFEST_NAME = '_manifest.json'
+
+
+def source_objects(source='sample', path=SAMPLE_PATH, listing=None):
+    """{object: fingerprint} of the data the rollups are built from.
+
+    S3 objects are fingerprinted by ETag (from `listing` when the caller
+    already listed them); the local sample by mtime and size.
+    """
+    if source == 's3':
+        if listing is None:
+            listing = list_parquet_objects(get_s3_client(), S3_BUCKET, S3_PREFIX)
+        return {key: str(meta[0]) for key, meta in listing.items()}
+    return sample_objects(path)
+
+
+class RollupStore:
+    """The rollup files of one source: a local directory or an S3 prefix.
+
+    Each day is one parquet file under `txn_date=YYYY-MM-DD/`, and
+    _manifest.json records the source fingerprints and a digest per day.
+    """
+
+    def __init__(self, root, s3=None, bucket=None):
+        self.root = root
+        self.s3 = s3
+        self.bucket = bucket
+
+    @classmethod
+    def for_source(cls, source='sample', path=SAMPLE_PATH):
+        if source == 's3':
+            return cls(ROLLUP_PREFIX, get_s3_client(), S3_BUCKET)
+        return cls(ROLLUP_DIR or os.path.join(os.path.dirname(os.path.abspath(path)), 'rollups'))
+
+    def location(self, name):
+        if self.s3 is not None:
+            return self.root.rstrip('/') + '/' + name
+        return os.path.join(self.root, name)
+
+    def day_location(self, day):
+        return self.location(f"txn_date={day}/rollup.parquet")
+
+    def _read(self, name):
+        if self.s3 is not None:
+            try:
+                return self.s3.get_object(Bucket=self.bucket, Key=self.location(name))['Body'].read()
+            except self.s3.exceptions.NoSuchKey:
+                return None
+        try:
+            with open(self.location(name), 'rb') as f:
+                return f.read()
+        except OSError:
+            return None
+
+    def _write(self, location, data):
+        if self.s3 is not None:
+            self.s3.put_object(Bucket=self.bucket, Key=location, Body=data)
+            return
+        os.makedirs(os.path.dirname(location), exist_ok=True)
+        # temp file + rename so readers never see a partial file
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(location), suffix='.tmp')
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, location)
+
+    def read_manifest(self):
+        """The manifest dict, or None if the rollups were never built."""
+        data = self._read(MANIFEST_NAME)
+        return json.loads(data) if data else None
+
+    def write_manifest(self, manifest):
+        self._write(self.location(MANIFEST_NAME), json.dumps(manifest, indent=1, sort_keys=True).encode('utf-8'))
+
+    def write_day(self, day, cells):
+        buffer = BytesIO()
+        cells.to_parquet(buffer, index=False)
+        self._write(self.day_location(day), buffer.getvalue())
+
+    def delete_day(self, day):
+        location = self.day_location(day)
+        if self.s3 is not None:
+            self.s3.delete_object(Bucket=self.bucket, Key=location)
+        elif os.path.exists(location):
+            os.remove(location)
+
+    def read_days(self, digests):
+        """Frames of the given {day: digest} rollups, in day order."""
+        days = sorted(digests)
+        if self.s3 is not None:
+            # the digest identifies the content, so it can stand in for the ETag in the disk cache
+            keys = [self.day_location(day) for day in days]
+            return fetch_many(self.s3, self.bucket, keys, etags={key: digests[day] for key, day in zip(keys, days)})
+        return [read_parquet_columns(self.day_location(day), key=self.day_location(day)) for day in days]
+
+
+def cells_digest(cells):
+    """Content digest of one day's cells, independent of row order."""
+    return format(int(pd.util.hash_pandas_object(cells.astype(str), index=False).sum()), '016x')
+
+
+def _load_rollup_cells(source, path):
+    store = RollupStore.for_source(source, path)
+    manifest = store.read_manifest()
+    if not manifest or manifest.get('objects') != source_objects(source, path):
+        return None  # never built, or the source changed since
+    frames = store.read_days(manifest['days'])
+    if not frames:
+        return None
+    # files from older builds also carry high_value/very_high counts, which nothing reads
+    cells = sort_by_date(concat_frames(frames)).drop(columns=['high_value', 'very_high'], errors='ignore')
+    # reading downcasts small counts; keep the cube's int64 so sums never overflow
+    cells['count'] = cells['count'].astype('int64')
+    cells.attrs['rollup_version'] = snapshot_version(source, sorted(manifest['days'].items()))
+    cells.attrs['source_objects'] = manifest['objects']
+    return cells
+
+
+def rollups_match(cells, df):
+    """Whether rollup cells were built from exactly the source objects df was read from.
+
+    The cells are only rechecked against the source every DATASET_TTL
+    seconds, so a dataset loaded in between can be newer than them. Pruned
+    loads (see source_scope) are compared with the manifest's objects in
+    the same partitions.
+    """
+    digest = df.attrs.get('source_digest')
+    objects = cells.attrs.get('source_objects')
+    if digest is None or objects is None:
+        return False
+    currencies, date_range = df.attrs.get('source_scope', (None, None))
+    if currencies or date_range:
+        objects = {key: etag for key, etag in objects.items() if key_in_partitions(key, currencies, date_range)}
+    return source_digest(objects) == digest
+
+
+def rollup_cells(source='sample', path=SAMPLE_PATH, currencies=None, date_range=None):
+    """The materialized daily cells of a source, or None when missing or stale.
+
+    Rollups are only used while their manifest matches the source's
+    current fingerprints; the check is repeated every DATASET_TTL seconds.
+    """
+    cells = get_dataset_cache().get(('rollups', source, os.path.abspath(path)),
+                                    lambda: _load_rollup_cells(source, path), ttl=DATASET_TTL)
+    if cells is None:
+        return None
+    if date_range:
+        cells = date_slice(cells, date_range)
+    if currencies:
+        cells = cells[cells['currency'].isin(currencies)]
+    return cells
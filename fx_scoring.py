@@ -0,0 +1,211 @@
+"""
+FX Incremental Scoring
+----------------------
+Robust scores for data that arrives piece by piece. amount_usd is
+counted per currency x product_type in log-spaced buckets (a quantile
+sketch in the style of DDSketch): histograms of disjoint rows add up,
+and an object's histogram can be subtracted again, so newly fetched
+objects are scored without rescanning the history. The group median
+and MAD are read off the merged histogram, and rows get the same
+modified z-score as the batch scores in fx_anomalies.
+"""
+
+import os
+
+import numpy as np
+import pandas as pd
+
+# Per-row modified z-score column attached to frames scored as they arrive
+SCORE_COLUMN = 'anomaly_score'
+
+# Peer groups the histograms are kept for
+SCORE_GROUPS = ('currency', 'product_type')
+
+# Relative accuracy of the histograms: an amount is counted in a bucket whose
+# value is within this fraction of it - override with FX_SCORE_ACCURACY
+SCORE_ACCURACY = float(os.environ.get("FX_SCORE_ACCURACY", "0.001"))
+
+# Amounts smaller than this (in magnitude) share the zero bucket
+MIN_AMOUNT = 1e-6
+
+# MAD of a normal distribution is 0.6745 sigma; mean absolute deviation is 0.7979 sigma
+MAD_SCALE = 0.6745
+MEAN_AD_SCALE = 1.253314
+
+_GAMMA = (1 + SCORE_ACCURACY) / (1 - SCORE_ACCURACY)
+_LOG_GAMMA = np.log(_GAMMA)
+# bucket numbers start at 1 for MIN_AMOUNT, negative amounts get negative numbers
+_BUCKET_OFFSET = int(np.ceil(np.log(MIN_AMOUNT) / _LOG_GAMMA)) - 1
+
+
+def amount_buckets(amounts):
+    """Histogram bucket of each amount: 0 for ~zero, +-k for the k-th log-spaced bucket."""
+    magnitude = np.abs(amounts)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        k = np.ceil(np.log(np.maximum(magnitude, MIN_AMOUNT)) / _LOG_GAMMA) - _BUCKET_OFFSET
+    return np.where(magnitude < MIN_AMOUNT, 0, np.sign(amounts) * k).astype(np.int64)
+
+
+def bucket_values(buckets):
+    """The value each bucket stands for (within SCORE_ACCURACY of everything in it)."""
+    buckets = np.asarray(buckets, dtype=np.int64)
+    k = np.abs(buckets) + _BUCKET_OFFSET
+    return np.where(buckets == 0, 0.0, np.sign(buckets) * 2 * _GAMMA ** k / (_GAMMA + 1))
+
+
+def empty_stats():
+    index = pd.MultiIndex.from_arrays([[] for _ in (*SCORE_GROUPS, 'bucket')], names=[*SCORE_GROUPS, 'bucket'])
+    return pd.DataFrame({'n': pd.Series(dtype='float64', index=index)})
+
+
+def group_stats(df):
+    """Row counts of amount_usd per group and bucket, indexed by (*SCORE_GROUPS, bucket)."""
+    amounts = df['amount_usd'].to_numpy(dtype=np.float64, na_value=np.nan)
+    valid = ~np.isnan(amounts)
+    if not valid.all():
+        df, amounts = df[valid], amounts[valid]
+    buckets = pd.Series(amount_buckets(amounts), index=df.index, name='bucket')
+    n = df.groupby([*(df[col] for col in SCORE_GROUPS), buckets], observed=True, dropna=False).size()
+    stats = n.astype('float64').to_frame('n')
+    stats.index = pd.MultiIndex.from_arrays(
+        [stats.index.get_level_values(i).astype(str) for i in range(len(SCORE_GROUPS))]
+        + [stats.index.get_level_values('bucket').astype('int64')], names=[*SCORE_GROUPS, 'bucket']
+    )
+    return stats[stats['n'] > 0]
+
+
+def merge_stats(a, b, remove=False):
+    """Add two histogram frames, or take b back out of a when remove is set."""
+    n = a['n'].sub(b['n'], fill_value=0.0) if remove else a['n'].add(b['n'], fill_value=0.0)
+    return n[n > 0.5].sort_index().to_frame('n')
+
+
+def _ranked(values, counts, groups, ranks):
+    """The value at 0-based rank ranks[g] of each group, from (group, value)-sorted weighted values."""
+    total = np.cumsum(counts)
+    starts = np.r_[0, np.flatnonzero(groups[1:] != groups[:-1]) + 1]
+    before = np.r_[0.0, total][starts]
+    return values[np.searchsorted(total, before + ranks, 'right')]
+
+
+def group_scales(stats):
+    """(median, scale, n) of amount_usd per group, indexed by SCORE_GROUPS.
+
+    Read off the histograms; scale is MAD / 0.6745, or 1.2533 x the mean
+    absolute deviation for groups whose MAD is 0, as in robust_scores.
+    """
+    groups = list(SCORE_GROUPS)
+    if not len(stats):
+        return pd.DataFrame({'median': [], 'scale': [], 'n': []},
+                            index=pd.MultiIndex.from_arrays([[] for _ in groups], names=groups))
+    frame = stats.reset_index()
+    codes, keys = pd.MultiIndex.from_frame(frame[groups]).factorize()
+    values = bucket_values(frame['bucket'].to_numpy())
+    counts = frame['n'].to_numpy()
+    n = np.bincount(codes, weights=counts)
+
+    order = np.lexsort((values, codes))
+    lower, upper = np.floor((n - 1) / 2), np.ceil((n - 1) / 2)
+    sorted_args = (values[order], counts[order], codes[order])
+    median = (_ranked(*sorted_args, lower) + _ranked(*sorted_args, upper)) / 2
+
+    deviation = np.abs(values - median[codes])
+    order = np.lexsort((deviation, codes))
+    sorted_args = (deviation[order], counts[order], codes[order])
+    scale = (_ranked(*sorted_args, lower) + _ranked(*sorted_args, upper)) / 2 / MAD_SCALE
+    flat = scale == 0
+    if flat.any():
+        mean_ad = np.bincount(codes, weights=deviation * counts) / n
+        scale[flat] = mean_ad[flat] * MEAN_AD_SCALE
+    index = pd.MultiIndex.from_tuples(list(keys), names=groups)
+    return pd.DataFrame({'median': median, 'scale': scale, 'n': n}, index=index)
+
+
+def score_rows(df, scales):
+    """float32 modified z-scores of df's rows against group_scales() output.
+
+    NaN for rows whose group has no statistics or fewer than two rows; a
+    group with no spread scores 0 at its median and +-inf elsewhere.
+    """
+    if not len(df) or not len(scales):
+        return np.full(len(df), np.nan, dtype=np.float32)
+    rows = pd.MultiIndex.from_arrays([df[col].astype(str) for col in SCORE_GROUPS], names=SCORE_GROUPS)
+    position = scales.index.get_indexer(rows)
+    median = scales['median'].to_numpy()
+    scale = np.where(scales['n'].to_numpy() < 2, np.nan, scales['scale'].to_numpy())
+    found = position >= 0
+    row_median = np.where(found, median[position], np.nan)
+    row_scale = np.where(found, scale[position], np.nan)
+    deviation = df['amount_usd'].to_numpy(dtype=np.float64, na_value=np.nan) - row_median
+    with np.errstate(divide='ignore', invalid='ignore'):
+        scores = np.where(deviation == 0, 0.0, deviation / row_scale)
+    return scores.astype(np.float32)
+
+
+class IncrementalScorer:
+    """Modified z-scores of amount_usd against running per-group histograms.
+
+    Each object's histogram is kept, so a changed or deleted object is
+    taken back out of the totals without touching the others. Rows are
+    scored once, when their object arrives, against the totals including
+    that object; earlier scores are never recomputed. Rows of a group
+    without enough statistics score NaN, never a default 0.
+    """
+
+    def __init__(self):
+        self.parts = {}  # key -> (etag, stats)
+        self.stats = empty_stats()
+        self._scales = None  # group_scales(self.stats), built on first use
+
+    @staticmethod
+    def can_score(df):
+        return 'amount_usd' in df.columns and all(col in df.columns for col in SCORE_GROUPS)
+
+    def is_current(self, key, etag):
+        return key in self.parts and self.parts[key][0] == etag
+
+    def forget(self, key):
+        part = self.parts.pop(key, None)
+        if part is not None:
+            self.stats = merge_stats(self.stats, part[1], remove=True)
+            self._scales = None
+
+    def update(self, frames):
+        """Add {key: (etag, frame)} to the running statistics, replacing older versions."""
+        for key, (etag, df) in frames.items():
+            self.forget(key)
+            part = group_stats(df)
+            self.parts[key] = (etag, part)
+            self.stats = merge_stats(self.stats, part)
+            self._scales = None
+
+    def with_frames(self, frames):
+        """The running statistics plus {key: (etag, frame)} not yet counted in them.
+
+        For scoring partial reads without adding them to the totals.
+        """
+        stats = self.stats
+        for key, (etag, df) in frames.items():
+            if not self.is_current(key, etag):
+                stats = merge_stats(stats, group_stats(df))
+        return stats
+
+    def score(self, df, stats=None):
+        """float32 modified z-scores of df's rows against stats (default: the running statistics)."""
+        if stats is not None:
+            return score_rows(df, group_scales(stats))
+        if self._scales is None:
+            self._scales = group_scales(self.stats)
+        return score_rows(df, self._scales)
+
+    def state(self):
+        """JSON-serialisable {key: [etag, rows]} for snapshots."""
+        return {key: [etag, stats.reset_index().values.tolist()] for key, (etag, stats) in self.parts.items()}
+
+    def restore(self, key, etag, rows):
+        frame = pd.DataFrame(rows, columns=[*SCORE_GROUPS, 'bucket', 'n'])
+        frame['bucket'] = frame['bucket'].astype('int64')
+        stats = frame.set_index([*SCORE_GROUPS, 'bucket'])[['n']].astype('float64')
+        self.parts[key] = (etag, stats)
+        self.stats = merge_stats(self.stats, stats)
+        self._scales = None
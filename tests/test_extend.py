@@ -0,0 +1,42 @@
+"""Derived structures extended with appended rows match a full rebuild."""
+
+import numpy as np
+
+from fx_aggregates import get_cube, get_top_index
+from fx_anomalies import get_anomaly_scores
+from fx_data import get_filter_index, synthetic_frame
+from fx_scoring import SCORE_COLUMN
+from fx_sketches import get_customer_sketches
+
+GETTERS = (get_filter_index, get_cube, get_top_index, get_anomaly_scores, get_customer_sketches)
+
+
+def _versions(n_old=3000, n_new=500):
+    df = synthetic_frame(n_old + n_new)
+    df[SCORE_COLUMN] = np.random.default_rng(0).normal(size=len(df)).astype(np.float32) * 2
+    old = df.iloc[:n_old].copy()
+    old.attrs = {'dataset_version': 'old'}
+    new = df.copy()
+    new.attrs = {'dataset_version': 'new', 'extends': ('old', n_old)}
+    rebuilt = df.copy()
+    rebuilt.attrs = {'dataset_version': 'rebuilt'}
+    for getter in GETTERS:
+        getter(old)
+    return new, rebuilt
+
+
+def test_extended_structures_match_rebuild():
+    new, rebuilt = _versions()
+    index, full = get_filter_index(new), get_filter_index(rebuilt)
+    for col, bitmaps in full.bitmaps.items():
+        assert bitmaps.keys() == index.bitmaps[col].keys()
+        assert all(np.array_equal(bitmaps[value], index.bitmaps[col][value]) for value in bitmaps)
+
+    assert get_cube(new).cells.equals(get_cube(rebuilt).cells)
+    for equals in ({}, {'currency': 'EUR'}, {'channel': 'ATM', 'product_type': 'FOREX'}):
+        assert get_top_index(new).top(new, **equals).equals(get_top_index(rebuilt).top(rebuilt, **equals))
+        assert np.array_equal(get_customer_sketches(new).merged(**equals),
+                              get_customer_sketches(rebuilt).merged(**equals))
+
+    extended, scores = get_anomaly_scores(new).summarize(), get_anomaly_scores(rebuilt).summarize()
+    assert extended[:2] == scores[:2] and extended[2].equals(scores[2])
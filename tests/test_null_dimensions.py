@@ -0,0 +1,43 @@
+"""Rows with null dimension values must be kept, scored and counted."""
+
+import numpy as np
+import pytest
+
+from fx_aggregates import view_rollups
+from fx_anomalies import ANOMALY_THRESHOLD, AnomalyScores
+from fx_data import prepare_frame, sort_by_date, synthetic_frame
+from fx_sketches import CustomerSketches, estimate, hash_values, register_updates
+
+
+@pytest.fixture
+def frame():
+    df = synthetic_frame(2000)
+    df.loc[df.index[::20], 'currency'] = None
+    df.loc[df.index[5::30], 'product_type'] = None
+    return sort_by_date(prepare_frame(df))
+
+
+def test_anomaly_scores_with_null_dimensions(frame):
+    scores = AnomalyScores(frame)
+    assert len(scores.scores) == len(frame)
+    assert (scores.codes >= 0).all()
+    flagged, severe, by_group = scores.summarize()
+    assert flagged == int((np.abs(scores.scores) > ANOMALY_THRESHOLD).sum())
+    assert severe <= flagged
+    assert by_group['flagged'].sum() == flagged
+
+
+def test_view_with_null_dimensions(frame):
+    agg = view_rollups(frame)
+    assert agg.count == len(frame)
+    assert agg.anomalies is not None
+    assert agg.by('currency')['count'].sum() == len(frame)
+
+
+def test_customer_sketches_with_null_dimensions(frame):
+    sketches = CustomerSketches(frame)
+    index, rank = register_updates(hash_values(frame['customer_id'].to_numpy()))
+    registers = np.zeros(len(sketches.merged()), dtype=np.uint8)
+    np.maximum.at(registers, index, rank)
+    assert (sketches.merged() == registers).all()
+    assert sketches.distinct() == int(round(estimate(registers)))
@@ -0,0 +1,35 @@
+"""Materialized rollups are only used for the exact source files a dataset was read from."""
+
+from fx_aggregates import build_cells, get_cube
+from fx_data import load_dataset, synthetic_frame
+from fx_rollups import RollupStore, rollup_cells, source_objects
+
+
+def _write_rollups(path, df):
+    store = RollupStore.for_source('sample', path)
+    days = {}
+    for day, cells in build_cells(df).groupby('txn_date', observed=True):
+        day = str(day.date())
+        store.write_day(day, cells.reset_index(drop=True))
+        days[day] = day
+    store.write_manifest({'objects': source_objects('sample', path), 'bounds': {}, 'days': days})
+
+
+def test_cube_uses_current_rollups(tmp_path):
+    path = str(tmp_path / 'sample.parquet')
+    synthetic_frame(1000).to_parquet(path, index=False)
+    df = load_dataset('sample', path=path)
+    _write_rollups(path, df)
+    assert rollup_cells('sample', path) is not None
+    assert get_cube(df).cells['count'].sum() == len(df)
+
+
+def test_cube_ignores_rollups_of_an_older_file(tmp_path):
+    path = str(tmp_path / 'sample.parquet')
+    synthetic_frame(1000).to_parquet(path, index=False)
+    _write_rollups(path, load_dataset('sample', path=path))
+    assert rollup_cells('sample', path) is not None  # cached until DATASET_TTL
+
+    synthetic_frame(3000).to_parquet(path, index=False)
+    df = load_dataset('sample', path=path)
+    assert get_cube(df).cells['count'].sum() == len(df) == 3000
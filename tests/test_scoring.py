@@ -0,0 +1,48 @@
+"""Incremental (quantile sketch) scores and their fallback to batch scores."""
+
+import numpy as np
+import pandas as pd
+
+from fx_anomalies import AnomalyScores
+from fx_data import prepare_frame, synthetic_frame
+from fx_scoring import SCORE_COLUMN, IncrementalScorer, group_stats
+
+
+def test_merged_stats_match_one_pass():
+    df = prepare_frame(synthetic_frame(3000))
+    scorer = IncrementalScorer()
+    scorer.update({'a': ('1', df.iloc[:1000]), 'b': ('1', df.iloc[1000:])})
+    expected = group_stats(df).reindex(scorer.stats.index)
+    assert np.allclose(scorer.stats.to_numpy(), expected.to_numpy())
+    scorer.forget('b')
+    expected = group_stats(df.iloc[:1000]).reindex(scorer.stats.index)
+    assert np.allclose(scorer.stats.to_numpy(), expected.to_numpy())
+
+
+def test_unknown_groups_fall_back_to_batch_scores():
+    df = prepare_frame(synthetic_frame(3000))
+    seen = df[df['currency'] != 'EUR']
+    scorer = IncrementalScorer()
+    scorer.update({'seen': ('1', seen)})
+    scores = scorer.score(df)
+    assert np.isnan(scores[(df['currency'] == 'EUR').to_numpy()]).all()
+    assert not np.isnan(scores[(df['currency'] != 'EUR').to_numpy()]).any()
+
+    mixed = AnomalyScores(df.assign(**{SCORE_COLUMN: scores}))
+    robust = AnomalyScores(df)
+    eur = (df['currency'] == 'EUR').to_numpy()
+    assert mixed.method == 'mixed'
+    assert np.array_equal(mixed.scores[eur], robust.scores[eur])
+    assert np.array_equal(mixed.scores[~eur], scores[~eur])
+    assert pd.notna(mixed.scores).all()
+
+
+def test_sketched_scores_flag_like_batch_scores():
+    df = prepare_frame(synthetic_frame(3000))
+    scorer = IncrementalScorer()
+    scorer.update({str(i): ('1', df.iloc[i::3]) for i in range(3)})
+    sketched = AnomalyScores(df.assign(**{SCORE_COLUMN: scorer.score(df)}))
+    robust = AnomalyScores(df)
+    assert sketched.method == 'sketch'
+    assert np.array_equal(sketched.flagged, robust.flagged)
+    assert np.allclose(sketched.scores, robust.scores, rtol=0.01, atol=0.05)
@@ -0,0 +1,51 @@
+"""Streamed rollups agree with the loaded dataset's, anomalies and bursts included."""
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from fx_aggregates import BURST_DIMENSIONS, build_cells, date_chunks, stream_rollups, view_rollups
+from fx_anomalies import StreamedBursts, VelocityBursts
+from fx_data import load_dataset, sort_by_date, synthetic_frame
+
+
+@pytest.mark.parametrize('date_range, equals', [
+    (None, {}),
+    (None, {'currency': 'USD'}),
+    (('2025-10-01', '2025-10-31'), {'product_type': 'SUBSCRIPTION'}),
+])
+def test_streamed_anomalies_match_loaded(date_range, equals):
+    streamed = stream_rollups('sample', date_range, **equals)
+    loaded = view_rollups(load_dataset('sample'), date_range, **equals)
+    assert streamed.anomaly_method == 'sketch' and loaded.anomaly_method == 'robust'
+    assert (streamed.count, streamed.anomalies, streamed.severe_anomalies) == \
+        (loaded.count, loaded.anomalies, loaded.severe_anomalies)
+    by_group = {(g.currency, g.product_type): g.flagged for g in streamed.anomaly_groups.itertuples()}
+    assert by_group == {(str(g.currency), str(g.product_type)): g.flagged for g in loaded.anomaly_groups.itertuples()}
+
+
+def test_chunked_bursts_match_loaded():
+    df = synthetic_frame(4000)
+    rng = np.random.default_rng(1)
+    df['customer_id'] = df['customer_id'].astype(str).str[:-1]  # fewer customers, so windows hit
+    df['txn_ts'] = df['txn_date'] + pd.to_timedelta(rng.integers(0, 86400, len(df)), unit='s')
+    df = sort_by_date(df)
+    loaded = VelocityBursts(df)
+
+    streamed = StreamedBursts(BURST_DIMENSIONS)
+    chunks = date_chunks(build_cells(df), max_rows=150)
+    for i, (first, last) in enumerate(chunks):
+        streamed.add(df[(df['txn_date'] >= first) & (df['txn_date'] <= last)],
+                     chunks[i + 1][0] if i + 1 < len(chunks) else None)
+    streamed.finish()
+
+    assert len(chunks) > 20 and loaded.burst.any()
+    for date_range, equals in [(None, {}), (('2025-10-01', '2025-10-31'), {'channel': 'ATM'})]:
+        mask = np.ones(len(df), dtype=bool)
+        if date_range:
+            mask &= ((df['txn_date'] >= date_range[0]) & (df['txn_date'] <= date_range[1])).to_numpy()
+        for col, value in equals.items():
+            mask &= (df[col] == value).to_numpy()
+        expected, actual = loaded.summarize(mask=mask), streamed.summarize(date_range, **equals)
+        assert expected[:2] == actual[:2]
+        assert expected[2]['customer_id'].tolist() == actual[2]['customer_id'].tolist()